@@ -0,0 +1,249 @@
+"""
+Benchmarks of the hot paths of testly
+
+Run the benchmarks, and save the results as json:
+	python benchmarks/bench.py run --output results.json [--quick] [--filter cdiff]
+Compare the results of two runs, and fail if any benchmark is slower than the threshold:
+	python benchmarks/bench.py compare base.json results.json --threshold 0.1
+"""
+import os, sys, json, fnmatch, argparse, platform, subprocess
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import testly
+from testly import TestCase, MetaTestCase
+from testly.cdiff import CDiff
+from testly import benchmark as testlyBenchmark
+
+# the minimum time of a measurement, the number of calls is increased until reaching it
+MIN_TIME   = .2
+REPEAT     = 5
+MAX_NUMBER = 1 << 20
+BENCHMARKS = []
+
+def benchmark(name, quick = True):
+	"""
+	Register a benchmark. The function sets things up and returns the function to time.
+	@params:
+		`name` : The name of the benchmark
+		`quick`: Whether to run it with `--quick`
+	"""
+	def decorator(func):
+		BENCHMARKS.append((name, func, quick))
+		return func
+	return decorator
+
+def measure(func, mintime = MIN_TIME, repeat = REPEAT):
+	"""
+	Time a function `repeat` times, each time with the number of calls that takes at least `mintime`,
+	see `testly.benchmark.measure`. A mintime of 0 times a single call, without warmup.
+	@returns:
+		A dict of the min, median, mean and stddev time per call, the number of calls and the repeat
+	"""
+	stats = testlyBenchmark.measure(func, warmup = 1 if mintime else 0, mintime = mintime,
+		rounds = repeat, maxtime = float('inf'), maxnumber = MAX_NUMBER)
+	ret = dict(stats)
+	ret['repeat'] = ret.pop('rounds')
+	return ret
+
+def _createClass(nrows):
+	def dataProvider_test(self):
+		for i in range(nrows):
+			yield i, i
+	def test(self, a, b):
+		pass
+	return MetaTestCase('BenchTest', (TestCase, ), dict(
+		__module__ = __name__, dataProvider_test = dataProvider_test, test = test))
+
+def _failure(func, *args):
+	def run():
+		try:
+			func(*args)
+		except AssertionError as ex:
+			return str(ex)
+	return run
+
+class _Case(TestCase):
+	diffColor = False
+	def runTest(self):
+		pass
+
+@benchmark('meta.rows10')
+def metaRows10():
+	return lambda: _createClass(10)
+
+@benchmark('meta.rows10k')
+def metaRows10k():
+	return lambda: _createClass(10000)
+
+@benchmark('meta.rows1m', quick = False)
+def metaRows1m():
+	return lambda: _createClass(1000000)
+
+@benchmark('lookup.setName')
+def lookupSetName():
+	test = _createClass(10000)('test-5000')
+	return test.setName
+
+@benchmark('lookup.isFirst')
+def lookupIsFirst():
+	test = _createClass(10000)('test-5000')
+	return test.isFirst
+
+def _lines(n, width, seed):
+	return ['%s line %s %s' % (seed if i % 7 == 0 else 'same', i, 'x' * width) for i in range(n)]
+
+@benchmark('cdiff.small')
+def cdiffSmall():
+	a, b = _lines(10, 10, 'a'), _lines(10, 10, 'b')
+	return lambda: list(CDiff(color = False).diff(a, b, cwidth = 160))
+
+@benchmark('cdiff.longline')
+def cdiffLongLine():
+	a, b = _lines(50, 2000, 'a'), _lines(50, 2000, 'b')
+	return lambda: list(CDiff(color = False).diff(a, b, cwidth = 160))
+
+@benchmark('cdiff.huge')
+def cdiffHuge():
+	a, b = _lines(20000, 20, 'a'), _lines(20000, 20, 'b')
+	return lambda: list(CDiff(color = False).diff(a, b, cwidth = 160, maxsize = 5000))
+
+@benchmark('assert.dictEqual')
+def assertDictEqual():
+	case = _Case()
+	a = dict(('key%s' % i, dict(value = i, items = list(range(10)))) for i in range(1000))
+	b = dict(('key%s' % i, dict(value = i + (i % 50 == 0), items = list(range(10)))) for i in range(1000))
+	return _failure(case.assertDictEqual, a, b)
+
+@benchmark('assert.sequenceEqual')
+def assertSequenceEqual():
+	case = _Case()
+	a = list(range(10000))
+	b = [i + (i % 500 == 0) for i in range(10000)]
+	return _failure(case.assertSequenceEqual, a, b)
+
+@benchmark('assert.dictContains')
+def assertDictContains():
+	case = _Case()
+	a = dict(('key%s' % i, i) for i in range(0, 10000, 2))
+	b = dict(('key%s' % i, i) for i in range(10000))
+	return lambda: case.assertDictContains(a, b)
+
+@benchmark('assert.seqContains')
+def assertSeqContains():
+	case = _Case()
+	a = list(range(0, 10000, 2))
+	b = list(range(10000))
+	return lambda: case.assertSeqContains(a, b)
+
+@benchmark('assert.inAny')
+def assertInAny():
+	case  = _Case()
+	lines = ['line %s' % i for i in range(10000)]
+	return lambda: case.assertInAny('line 9999', lines)
+
+@benchmark('assert.regexAny')
+def assertRegexAny():
+	case  = _Case()
+	lines = ['line %s' % i for i in range(10000)]
+	return lambda: case.assertRegexAny([r'^line 99\d\d$', r'^line 5000$', r'^line 1$'], lines)
+
+@benchmark('assert.notRegexAny')
+def assertNotRegexAny():
+	case  = _Case()
+	lines = ['line %s' % i for i in range(10000)]
+	return lambda: case.assertNotRegexAny([r'cat', r'dog\d+'], lines)
+
+def _importer(modules):
+	# a fresh interpreter each time, as the modules are cached once imported
+	command = [sys.executable, '-c', 'import %s' % modules]
+	return lambda: subprocess.check_call(command, cwd = ROOT)
+
+@benchmark('import.unittest')
+def importUnittest():
+	"""The startup of the interpreter with unittest, which import.testly is compared with"""
+	return _importer('unittest')
+
+@benchmark('import.testly')
+def importTestly():
+	return _importer('testly')
+
+def run(args):
+	results = {}
+	for name, func, quick in BENCHMARKS:
+		if args.quick and not quick or args.filter and not fnmatch.fnmatch(name, args.filter):
+			continue
+		# the slow ones are only timed once
+		results[name] = measure(func(), repeat = args.repeat) if quick else measure(func(), 0, 1)
+		sys.stderr.write('%-24s %10.3es min %10.3es median (%s x %s calls)\n' % (
+			name, results[name]['min'], results[name]['median'], results[name]['repeat'], results[name]['number']))
+	report = dict(
+		testly     = testly.VERSION,
+		python     = platform.python_version(),
+		platform   = platform.platform(),
+		benchmarks = results)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent = 1, sort_keys = True)
+	else:
+		json.dump(report, sys.stdout, indent = 1, sort_keys = True)
+		sys.stdout.write('\n')
+	return 0
+
+def compare(base, results, threshold, metric = 'min'):
+	"""
+	Compare the results of two runs.
+	@params:
+		`base`     : The results of the base run
+		`results`  : The results of the new run
+		`threshold`: The ratio of slowdown to tolerate, i.e. 0.1 for 10%
+		`metric`   : The metric to compare, `min` or `median`
+	@returns:
+		A list of (name, base time, new time, ratio, regressed)
+	"""
+	ret = []
+	for name in sorted(results['benchmarks']):
+		if name not in base['benchmarks']:
+			continue
+		old   = base['benchmarks'][name][metric]
+		new   = results['benchmarks'][name][metric]
+		ratio = new / old if old else float('inf')
+		ret.append((name, old, new, ratio, ratio > 1 + threshold))
+	return ret
+
+def compareCommand(args):
+	with open(args.base) as f:
+		base = json.load(f)
+	with open(args.results) as f:
+		results = json.load(f)
+	regressed = False
+	for name, old, new, ratio, slower in compare(base, results, args.threshold, args.metric):
+		regressed = regressed or slower
+		sys.stdout.write('%-24s %10.3es -> %10.3es %7.2fx%s\n' % (
+			name, old, new, ratio, '  REGRESSED' if slower else ''))
+	return 1 if regressed else 0
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Benchmarks of testly.')
+	commands = parser.add_subparsers(dest = 'command')
+	runParser = commands.add_parser('run', help = 'Run the benchmarks')
+	runParser.add_argument('--output', help = 'Write the results to this json file instead of stdout')
+	runParser.add_argument('--quick', action = 'store_true', help = 'Skip the slow benchmarks')
+	runParser.add_argument('--filter', help = 'Only run the benchmarks matching this glob pattern')
+	runParser.add_argument('--repeat', type = int, default = REPEAT, help = 'Times to repeat each measurement')
+	compareParser = commands.add_parser('compare', help = 'Compare the results of two runs')
+	compareParser.add_argument('base', help = 'The json file of the base results')
+	compareParser.add_argument('results', help = 'The json file of the new results')
+	compareParser.add_argument('--threshold', type = float, default = .1,
+		help = 'Fail if a benchmark is slower than this ratio (default: 0.1 for 10%%)')
+	compareParser.add_argument('--metric', choices = ['min', 'median'], default = 'min',
+		help = 'The time to compare (default: min, which is the least noisy)')
+	args = parser.parse_args(argv)
+	if args.command == 'compare':
+		return compareCommand(args)
+	if args.command == 'run':
+		return run(args)
+	parser.print_help()
+	return 2
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,6 +1,61 @@
-import sys, logging
-from testly import Data, Box, TestSet, TestCase, main
+import os, sys, json, time, shutil, logging, tempfile, unittest, itertools, subprocess
+from testly import Data, Box, TestSet, TestCase, TestLoader, LazyTestSet, LazyTestSuite, lazyProvider, concurrent, main
+from testly.cdiff import CDiff, FastEngine, DifflibEngine, MISSING, structDiff, Theme, Renderer, AnsiRenderer, PlainRenderer, HtmlRenderer, getRenderer, toSegments
+from testly.result import RecordingResult, TextTestRunner, replay
+from testly.parallel import ParallelSuite, shardTests
+from testly.reporters import JsonLinesReporter, JUnitXmlReporter
+from testly.cache import ResultCache, testKey, cachedProvider
+from testly.benchmark import measure, getStore
+from testly.sizes import parseSize, formatSize
+from testly.profiler import Profiler, CProfiler, SamplingProfiler
+from testly.shard import parseShard, loadDurations, units, assign, selectShard
 from collections import OrderedDict
+from os import path, remove
+from six import StringIO, moves
+
+class ParallelSample(TestCase):
+	# methods are not prefixed with "test", so they are only run by TestParallel
+
+	@classmethod
+	def setUpClass(cls):
+		cls.firsts = 0
+
+	def setUp(self):
+		if self.isFirst():
+			self.__class__.firsts += 1
+
+	def dataProvider_sample(self):
+		for i in range(6):
+			yield i, i
+
+	def sample(self, in_, out):
+		self.assertEqual(in_, out)
+		self.assertEqual(self.__class__.firsts, 1)
+
+	@lazyProvider
+	def dataProvider_sampleLazy(self):
+		for i in range(6):
+			yield i, i
+
+	def sampleLazy(self, in_, out):
+		self.assertEqual(in_, out)
+
+	def dataProvider_sampleSlow(self):
+		yield .02,
+		yield 0,
+
+	def sampleSlow(self, seconds):
+		time.sleep(seconds)
+
+	def sampleFail(self):
+		self.assertEqual(1, 2)
+
+	def sampleError(self):
+		raise ValueError('sample error')
+
+	def sampleDiff(self):
+		self.diffColor = True
+		self.assertEqual('a\nb', 'a\nc')
 
 class TestOther(TestCase):
 
@@ -61,8 +116,1052 @@ class TestOther(TestCase):
 		self.assertFalse(ts.isLast('test1'))
 		self.assertTrue(ts.isLast('test2'))
 
+		# index
+		self.assertEqual(ts.index('test2'), 1)
+		self.assertEqual(ts.index('test3'), -1)
+		ts.tests = ['test2']
+		self.assertEqual(ts.index('test2'), 0)
+		self.assertEqual(ts.index('test1'), -1)
+		self.assertTrue(ts.isFirst('test2'))
+		self.assertTrue(ts.isLast('test2'))
+
+	def testSetOfTest(self):
+		test = ParallelSample('sample-3')
+		self.assertEqual(test.setName(), 'sample')
+		self.assertTrue(test.isOfSet())
+		self.assertFalse(test.isFirst())
+		self.assertFalse(ParallelSample('sampleFail').isOfSet())
+		self.assertEqual(ParallelSample('sampleFail').setName(), 'sampleFail')
+
+		tests = ParallelSample.sample.tests
+		ParallelSample.sample.tests = ['sample-3']
+		try:
+			self.assertEqual(test.setName(), 'sample')
+			self.assertTrue(test.isFirst())
+			self.assertTrue(test.isLast())
+			self.assertFalse(ParallelSample('sample-0').isFirst())
+		finally:
+			ParallelSample.sample.tests = tests
+
+		# test sets are inherited
+		class SubSample(ParallelSample):
+			pass
+		test = SubSample('sample-5')
+		self.assertEqual(test.setName(), 'sample')
+		self.assertTrue(test.isLast())
+
+LAZY_ROWS = []
+
+class TestLazy(TestCase):
+
+	@lazyProvider
+	def dataProvider_testLazy(self):
+		del LAZY_ROWS[:]
+		for i in range(4):
+			LAZY_ROWS.append(i)
+			yield i, i * i
+
+	def testLazy(self, i, square):
+		# the rows are not expanded in advance, only one row ahead
+		self.assertLessEqual(len(LAZY_ROWS), i + 2)
+		self.assertEqual(square, i * i)
+		self.assertEqual(self.setName(), 'testLazy')
+		self.assertTrue(self.isOfSet())
+		self.assertEqual(self.isFirst(), i == 0)
+		self.assertEqual(self.isLast(), i == 3)
+
+	def testNotExpanded(self):
+		self.assertIsInstance(TestLazy.testLazy, LazyTestSet)
+		self.assertFalse(hasattr(TestLazy, 'testLazy-0'))
+
+	def dataProvider_testLoad(self):
+		yield 'TestLazy', 10, ['testLazy-0', 'testLazy-1', 'testLazy-2', 'testLazy-3']
+		yield 'TestLazy.testLazy', 4, ['testLazy-0', 'testLazy-1', 'testLazy-2', 'testLazy-3']
+		yield 'TestLazy.testLazy-2', 1, ['testLazy-2']
+
+	def testLoad(self, name, count, names):
+		suite = TestLoader().loadTestsFromName(name, sys.modules[__name__])
+		self.assertEqual(suite.countTestCases(), count)
+		lazy = suite if isinstance(suite, LazyTestSuite) else list(suite)[-1]
+		self.assertEqual([test._testMethodName for test in lazy], names)
+
+	def testLoadPrefix(self):
+		# the lazy test sets not prefixed with "test" are not loaded, unless named
+		suite = TestLoader().loadTestsFromName('SetSample', sys.modules[__name__])
+		self.assertEqual(suite.countTestCases(), 0)
+		self.assertFalse([test for test in suite if isinstance(test, LazyTestSuite)])
+		loader = TestLoader()
+		loader.testMethodPrefix = 'sampleLazy'
+		self.assertEqual(loader.loadTestsFromName('SetSample', sys.modules[__name__]).countTestCases(), 3)
+		self.assertEqual(TestLoader().loadTestsFromName('SetSample.sampleLazy', sys.modules[__name__]).countTestCases(), 3)
+
+	def testSingleRow(self):
+		test = list(LazyTestSuite(TestLazy, TestLazy.testLazy, [2]))[0]
+		self.assertTrue(test.isFirst())
+		self.assertTrue(test.isLast())
+
+SET_LOG = []
+
+class SetSample(TestCase):
+	# methods are not prefixed with "test", so they are only run by TestSetHooks
+
+	def setUpSet(self, name):
+		SET_LOG.append(('setUpSet', name))
+		if name == 'sampleBroken':
+			raise ValueError('broken set')
+		self.setContext.rows = []
+
+	def tearDownSet(self, name):
+		SET_LOG.append(('tearDownSet', name, self.setContext.rows))
+
+	def dataProvider_sample(self):
+		for i in range(3):
+			yield i,
+
+	def sample(self, i):
+		self.setContext.rows.append(i)
+
+	@lazyProvider
+	def dataProvider_sampleLazy(self):
+		for i in range(3):
+			yield i,
+
+	def sampleLazy(self, i):
+		self.setContext.rows.append(i)
+
+	def dataProvider_sampleBroken(self):
+		yield 1,
+		yield 2,
+
+	def sampleBroken(self, i):
+		SET_LOG.append(('sampleBroken', i))
+
+	def sampleAlone(self):
+		self.assertIsNone(self.setContext)
+
+class TestSetHooks(TestCase):
+
+	def setUp(self):
+		del SET_LOG[:]
+
+	def dataProvider_testRun(self):
+		yield ['sample-0', 'sample-1', 'sample-2', 'sampleAlone'], 0, [
+			('setUpSet', 'sample'), ('tearDownSet', 'sample', [0, 1, 2])]
+		yield ['sample-1', 'sample-0', 'sampleAlone', 'sample-2'], 0, [
+			('setUpSet', 'sample'), ('tearDownSet', 'sample', [1, 0]),
+			('setUpSet', 'sample'), ('tearDownSet', 'sample', [2])]
+		yield ['sampleBroken-0', 'sampleBroken-1', 'sample-0'], 1, [
+			('setUpSet', 'sampleBroken'), ('setUpSet', 'sample'), ('tearDownSet', 'sample', [0])]
+
+	def testRun(self, names, errors, log):
+		result = unittest.TestResult()
+		TestLoader.suiteClass([SetSample(name) for name in names]).run(result)
+		self.assertEqual(len(result.errors), errors)
+		self.assertEqual(result.failures, [])
+		self.assertEqual(SET_LOG, log)
+		if errors:
+			self.assertEqual(str(result.errors[0][0]), 'setUpSet (%s.SetSample.sampleBroken)' % __name__)
+			self.assertIn('ValueError: broken set', result.errors[0][1])
+			# the rows of the broken set are not run, but the class is not marked as failed
+			self.assertEqual(result.testsRun, 1)
+			self.assertFalse(SetSample._classSetupFailed)
+
+	def testRunLazy(self):
+		result = unittest.TestResult()
+		TestLoader.suiteClass([LazyTestSuite(SetSample, SetSample.sampleLazy)]).run(result)
+		self.assertTrue(result.wasSuccessful())
+		self.assertEqual(result.testsRun, 3)
+		self.assertEqual(SET_LOG, [('setUpSet', 'sampleLazy'), ('tearDownSet', 'sampleLazy', [0, 1, 2])])
+
+	def testRunParallel(self):
+		result = unittest.TestResult()
+		ParallelSuite([SetSample('sample-%s' % i) for i in range(3)], workers = 2).run(result)
+		self.assertTrue(result.wasSuccessful())
+		self.assertEqual(result.testsRun, 3)
+
+class ConcurrentSample(TestCase):
+	# methods are not prefixed with "test", so they are only run by TestConcurrency
+	diffColor = False
+
+	def setUp(self):
+		CONCURRENT_LOG.append(('setUp', self._testMethodName, self.isFirst(), self.isLast()))
+
+	def dataProvider_sample(self):
+		for i in range(6):
+			yield i,
+
+	@concurrent(4)
+	def sample(self, i):
+		time.sleep(.1)
+		CONCURRENT_LOG.append(('done', i))
+		self.assertEqual('row\n%s' % i, 'row\n3')
+
+	def dataProvider_sampleSerial(self):
+		yield 1,
+		yield 2,
+		yield 3,
+
+	def sampleSerial(self, i):
+		CONCURRENT_LOG.append(('done', i))
+
+	def dataProvider_sampleOutput(self):
+		for i in range(6):
+			yield i,
+
+	@concurrent(2)
+	def sampleOutput(self, i):
+		# row 2 fails while row 1 still runs
+		time.sleep(.1 if i == 1 else 0)
+		sys.stdout.write('row %s\n' % i)
+		CONCURRENT_LOG.append(('done', i))
+		self.assertNotEqual(i, 2)
+
+CONCURRENT_LOG = []
+
+class TestConcurrency(TestCase):
+
+	def setUp(self):
+		del CONCURRENT_LOG[:]
+
+	def testRun(self):
+		stream  = StringIO()
+		result  = unittest.TextTestResult(unittest.runner._WritelnDecorator(stream), True, 2)
+		started = time.time()
+		TestLoader().loadTestsFromName('ConcurrentSample.sample', sys.modules[__name__]).run(result)
+		# the 4 rows in the middle overlap
+		self.assertLess(time.time() - started, .5)
+		self.assertEqual(result.testsRun, 6)
+		# the first and the last rows run alone
+		self.assertEqual(CONCURRENT_LOG[:2], [('setUp', 'sample-0', True, False), ('done', 0)])
+		self.assertEqual(CONCURRENT_LOG[-2:], [('setUp', 'sample-5', False, True), ('done', 5)])
+		self.assertEqual(sorted(CONCURRENT_LOG[2:-2]),
+			[('done', i) for i in range(1, 5)] + [('setUp', 'sample-%s' % i, False, False) for i in range(1, 5)])
+		# the results and the diffs are reported in order
+		lines = [line.split(' ')[0] for line in stream.getvalue().splitlines() if ' ... ' in line]
+		self.assertEqual(lines, ['sample-%s' % i for i in range(6)])
+		self.assertEqual(len(result.failures), 5)
+		for i, (test, text) in enumerate(result.failures):
+			row = i if i < 3 else i + 1
+			self.assertEqual(test.id(), '%s.ConcurrentSample.sample-%s' % (__name__, row))
+			# the diff of the row
+			self.assertIn('2. %s ' % row, text)
+
+	def testSerial(self):
+		result = unittest.TestResult()
+		TestLoader().loadTestsFromName('ConcurrentSample.sampleSerial', sys.modules[__name__]).run(result)
+		self.assertTrue(result.wasSuccessful())
+		self.assertEqual([item for item in CONCURRENT_LOG if item[0] == 'done'], [('done', 1), ('done', 2), ('done', 3)])
+
+	@staticmethod
+	def _runOutput(failfast):
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			result = unittest.TestResult()
+			result.buffer   = True
+			result.failfast = failfast
+			TestLoader().loadTestsFromName('ConcurrentSample.sampleOutput', sys.modules[__name__]).run(result)
+			return result, sys.stdout.getvalue()
+		finally:
+			sys.stdout = stdout
+
+	def testBuffer(self):
+		result, output = self._runOutput(False)
+		self.assertEqual(result.testsRun, 6)
+		# only the output of the failing row is shown
+		self.assertEqual(output, 'row 2\n')
+		self.assertIn('row 2', result.failures[0][1])
+
+	def testFailfast(self):
+		result, _ = self._runOutput(True)
+		self.assertEqual(len(result.failures), 1)
+		# no more rows are started once row 2 fails
+		self.assertEqual(sorted(item for item in CONCURRENT_LOG if item[0] == 'done'), [('done', 0), ('done', 1), ('done', 2)])
+
+# async def is a syntax error before python 3.5 (async generators: 3.6)
+ASYNC_SAMPLE = """
+import asyncio
+
+class AsyncSample(TestCase):
+	concurrency = 4
+
+	async def sampleAsync(self):
+		await asyncio.sleep(0)
+		ASYNC_LOG.append(asyncio.get_event_loop())
+
+	async def dataProvider_sampleRows(self):
+		for i in range(6):
+			await asyncio.sleep(0)
+			yield i,
+
+	async def sampleRows(self, i):
+		ASYNC_LOG.append(('start', i))
+		await asyncio.sleep(.1)
+		ASYNC_LOG.append(asyncio.get_event_loop())
+		self.assertNotEqual(i, 3)
+
+	@lazyProvider
+	async def dataProvider_sampleLazy(self):
+		for i in range(3):
+			await asyncio.sleep(0)
+			ASYNC_LOG.append(asyncio.get_event_loop())
+			yield i,
+
+	async def sampleLazy(self, i):
+		ASYNC_LOG.append(asyncio.get_event_loop())
+"""
+ASYNC_LOG = []
+if sys.version_info >= (3, 6):
+	exec(ASYNC_SAMPLE)
+
+@unittest.skipIf(sys.version_info < (3, 6), 'async generators require python 3.6+')
+class TestAsync(TestCase):
+
+	def setUp(self):
+		del ASYNC_LOG[:]
+
+	def testAsyncMethods(self):
+		result = unittest.TestResult()
+		TestLoader.suiteClass([AsyncSample('sampleAsync'), AsyncSample('sampleAsync')]).run(result)
+		self.assertTrue(result.wasSuccessful())
+		self.assertEqual(len(ASYNC_LOG), 2)
+		# one loop for the class, closed after it
+		self.assertIs(ASYNC_LOG[0], ASYNC_LOG[1])
+		self.assertTrue(ASYNC_LOG[0].is_closed())
+
+	def testConcurrentRows(self):
+		stream = StringIO()
+		result = unittest.TextTestResult(unittest.runner._WritelnDecorator(stream), True, 2)
+		started = time.time()
+		TestLoader().loadTestsFromName('AsyncSample.sampleRows', sys.modules[__name__]).run(result)
+		# the 4 rows in the middle overlap
+		self.assertLess(time.time() - started, .5)
+		self.assertEqual(result.testsRun, 6)
+		self.assertEqual([test.id() for test, _ in result.failures], ['%s.AsyncSample.sampleRows-3' % __name__])
+		# the first and the last rows run alone
+		starts = [item for item in ASYNC_LOG if isinstance(item, tuple)]
+		self.assertEqual(starts[0], ('start', 0))
+		self.assertEqual(sorted(starts[1:5]), [('start', i) for i in range(1, 5)])
+		self.assertEqual(starts[5], ('start', 5))
+		loops = set(item for item in ASYNC_LOG if not isinstance(item, tuple))
+		self.assertEqual(len(loops), 1)
+		# reported in order
+		lines = [line.split(' ')[0] for line in stream.getvalue().splitlines() if ' ... ' in line]
+		self.assertEqual(lines, ['sampleRows-%s' % i for i in range(6)])
+
+	def testLazyRows(self):
+		result = unittest.TestResult()
+		TestLoader.suiteClass([LazyTestSuite(AsyncSample, AsyncSample.sampleLazy)]).run(result)
+		self.assertTrue(result.wasSuccessful())
+		self.assertEqual(result.testsRun, 3)
+		self.assertEqual(len(ASYNC_LOG), 6)
+		self.assertEqual(len(set(ASYNC_LOG)), 1)
+
+class TestParallel(TestCase):
+
+	def _suite(self, names):
+		return unittest.TestSuite([ParallelSample(name) for name in names])
+
+	def dataProvider_testShard(self):
+		names = ['sample-%s' % i for i in range(6)]
+		yield names + ['sampleFail'], 2, False, [names, ['sampleFail']]
+		yield names, 2, True, [names[:3], names[3:]]
+		yield names[:2], 4, True, [names[:1], names[1:2]]
+
+	def testShard(self, names, workers, splitSets, shards):
+		ret, local = shardTests(self._suite(names), workers, splitSets)
+		self.assertEqual(local, [])
+		self.assertEqual([shard[2] for shard in ret], shards)
+		self.assertEqual(set(shard[1] for shard in ret), {'ParallelSample'})
+
+	def dataProvider_testRun(self):
+		names = ['sample-%s' % i for i in range(6)]
+		yield names, False, 6, 0, 0
+		yield names, True, 6, 0, 0
+		yield names + ['sampleFail', 'sampleError'], True, 8, 1, 1
+
+	def testRun(self, names, splitSets, testsRun, failures, errors):
+		result = unittest.TestResult()
+		ParallelSuite(self._suite(names), workers = 2, splitSets = splitSets).run(result)
+		self.assertEqual(result.testsRun, testsRun)
+		self.assertEqual(len(result.failures), failures)
+		self.assertEqual(len(result.errors), errors)
+		if failures:
+			self.assertEqual(result.failures[0][0].id(), ParallelSample('sampleFail').id())
+			self.assertIn('AssertionError: 1 != 2', result.failures[0][1])
+		if errors:
+			self.assertIn('ValueError: sample error', result.errors[0][1])
+
+	def testRunLazy(self):
+		result = unittest.TestResult()
+		ParallelSuite([LazyTestSuite(ParallelSample, ParallelSample.sampleLazy)], workers = 2).run(result)
+		self.assertEqual(result.failures, [])
+		self.assertEqual(result.testsRun, 6)
+		self.assertTrue(result.wasSuccessful())
+
+	def testReplay(self):
+		recording = RecordingResult()
+		self._suite(['sample-0', 'sampleFail']).run(recording)
+		result = unittest.TestResult()
+		replay(recording.events, result)
+		self.assertEqual(result.testsRun, 2)
+		self.assertEqual(result.failures[0][0].id(), ParallelSample('sampleFail').id())
+		self.assertIn('AssertionError: 1 != 2', result.failures[0][1])
+
+class TestShard(TestCase):
+
+	def _suite(self):
+		names = ['sample-%s' % i for i in range(6)] + ['sampleSlow-0', 'sampleSlow-1', 'sampleFail', 'sampleError']
+		return unittest.TestSuite([ParallelSample(name) for name in names] +
+			[LazyTestSuite(ParallelSample, ParallelSample.sampleLazy)])
+
+	def dataProvider_testParseShard(self):
+		yield '1/4', (0, 4)
+		yield '4/4', (3, 4)
+		yield '0/4', ValueError
+		yield '5/4', ValueError
+		yield '1-4', ValueError
+
+	def testParseShard(self, shard, ret):
+		if ret is ValueError:
+			self.assertRaises(ValueError, parseShard, shard)
+		else:
+			self.assertEqual(parseShard(shard), ret)
+
+	def testUnits(self):
+		prefix = ParallelSample('sampleFail').id().rpartition('.')[0]
+		self.assertEqual([(name[len(prefix) + 1:], len(tests)) for name, tests in units(self._suite()).items()], [
+			('sample', 6), ('sampleSlow', 2), ('sampleFail', 1), ('sampleError', 1), ('sampleLazy', 1)])
+
+	def dataProvider_testAssign(self):
+		# longest processing time first, each to the shard with the least time so far
+		yield dict(a = 5, b = 4, c = 3, d = 3, e = 3), 2, dict(a = 0, b = 1, c = 1, d = 0, e = 1), [8, 10]
+		yield dict(a = 1, b = 1, c = 1), 3, dict(a = 0, b = 1, c = 2), [1, 1, 1]
+		yield dict(a = 10, b = 1, c = 1, d = 1), 2, dict(a = 0, b = 1, c = 1, d = 1), [10, 3]
+
+	def testAssign(self, durations, total, shards, loads):
+		self.assertEqual(assign(sorted(durations), total, durations), (shards, loads))
+
+	def testAssignByHash(self):
+		names = ['test%s' % i for i in range(100)]
+		shards, loads = assign(names, 4, dict(test0 = 1.0))
+		self.assertEqual(loads, [1.0, 0, 0, 0])
+		self.assertEqual(shards['test0'], 0)
+		# stable as the other tests come and go
+		self.assertEqual(assign(names[50:], 4)[0], dict((name, shards[name]) for name in names[50:]))
+		self.assertEqual(set(shards.values()), {0, 1, 2, 3})
+
+	def testSelectShard(self):
+		timings = path.join(tempfile.mkdtemp(), 'timings.json')
+		try:
+			result = TextTestRunner(stream = StringIO(), durationsJson = timings).run(self._suite())
+			self.assertEqual(result.testsRun, 16)
+			durations = loadDurations(timings)
+		finally:
+			shutil.rmtree(path.dirname(timings))
+		self.assertIn(units(self._suite()).popitem()[0], durations)
+		selected = []
+		for index in range(3):
+			suite, _ = selectShard(self._suite(), index, 3, durations)
+			tests = list(suite)
+			names = [test.testset.name if isinstance(test, LazyTestSuite) else test._testMethodName for test in tests]
+			# the sets are not split, in the order of the suite
+			if 'sample-0' in names:
+				self.assertEqual(names[names.index('sample-0'):names.index('sample-0') + 6], ['sample-%s' % i for i in range(6)])
+			selected.extend(names)
+		self.assertEqual(sorted(selected), sorted(test.testset.name if isinstance(test, LazyTestSuite) else test._testMethodName
+			for test in self._suite()))
+		# the slow set is alone, the other tests are on the other shards
+		suite, estimated = selectShard(self._suite(), 0, 3, durations)
+		self.assertEqual([test._testMethodName for test in suite], ['sampleSlow-0', 'sampleSlow-1'])
+		self.assertGreaterEqual(estimated, .02)
+
+class TestTiming(TestCase):
+
+	def _run(self, suite, **kwargs):
+		stream = StringIO()
+		result = TextTestRunner(stream = stream, **kwargs).run(suite)
+		return result, stream.getvalue()
+
+	def testTimings(self):
+		jsonfile = path.join(tempfile.gettempdir(), 'testly-timings.json')
+		result, out = self._run(
+			unittest.TestSuite([ParallelSample(name) for name in ('sampleSlow-0', 'sampleSlow-1', 'sampleFail')]),
+			durations = 0, durationsJson = jsonfile)
+		self.assertEqual([timing[:2] for timing in result.timings], [
+			(ParallelSample('sampleSlow-0').id(), ParallelSample.__module__ + '.ParallelSample.sampleSlow'),
+			(ParallelSample('sampleSlow-1').id(), ParallelSample.__module__ + '.ParallelSample.sampleSlow'),
+			(ParallelSample('sampleFail').id(), None)])
+		self.assertGreaterEqual(result.timings[0][2], .02)
+		self.assertEqual(result.slowestTests(1)[0][0], ParallelSample('sampleSlow-0').id())
+		self.assertEqual(result.slowestSets(), [(ParallelSample.__module__ + '.ParallelSample.sampleSlow', 2) + tuple(
+			sum(timing[k] for timing in result.timings[:2]) for k in (2, 3))])
+		self.assertIn('Slowest tests:', out)
+		self.assertIn('.ParallelSample.sampleSlow (2 tests)', out)
+		with open(jsonfile) as f:
+			timings = json.load(f)
+		remove(jsonfile)
+		self.assertEqual(len(timings['tests']), 3)
+		self.assertEqual(timings['sets'][0]['tests'], 2)
+
+		result, out = self._run(unittest.TestSuite([ParallelSample('sampleFail')]))
+		self.assertNotIn('Slowest tests:', out)
+		self.assertEqual(result.timings, [])
+		self.assertEqual(result.lastTiming[0], ParallelSample('sampleFail').id())
+
+	def testSlowestKept(self):
+		# only the slowest tests to print are kept
+		result, out = self._run(
+			unittest.TestSuite([ParallelSample(name) for name in ('sample-0', 'sampleSlow-0', 'sample-1', 'sampleSlow-1')]),
+			durations = 1)
+		self.assertEqual(result.timings, [])
+		self.assertEqual([timing[0] for timing in result.slowestTests()], [ParallelSample('sampleSlow-0').id()])
+		self.assertEqual([timing[:2] for timing in result.slowestSets()], [
+			(ParallelSample.__module__ + '.ParallelSample.sampleSlow', 2), (ParallelSample.__module__ + '.ParallelSample.sample', 2)])
+		self.assertIn(ParallelSample('sampleSlow-0').id(), out)
+
+	def testParallelTimings(self):
+		result, _ = self._run(ParallelSuite(
+			[ParallelSample(name) for name in ('sampleSlow-0', 'sampleSlow-1')], workers = 2, splitSets = True), durations = 0)
+		self.assertGreaterEqual(dict((timing[0], timing[2]) for timing in result.timings)[ParallelSample('sampleSlow-0').id()], .02)
+
+class BenchmarkSample(TestCase):
+	# methods are not prefixed with "test", so they are only run by TestBenchmark
+	benchmarkRounds = 3
+
+	def dataProvider_sample(self):
+		yield 10,
+		yield 1000,
+
+	def sample(self, size):
+		self.benchmark(sorted, list(range(size, 0, -1)))
+
+	def sampleBaseline(self):
+		self.benchmark(sum, range(100))
+
+class TestBenchmark(TestCase):
+
+	def testMeasure(self):
+		stats = measure(lambda: None, rounds = 3)
+		self.assertEqual(sorted(stats), ['mean', 'median', 'min', 'number', 'rounds', 'stddev'])
+		self.assertEqual(stats.rounds, 3)
+		self.assertLessEqual(stats.min, stats.median)
+		# fewer rounds for slow functions
+		stats = measure(lambda: time.sleep(.02), warmup = 0, mintime = 0, rounds = 5, maxtime = .03)
+		self.assertEqual(stats.number, 1)
+		self.assertEqual(stats.rounds, 2)
+
+	def testFasterThan(self):
+		stats = self.assertFasterThan(sum, 1, range(10))
+		self.assertLess(stats.median, 1)
+		with self.assertRaisesRegex(AssertionError, r'^sleep is not faster than 1ms: min '):
+			self.assertFasterThan(time.sleep, .001, .002)
+
+	def testBaseline(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			baseline = path.join(tmpdir, 'benchmarks.json')
+			BenchmarkSample.benchmarkBaseline = baseline
+			result = unittest.TestResult()
+			BenchmarkSample('sampleBaseline').run(result)
+			self.assertTrue(result.wasSuccessful())
+			with open(baseline) as f:
+				baselines = json.load(f)
+			name = BenchmarkSample('sampleBaseline').id()
+			self.assertEqual(list(baselines), [name])
+			baselines[name]['median'] /= 100.0
+			with open(baseline, 'w') as f:
+				json.dump(baselines, f)
+			getStore(baseline).baselines = None
+			BenchmarkSample('sampleBaseline').run(result)
+			self.assertEqual(len(result.failures), 1)
+			self.assertIn('Benchmark %s is slower than its baseline' % name, result.failures[0][1])
+		finally:
+			del BenchmarkSample.benchmarkBaseline
+			shutil.rmtree(tmpdir)
+
+	def testScalingTable(self):
+		for suite in (TestLoader.suiteClass, lambda tests: ParallelSuite(tests, workers = 2)):
+			stream = StringIO()
+			result = TextTestRunner(stream = stream).run(suite([BenchmarkSample('sample-0'), BenchmarkSample('sample-1')]))
+			self.assertEqual([benchmark[1:3] for benchmark in result.benchmarks], [
+				('%s.BenchmarkSample.sample' % __name__, '10'), ('%s.BenchmarkSample.sample' % __name__, '1000')])
+			out = stream.getvalue()
+			self.assertIn('Benchmarks:\n  %s.BenchmarkSample.sample\n    10 ' % __name__, out)
+			self.assertRegex(out, r'\n    1000 .* median .* min .* stddev +\d+\.\d\dx\n')
+
+@unittest.skipIf(sys.version_info < (3, 4), 'tracemalloc requires python 3.4+')
+class TestMemory(TestCase):
+	diffColor = False
+
+	def dataProvider_testSize(self):
+		yield '100', 100, '100B'
+		yield '2KB', 2048, '2KB'
+		yield '1.5 MiB', 1572864, '1.5MB'
+		yield '50mb', 52428800, '50MB'
+		yield 3 << 30, 3 << 30, '3GB'
+
+	def testSize(self, size, parsed, formatted):
+		self.assertEqual(parseSize(size), parsed)
+		self.assertEqual(formatSize(parsed), formatted)
+
+	def testSizeError(self):
+		self.assertRaises(ValueError, parseSize, '50 apples')
+
+	def testMaxMemory(self):
+		with self.assertMaxMemory('10MB', retained = '1KB') as usage:
+			data = bytearray(5 << 20)
+			del data
+		self.assertGreaterEqual(usage.peak, 5 << 20)
+		self.assertLess(usage.retained, 1024)
+		with self.assertRaisesRegex(AssertionError, r'^Peak memory 5(\.\d+)?MB > 1MB$'):
+			with self.assertMaxMemory('1MB'):
+				data = bytearray(5 << 20)
+				del data
+
+	def testMaxRetained(self):
+		kept = []
+		with self.assertRaises(AssertionError) as cm:
+			with self.assertMaxMemory(retained = '1MB'):
+				kept.append(bytearray(2 << 20))
+		lines = str(cm.exception).splitlines()
+		self.assertRegex(lines[0], r'^Retained memory 2(\.\d+)?MB > 1MB$')
+		self.assertEqual(lines[1], 'Top allocations retained:')
+		self.assertRegex(lines[2], r'^\+ +2(\.\d+)?MB \(\d+ blocks\) .*test\.py:\d+$')
+
+	def testNoLeak(self):
+		usage = self.assertNoLeak(lambda: [1] * 100)
+		self.assertLess(usage.retained, 1024)
+		kept = []
+		with self.assertRaisesRegex(AssertionError, r'^<lambda> leaked .* in 100 calls \(.* per call\) > 1KB\nTop allocations retained:\n'):
+			self.assertNoLeak(lambda: kept.append(bytearray(100)))
+
+def busyLoop(seconds):
+	started = time.time()
+	while time.time() - started < seconds:
+		pass
+
+class ProfileSample(TestCase):
+	# methods are not prefixed with "test", so they are only run by TestProfiler
+
+	def dataProvider_sample(self):
+		yield .01,
+		yield .05,
+
+	def sample(self, seconds):
+		busyLoop(seconds)
+
+	def sampleAlone(self):
+		busyLoop(.01)
+
+	def sampleFail(self):
+		self.assertEqual(1, 2)
+
+class TestProfiler(TestCase):
+
+	def setUp(self):
+		self.outdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outdir)
+
+	def _run(self, profiler):
+		stream = StringIO()
+		TextTestRunner(stream = stream, profiler = profiler).run(
+			TestLoader.suiteClass([ProfileSample(name) for name in ('sample-0', 'sample-1', 'sampleAlone')]))
+		return stream.getvalue()
+
+	def dataProvider_testProfile(self):
+		prefix = '%s.ProfileSample.' % __name__
+		yield CProfiler, 'test', [prefix + 'sample-0.pstats', prefix + 'sample-1.pstats', prefix + 'sampleAlone.pstats']
+		yield CProfiler, 'set', [prefix + 'sample.pstats', prefix + 'sampleAlone.pstats']
+		yield SamplingProfiler, 'set', [prefix + 'sample.collapsed', prefix + 'sampleAlone.collapsed']
+
+	def testProfile(self, profilerClass, group, files):
+		out = self._run(profilerClass(self.outdir, group))
+		self.assertEqual(sorted(os.listdir(self.outdir)), files)
+		self.assertIn('Hottest functions (%s, ' % profilerClass.NAME, out)
+		hottest = [line for line in out.splitlines() if 'busyLoop' in line]
+		self.assertTrue(hottest)
+		# the test (set) that spent the most time in the function comes first
+		lines = out.splitlines()
+		where = lines[lines.index(hottest[0]) + 1].strip()
+		self.assertTrue(where.startswith('in %s.ProfileSample.sample' % __name__))
+		self.assertNotIn('sampleAlone', where.split(',')[0])
+
+	def testCollapsed(self):
+		self._run(SamplingProfiler(self.outdir))
+		with open(path.join(self.outdir, '%s.ProfileSample.sample-1.collapsed' % __name__)) as f:
+			stacks = f.read().splitlines()
+		stack, count = stacks[0].rsplit(' ', 1)
+		self.assertGreater(int(count), 1)
+		self.assertRegex(stack.split(';')[-1], r'test\.py:\d+\(busyLoop\)$')
+
+	def testFailureNotProfiled(self):
+		profiler = CProfiler(self.outdir)
+		TextTestRunner(stream = StringIO(), profiler = profiler).run(ProfileSample('sampleFail'))
+		funcs = [func[2] for func in profiler.written[0][1].stats]
+		self.assertIn('sampleFail', funcs)
+		# the failure is formatted by the result, which is not profiled
+		self.assertNotIn('_exc_info_to_string', funcs)
+
+	def testBaseProfiler(self):
+		profiler = Profiler(self.outdir)
+		out = self._run(profiler)
+		self.assertEqual(os.listdir(self.outdir), [])
+		self.assertIn('Hottest functions (none, ', out)
+
+class TestReporters(TestCase):
+
+	def _run(self, suite):
+		jsonl = path.join(tempfile.gettempdir(), 'testly-results.jsonl')
+		xml   = path.join(tempfile.gettempdir(), 'testly-results.xml')
+		TextTestRunner(stream = StringIO(), reporters = [JsonLinesReporter(jsonl), JUnitXmlReporter(xml)]).run(suite)
+		with open(jsonl) as f:
+			records = [json.loads(line) for line in f]
+		with open(xml) as f:
+			xmlstr = f.read()
+		remove(jsonl)
+		remove(xml)
+		return records, xmlstr
+
+	def dataProvider_testReport(self):
+		yield False,
+		yield True,
+
+	def testReport(self, parallel):
+		tests = [ParallelSample(name) for name in ('sample-0', 'sampleFail', 'sampleDiff')] + [
+			LazyTestSuite(ParallelSample, ParallelSample.sampleLazy, [2])]
+		records, xmlstr = self._run(ParallelSuite(tests, workers = 2) if parallel else unittest.TestSuite(tests))
+		records = dict((record['name'], record) for record in records)
+		self.assertEqual(sorted(records), ['sample-0', 'sampleDiff', 'sampleFail', 'sampleLazy-2'])
+		self.assertEqual((records['sample-0']['set'], records['sample-0']['row']), ('sample', 0))
+		self.assertEqual((records['sampleLazy-2']['set'], records['sampleLazy-2']['row']), ('sampleLazy', 2))
+		self.assertEqual(records['sampleFail']['set'], None)
+		self.assertEqual(records['sampleFail']['outcome'], 'failure')
+		self.assertEqual(records['sample-0']['outcome'], 'success')
+		self.assertIn('AssertionError: 1 != 2', records['sampleFail']['text'])
+		self.assertIn('2. b', records['sampleDiff']['text'])
+		self.assertNotIn('\x1b', records['sampleDiff']['text'])
+
+		self.assertIn('<testcase classname="%s.ParallelSample" name="sample-0"' % ParallelSample.__module__, xmlstr)
+		self.assertIn('<property name="row" value="2"/>', xmlstr)
+		self.assertIn('<failure message="AssertionError: 1 != 2">', xmlstr)
+		self.assertNotIn('\x1b', xmlstr)
+		self.assertTrue(xmlstr.endswith('</testsuite>\n</testsuites>\n'))
+
+class TestCache(TestCase):
+
+	def setUp(self):
+		self.cachedir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.cachedir)
+
+	def _ids(self, suite):
+		return [test._testMethodName for test in suite]
+
+	def testKey(self):
+		keys = [testKey(ParallelSample('sample-%s' % i)) for i in range(6)]
+		# same method and provider, different arguments
+		self.assertEqual(len(set(keys)), 6)
+		self.assertEqual(testKey(ParallelSample('sample-0')), keys[0])
+		self.assertNotEqual(testKey(ParallelSample('sampleFail')), testKey(ParallelSample('sampleError')))
+
+	@unittest.skipIf(sys.version_info < (3, 5), 'async def requires python 3.5+')
+	def testKeyAsync(self):
+		def sample(body):
+			scope = {'TestCase': TestCase}
+			exec('class AsyncKeySample(TestCase):\n\tasync def sampleA(self):\n\t\t%s\n\tasync def sampleB(self):\n\t\tpass\n' % body, scope)
+			return scope['AsyncKeySample']
+		klass  = sample('self.assertEqual(1, 1)')
+		edited = sample('self.assertEqual(1, 2)')
+		self.assertNotEqual(testKey(klass('sampleA')), testKey(klass('sampleB')))
+		# editing a method changes its key only
+		self.assertNotEqual(testKey(klass('sampleA')), testKey(edited('sampleA')))
+		self.assertEqual(testKey(klass('sampleB')), testKey(edited('sampleB')))
+
+	def testSelect(self):
+		names = ['sampleFail', 'sample-0', 'sample-1', 'sampleError', 'sampleSlow-1']
+		suite = lambda: unittest.TestSuite([ParallelSample(name) for name in names])
+		cache = ResultCache(self.cachedir)
+		TextTestRunner(stream = StringIO(), reporters = [cache.reporter()]).run(cache.select(suite()))
+		self.assertEqual(cache.stats['new'], 5)
+
+		cache = ResultCache(self.cachedir)
+		self.assertEqual(cache.status(ParallelSample('sample-0')), 'passed')
+		self.assertEqual(cache.status(ParallelSample('sampleFail')), 'failed')
+		self.assertEqual(cache.status(ParallelSample('sample-2')), 'new')
+		cache.results[ParallelSample('sampleSlow-1').id()][0] = 'oldkey'
+		self.assertEqual(cache.status(ParallelSample('sampleSlow-1')), 'changed')
+		# the tests of a test set are kept together
+		self.assertEqual(self._ids(cache.select(suite(), changedOnly = True)), ['sampleFail', 'sampleError', 'sampleSlow-1'])
+		self.assertEqual(cache.stats['notrun'], 2)
+		self.assertIn('1 changed, 2 failed last time, 2 unchanged and passed', cache.summary())
+
+		cache = ResultCache(self.cachedir)
+		self.assertEqual(self._ids(cache.select(suite(), failedFirst = True)), ['sampleFail', 'sampleError', 'sample-0', 'sample-1', 'sampleSlow-1'])
+
+	def testCachedProvider(self):
+		calls = []
+		dep   = path.join(self.cachedir, 'dep.txt')
+		with open(dep, 'w') as f:
+			f.write('a')
+		def makeClass(cacheDir):
+			class Sample(TestCase):
+				@cachedProvider(dependsOn = [dep], cacheDir = cacheDir)
+				def dataProvider_sample(self):
+					calls.append(1)
+					for i in range(3):
+						yield i, Box(a = [i])
+				def sample(self, i, box):
+					pass
+			return Sample
+
+		self.assertEqual(makeClass(self.cachedir).sample.tests, ['sample-0', 'sample-1', 'sample-2'])
+		klass = makeClass(self.cachedir)
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(klass.__dict__['sample-2'].testlyArgs, ((2, {'a': [2]}), {}))
+		self.assertEqual(len(os.listdir(path.join(self.cachedir, 'providers'))), 1)
+
+		with open(dep, 'w') as f:
+			f.write('ab')
+		makeClass(self.cachedir)
+		makeClass(self.cachedir)
+		self.assertEqual(len(calls), 2)
+		# the old cache is removed
+		self.assertEqual(len(os.listdir(path.join(self.cachedir, 'providers'))), 1)
+
+	def testCachedLazyProvider(self):
+		provider = cachedProvider(cacheDir = self.cachedir)(lambda box: iter(range(5)))
+		rows = provider(None)
+		self.assertEqual(next(rows), 0)
+		rows.close()
+		# not cached until all the rows are generated
+		self.assertEqual(os.listdir(path.join(self.cachedir, 'providers')), [])
+		self.assertEqual(list(provider(None)), list(range(5)))
+		self.assertEqual(len(os.listdir(path.join(self.cachedir, 'providers'))), 1)
+		self.assertEqual(list(provider(None)), list(range(5)))
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), 'benchmarks'))
+import bench
+
+class TestBenchmarks(TestCase):
+
+	def testMeasure(self):
+		ret = bench.measure(lambda: None, mintime = .01, repeat = 3)
+		self.assertEqual(ret['repeat'], 3)
+		self.assertGreater(ret['number'], 1)
+		self.assertLessEqual(ret['min'], ret['median'])
+
+	def dataProvider_testCompare(self):
+		base = dict(benchmarks = dict(a = dict(min = 1.0), b = dict(min = 1.0), c = dict(min = 1.0)))
+		new  = dict(benchmarks = dict(a = dict(min = 1.05), b = dict(min = 2.0), d = dict(min = 1.0)))
+		yield base, new, .1, [('a', 1.0, 1.05, 1.05, False), ('b', 1.0, 2.0, 2.0, True)]
+		yield base, new, 1.5, [('a', 1.0, 1.05, 1.05, False), ('b', 1.0, 2.0, 2.0, False)]
+
+	def testCompare(self, base, new, threshold, ret):
+		self.assertEqual(bench.compare(base, new, threshold), ret)
+
+	def testCommands(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			base, new = path.join(tmpdir, 'base.json'), path.join(tmpdir, 'new.json')
+			stderr, sys.stderr = sys.stderr, StringIO()
+			try:
+				self.assertEqual(bench.main(['run', '--filter', 'lookup.setName', '--repeat', '2', '--output', base]), 0)
+			finally:
+				sys.stderr = stderr
+			with open(base) as f:
+				results = json.load(f)
+			self.assertEqual(list(results['benchmarks']), ['lookup.setName'])
+			results['benchmarks']['lookup.setName']['min'] *= 2
+			with open(new, 'w') as f:
+				json.dump(results, f)
+			with self.assertStdOE() as (out, _):
+				self.assertEqual(bench.main(['compare', base, new]), 1)
+			self.assertIn('REGRESSED', out.getvalue())
+			with self.assertStdOE():
+				self.assertEqual(bench.main(['compare', base, new, '--threshold', '1.5']), 0)
+		finally:
+			shutil.rmtree(tmpdir)
+
+class TestImport(TestCase):
+
+	@unittest.skipIf(sys.version_info < (3, 7), 'the modules are imported eagerly without module __getattr__')
+	def testLazyModules(self):
+		# the modules only needed by some tests or by the failures are not imported by `import testly`
+		lazy = ['testly.cdiff', 'testly.cache', 'testly.batch', 'testly.benchmark', 'testly.memory',
+			'testly.logs', 'testly.capture', 'testly.shard', 'testly.reporters', 'asyncio', 'logging', 'multiprocessing', 'xml.sax.saxutils']
+		out = subprocess.check_output([sys.executable, '-c',
+			'import sys, testly; print(" ".join(sorted(m for m in %r if m in sys.modules)))' % lazy],
+			cwd = path.dirname(path.abspath(__file__)))
+		self.assertEqual(out.decode().strip(), '')
+
+	def testLazyNames(self):
+		import testly
+		from testly.cdiff import CDiff
+		from testly.batch import RowBatch
+		self.assertIs(testly.CDiff, CDiff)
+		self.assertIs(testly.RowBatch, RowBatch)
+		self.assertIs(testly.memory, sys.modules['testly.memory'])
+		self.assertIs(testly.cachedProvider, cachedProvider)
+		with self.assertRaises(AttributeError):
+			testly.notExisting
+
+class TestCDiff(TestCase):
+
+	diffColor = True
+
+	def dataProvider_testBudget(self):
+		a = ['line %s' % i for i in range(1000)]
+		b = ['line %s' % (i if i % 2 else -i) for i in range(1000)]
+		# 499 differing lines, with 1 equal line in between each two
+		yield a, b, 10, None, 10, '... 495 more differing lines'
+		yield a, b, None, 1000, None, '... 496 more differing lines'
+		yield a, b, 2000, None, 1000, None
+		yield a[:3], b[:3], 2, None, 2, '... 1 more differing lines'
+
+
+	def testBudget(self, a, b, maxlines, maxsize, nlines, footer):
+		lines = list(CDiff(color = True).diff(a, b, context = 1, cwidth = 100, maxlines = maxlines, maxsize = maxsize))
+		if footer:
+			self.assertIn(footer, lines[-1])
+			lines = lines[:-1]
+		if nlines is not None:
+			self.assertEqual(len(lines), nlines)
+		if maxsize is not None:
+			self.assertLessEqual(len(''.join(lines)), maxsize)
+
+	def dataProvider_testEngineOpcodes(self):
+		lines = ['line %s' % i for i in range(20)]
+		yield lines, lines[:5] + ['new'] + lines[5:15] + lines[16:]
+		yield lines, lines[::-1]
+		yield lines, []
+		yield [], lines
+		yield ['a', 'b', 'a', 'b'], ['b', 'a', 'b', 'a', 'c']
+		yield lines * 3, lines[1:] * 2 + ['x']
+
+	def testEngineOpcodes(self, a, b):
+		# the opcodes turn a into b
+		out = []
+		pos = [0, 0]
+		for tag, i1, i2, j1, j2 in FastEngine().opcodes(a, b):
+			self.assertEqual([i1, j1], pos)
+			if tag == 'equal':
+				self.assertEqual(a[i1:i2], b[j1:j2])
+			out.extend(b[j1:j2])
+			pos = [i2, j2]
+		self.assertEqual(pos, [len(a), len(b)])
+		self.assertEqual(out, b)
+
+	def dataProvider_testEngineRows(self):
+		yield ['abcdef'], ['abXdef'], [((1, [('equal', 'ab'), ('change', 'c'), ('equal', 'def')]), (1, [('equal', 'ab'), ('change', 'X'), ('equal', 'def')]), True)]
+		yield ['abcdef'], ['uvwxyz'], [((1, [('delete', 'abcdef')]), (1, [('insert', 'uvwxyz')]), True)]
+		yield ['a', 'b'], ['a'], [((1, [('equal', 'a')]), (1, [('equal', 'a')]), False), ((2, [('delete', 'b')]), ('', []), True)]
+		yield ['', 'b'], ['b'], [((1, [('delete', ' ')]), ('', []), True), ((2, [('equal', 'b')]), (1, [('equal', 'b')]), False)]
+		# long lines are only trimmed
+		yield ['x' * 300 + 'ab'], ['x' * 300 + 'cb'], [((1, [('equal', 'x' * 300), ('change', 'a'), ('equal', 'b')]), (1, [('equal', 'x' * 300), ('change', 'c'), ('equal', 'b')]), True)]
+
+	def testEngineRows(self, a, b, rows):
+		engine = FastEngine()
+		self.assertEqual(list(engine.rows(a, b, engine.opcodes(a, b))), rows)
+
+	def testAutoEngine(self):
+		self.assertIsInstance(CDiff()._getEngine(['a'], ['b']), DifflibEngine)
+		self.assertIsInstance(CDiff()._getEngine(['a' * 100000], ['b']), FastEngine)
+		self.assertIsInstance(CDiff(engine = 'difflib')._getEngine(['a' * 100000], ['b']), DifflibEngine)
+
+	def testRenderers(self):
+		Theme.register('test', {'insert': '<', 'sep': ''})
+		renderer = AnsiRenderer('test')
+		self.assertEqual(renderer.insert('a'), '<a\x1b[0m')
+		self.assertEqual(renderer.delete('a'), '\x1b[31ma\x1b[0m')
+		self.assertEqual(renderer.render([('equal', 'a'), ('insert', 'b'), ('equal', 'c')]), 'a<b\x1b[0mc')
+		renderer = PlainRenderer('test')
+		self.assertEqual(renderer.insert('a'), 'a')
+		self.assertEqual(renderer.render([('equal', 'a'), ('insert', 'b'), ('change', 'c')]), 'abc')
+		self.assertEqual(renderer.mark([('equal', 'a'), ('insert', 'b'), ('delete', ''), ('change', 'c')]),
+			[('equal', 'a'), ('insert', '{+b+}'), ('delete', ''), ('change', '[~c~]')])
+		self.assertEqual(renderer.mark([('delete', 'a')]), [('delete', 'a')])
+		self.assertEqual(Renderer().render([('equal', 'a'), ('delete', 'b')]), 'ab')
+		self.assertEqual(Theme('test').insert('a'), '<a\x1b[0m')
+		self.assertRaises(AttributeError, getattr, Theme(), 'unknown')
+		renderer = HtmlRenderer()
+		self.assertEqual(renderer.render([('equal', '<a>'), ('delete', 'b')]), '&lt;a&gt;<span class="testly-delete">b</span>')
+		self.assertRaises(ValueError, Theme.register, 'test', {'unknown': ''})
+		self.assertRaises(ValueError, Theme, 'unknown')
+
+		lines = ''.join(CDiff(color = False).diff(['abc', 'def'], ['abd', 'def']))
+		self.assertNotIn('\x1b', lines)
+		self.assertIn('abc', lines)
+		# the changes within the lines are marked, as they are not colored
+		lines = ''.join(CDiff(color = False).diff(['abcdefgh'], ['abcdxfgh']))
+		self.assertIn('abcd[~e~]fgh', lines)
+		self.assertIn('abcd[~x~]fgh', lines)
+
+	def testSegments(self):
+		self.assertEqual(toSegments('\n'), [])
+		self.assertEqual(toSegments('a\x00+b\x01\x00^c\x01d'), [('equal', 'a'), ('insert', 'b'), ('change', 'c'), ('equal', 'd')])
+		self.assertEqual(CDiff._wrap([('equal', 'ab'), ('insert', 'cdefg')], 3), [
+			[('equal', 'ab'), ('insert', 'c')], [('insert', 'def')], [('insert', 'g'), ('equal', '  ')]])
+		self.assertEqual(CDiff._wrap([('equal', 'abc')], 3), [[('equal', 'abc')]])
+		self.assertEqual(CDiff._wrap([], 3), [])
+
+	def testAutoColor(self):
+		class Stream(object):
+			def __init__(self, tty):
+				self.tty = tty
+			def isatty(self):
+				return self.tty
+		nocolor = os.environ.pop('NO_COLOR', None)
+		try:
+			self.assertIsInstance(getRenderer(stream = Stream(True)), AnsiRenderer)
+			self.assertIsInstance(getRenderer(stream = Stream(False)), PlainRenderer)
+			self.assertIsInstance(getRenderer(color = True, stream = Stream(False)), AnsiRenderer)
+			os.environ['NO_COLOR'] = '1'
+			self.assertIsInstance(getRenderer(stream = Stream(True)), PlainRenderer)
+		finally:
+			os.environ.pop('NO_COLOR', None)
+			if nocolor is not None:
+				os.environ['NO_COLOR'] = nocolor
+
+	def testLargeMultiLine(self):
+		# used to fall back to the plain message, now diffed by the fast engine
+		first  = '\n'.join('line %s' % i for i in range(100000))
+		second = first.replace('line 50000\n', 'line 50000!\n')
+		with self.assertRaises(AssertionError) as cm:
+			self.assertMultiLineEqual(first, second)
+		self.assertIn('line 50000\x1b[32m!', str(cm.exception))
+
+	def dataProvider_testStructDiff(self):
+		yield {'a': {'b': [1, 2, {'c': 1}]}}, {'a': {'b': [1, 2, {'c': 2}]}}, [('a.b[2].c', 1, 2)]
+		yield {'a': [1, 2]}, {'a': [1]}, [('a[1]', 2, MISSING)]
+		yield {'a': 1}, {'a': 1, 'b c': 2}, [("['b c']", MISSING, 2)]
+		# unorderable keys
+		yield {1: 1, 'a': 1}, {1: 2, 'a': 2}, [('[1]', 1, 2), ('a', 1, 2)]
+		# unhashable values
+		yield {'a': [1], 'b': {}}, {'a': [2], 'b': {}}, [('a[0]', 1, 2)]
+		# different types are not walked
+		yield {'a': (1, 2)}, {'a': [1, 2]}, [('a', (1, 2), [1, 2])]
+
+	def testStructDiff(self, first, second, diffs):
+		self.assertEqual(list(structDiff(first, second)), diffs)
+
+	def testPathDiffBudget(self):
+		first  = dict(('key%s' % i, i) for i in range(100000))
+		second = dict(('key%s' % i, i if i % 1000 else -i) for i in range(100000))
+		lines  = list(CDiff(theme = 'plain').pathdiff(first, second, maxlines = 10))
+		self.assertEqual(len(lines), 11)
+		self.assertIn('... 89 more differing paths', lines[-1])
+		with self.assertRaises(AssertionError) as cm:
+			self.assertDictEqual({'a': {'b': [1, 2]}}, {'a': {'b': [1, 3]}})
+		self.assertIn('a.b[1]', str(cm.exception))
+
 class TestTestCase(TestCase):
 
+	diffColor = True
+
 	def setUpMeta(self):
 		self.meta = True
 
@@ -89,6 +1188,56 @@ class TestTestCase(TestCase):
 				getattr(logging, key)(val)
 		self.assertCountEqual(logouts.output, outs)
 
+	def dataProvider_testLogsKept(self):
+		yield dict(capacity = 2), ['INFO:root:2', 'ERROR:a.b:3']
+		yield dict(keep = 'WARNING'), ['WARNING:a:1', 'ERROR:a.b:3']
+		yield dict(names = 'a'), ['WARNING:a:1', 'ERROR:a.b:3']
+		yield dict(names = ['a.b', 'ab']), ['ERROR:a.b:3']
+		yield dict(level = 'DEBUG', keep = logging.DEBUG, capacity = 3), ['DEBUG:ab:ab', 'INFO:root:2', 'ERROR:a.b:3']
+
+	def testLogsKept(self, kwargs, outs):
+		with self.assertLogs(**kwargs) as watcher:
+			logging.getLogger('a').debug('0')
+			logging.getLogger('a').warning('1')
+			logging.getLogger('ab').debug('ab')
+			logging.info('2')
+			logging.getLogger('a.b').error('3')
+		self.assertEqual(watcher.output, outs)
+		self.assertEqual(len(watcher.records), len(outs))
+
+	def testLogsLazyOutput(self):
+		formatted = []
+		class Message(object):
+			def __str__(self):
+				formatted.append(1)
+				return 'message'
+		with self.assertLogs(capacity = 10) as watcher:
+			for _ in range(1000):
+				logging.info(Message())
+		self.assertEqual(formatted, [])
+		self.assertEqual(watcher.output, ['INFO:root:message'] * 10)
+		self.assertEqual(len(formatted), 10)
+
+	def dataProvider_testLogsMatchers(self):
+		yield dict(appears = r'ready \d+'), None
+		yield dict(appears = [r'ready', r'done']), "Pattern 'done' not found in the logs"
+		yield dict(never = r'error'), None
+		yield dict(never = [r'ready \d', r'error']), "Pattern 'ready \\\\d' found in the logs 3 time(s), first: INFO:root:ready 0"
+		yield dict(appears = 'ready', never = 'ready 1', keep = 'ERROR'), "Pattern 'ready 1' found in the logs 1 time(s)"
+
+	def testLogsMatchers(self, kwargs, failure):
+		try:
+			with self.assertLogs(**kwargs) as watcher:
+				for i in range(3):
+					logging.info('ready %s', i)
+		except AssertionError as ex:
+			self.assertIsNotNone(failure, str(ex))
+			self.assertIn(failure, str(ex))
+		else:
+			self.assertIsNone(failure)
+		# the records are kept or not regardless of the matchers
+		self.assertEqual(len(watcher.records), 0 if kwargs.get('keep') else 3)
+
 	def dataProvider_testStdOE(self):
 		yield '', ''
 		yield 'a;lwjf', ''
@@ -105,6 +1254,45 @@ class TestTestCase(TestCase):
 		self.assertEqual(out.getvalue(), stdout)
 		self.assertEqual(err.getvalue(), stderr)
 
+	def testStdOEFd(self):
+		with self.assertStdOE(fd = True) as (out, err):
+			print('python')
+			os.write(1, b'fd\n')
+			os.write(2, b'fd err\n')
+			sys.stderr.write('python err\n')
+			subprocess.call([sys.executable, '-c', 'import sys; sys.stdout.write("subprocess\\n")'])
+		self.assertEqual(out.getvalue(), 'python\nfd\nsubprocess\n')
+		self.assertEqual(err.getvalue(), 'fd err\npython err\n')
+		self.assertFalse(out.spilled)
+
+	def testStdOESubprocessRunning(self):
+		start = time.time()
+		with self.assertStdOE(fd = True) as (out, _):
+			child = subprocess.Popen([sys.executable, '-u', '-c', 'import time; print("started"); time.sleep(10)'])
+			time.sleep(.5)
+		try:
+			# the subprocess has the pipe open, but the block is done without waiting for it
+			self.assertLess(time.time() - start, 5)
+			self.assertEqual(out.getvalue(), 'started\n')
+		finally:
+			child.kill()
+			child.wait()
+
+	def testStdOESpill(self):
+		with self.assertStdOE(fd = True, spool = '1KB') as (out, err):
+			for i in range(10000):
+				print('line %s \u00e9' % i)
+		self.assertTrue(out.spilled)
+		self.assertEqual(err.size, 0)
+		self.assertEqual(out.tail(3), ['line 9997 \u00e9', 'line 9998 \u00e9', 'line 9999 \u00e9'])
+		self.assertEqual(out.tail(0), [])
+		lines = iter(out)
+		self.assertEqual(next(lines), 'line 0 \u00e9\n')
+		self.assertEqual(sum(1 for _ in lines), 9999)
+		# the multibyte characters cut by the chunks are decoded
+		self.assertEqual(''.join(out.chunks(7)), out.getvalue())
+		self.assertNotIn('\ufffd', out.getvalue())
+
 	def dataProvider_testMethods(self):
 		yield 'assertMultiLineEqual', '\n'.join(['oooooooone', 'two', 'aaa', 'tree', '1', '1', '1', '1', '1', '1', 'fourfourfourfourfourfourfourfourfour very very very very very very very very very very very very very very very very very very very very very very very very very very long line']), '\n'.join(['oooooooore', 'emu', 'three', '1', '1', '1', '1', '1', '1', 'aaa', 'fivefivefivefivefivefivefivefivefive']), [
 			"'oooooooone",
@@ -124,9 +1312,8 @@ class TestTestCase(TestCase):
 		# 1. OrderedDict is just to make sure the output is in order
 		yield 'assertDictEqual', OrderedDict([('a', 1), ('b', 2)]), OrderedDict([('a',1), ('b',3), ('c', 8)]), [
 			"OrderedDict([('a', 1), ('b', 2)]) != OrderedDict([('a', 1), ('b', 3), ('c', 8)])", 
-			"\x1b[90m1. \x1b[0m('a', 1)                                \x1b[90m | \x1b[0m\x1b[90m1. \x1b[0m('a', 1)                                ", 
-			"\x1b[90m2. \x1b[0m('b', \x1b[33m2\x1b[0m)                                \x1b[90m | \x1b[0m\x1b[90m2. \x1b[0m('b', \x1b[33m3\x1b[0m)                                ", 
-			"\x1b[90m   \x1b[0m                                        \x1b[90m | \x1b[0m\x1b[90m3. \x1b[0m\x1b[32m('c', 8)\x1b[0m                                "
+			"  \x1b[90mb\x1b[0m: \x1b[31m2\x1b[0m\x1b[90m != \x1b[0m\x1b[32m3\x1b[0m", 
+			"\x1b[32m+ \x1b[0m\x1b[90mc\x1b[0m: \x1b[32m8\x1b[0m"
 		]
 
 		yield 'assertDictEqual', OrderedDict([('a', 1), ('b', 2)]), OrderedDict([('a',1), ('b',3), ('c', 8)]), [
@@ -135,9 +1322,8 @@ class TestTestCase(TestCase):
 
 		yield 'assertDictEqual', OrderedDict([('a', 1), ('b', 2)]), OrderedDict([('a',1), ('b',3), ('c', 8)]), [
 			"OrderedDict([('a', 1), ('b', 2)]) != OrderedDict([('a', 1), ('b', 3), ('c', 8)])", 
-			"\x1b[90m1. \x1b[0m('a', 1)                                \x1b[90m | \x1b[0m\x1b[90m1. \x1b[0m('a', 1)                                ", 
-			"\x1b[90m2. \x1b[0m('b', \x1b[43m2\x1b[0m)                                \x1b[90m | \x1b[0m\x1b[90m2. \x1b[0m('b', \x1b[43m3\x1b[0m)                                ", 
-			"\x1b[90m   \x1b[0m                                        \x1b[90m | \x1b[0m\x1b[90m3. \x1b[0m\x1b[42m('c', 8)\x1b[0m                                "
+			"  \x1b[90mb\x1b[0m: \x1b[41m2\x1b[0m\x1b[90m != \x1b[0m\x1b[42m3\x1b[0m", 
+			"\x1b[42m+ \x1b[0m\x1b[90mc\x1b[0m: \x1b[42m8\x1b[0m"
 		], None, 'contrast'
 
 		# 4
@@ -166,20 +1352,65 @@ class TestTestCase(TestCase):
 		yield 'assertDictNotContains', {'a':1}, {'a':1}, ["{'a': 1} is in {'a': 1}"]
 
 		yield 'assertSeqContains', [1], [], ['[] does not contain [1]']
+		yield 'assertSeqContains', [1, 2, 3], [2], ['[2] does not contain [1, 2, 3], missing 2 element(s): [1, 3]']
+		yield 'assertSeqContains', [[1], [2]], [[2]], ['missing 1 element(s): [[1]]']
+		yield 'assertSeqContains', [{1}, {2}], [{2}], ['missing 1 element(s): [%r]' % {1}]
+		# substrings of a string
+		yield 'assertSeqContains', ['ab', 'ad'], 'abc', ["'abc' does not contain ['ab', 'ad'], missing 1 element(s): ['ad']"]
+		yield 'assertDictContains', {'a': 1, 'b': [1], 'c': 3}, {'a': 2, 'b': [2]}, ['Key c from ', 'have different values on keys a, b']
 		yield 'assertSeqNotContains', [], [1], ['[1] contains []']
 
-		# 13
+		# 17
 		yield 'assertInAny', 'abc', ['d','e'], ["'abc' is not in any elements of ['d', 'e']"]
 		yield 'assertNotInAny', 'ef', ['def','ghi'], ["'ef' is in at least one element of ['def', 'ghi']"]
 
 		yield 'assertRegexAny', r'^$', ['a', 'b'], ["'^$' does not match any elements of ['a', 'b']"]
 		yield 'assertNotRegexAny', r'^a$', ['a', 'b'], ["'^a$' matches at least one element of ['a', 'b']"]
+		yield 'assertRegexAny', [r'^a', r'^c', r'^d'], ['a', 'b'], ["Missing patterns: '^c', '^d'"]
+		yield 'assertNotRegexAny', [r'^c', r'^b$'], ['a', 'b'], ["Element 1: 'b' matches '^b$'"]
+		yield 'assertNotRegexAny', [r'^c', r'(b)\1'], ['a', 'bb'], ["Element 1: 'bb' matches '(b)\\\\1'"]
+		yield 'assertNotInAny', 'b', ['a', 'abc'], ["Element 1: 'abc'"]
 
-		# 17
+		# 25
 		yield 'assertCountEqual', [1,2,2], [2,1], ['Element counts were not equal:', 'First has 2, Second has 1:  2']
 		yield 'assertRaisesRegex', ZeroDivisionError, r'aaa', ['"aaa" does not match "', 'by zero'], lambda: 1/0
 		yield 'assertRegex', 'string', r'regex', ["Regex", " didn't match: "]
 
+	def testContainsLarge(self):
+		# hashable, unhashable but orderable, and neither
+		for seq in (list(range(100000)), [[i] for i in range(100000)]):
+			self.assertSeqContains(seq[::-1], seq)
+			self.assertSeqNotContains(seq + [None], seq[1:] + [None])
+		big = dict(('key%s' % i, [i]) for i in range(100000))
+		self.assertDictContains(big, dict(big, extra = 1))
+		self.assertDictNotContains(dict(big, extra = 1), big)
+		self.assertSeqContains([{1}, {2}], [{2}, {1}])
+		self.assertSeqContains(['ab', 'bc'], 'abc')
+		self.assertSeqNotContains(['ab', 'ad'], 'abc')
+		# substrings of bytes
+		self.assertSeqContains([b'ab', b'bc'], b'abc')
+		self.assertSeqContains([b'ab'], bytearray(b'abc'))
+		self.assertSeqNotContains([b'ab', b'ad'], b'abc')
+		self.assertRaises(AssertionError, self.assertSeqContains, [b'ad'], b'abc')
+		self.assertRaises(AssertionError, self.assertSeqNotContains, [b'ab'], b'abc')
+		# the membership of the container itself
+		class Evens(object):
+			def __contains__(self, item):
+				return item % 2 == 0
+			def __iter__(self):
+				return iter([0])
+		self.assertSeqContains([2, 4], Evens())
+		self.assertSeqNotContains([1, 3], Evens())
+		self.assertRaises(AssertionError, self.assertSeqContains, [3], Evens())
+		self.assertSeqContains([5, 99999], moves.range(100000))
+
+	def testRegexAnyStream(self):
+		# the sequence is only read until all the patterns have matched
+		lines = ('line %s' % i for i in itertools.count())
+		self.assertRegexAny([r'line 1$', r'line 100$'], lines)
+		self.assertEqual(next(lines), 'line 101')
+		self.assertNotRegexAny([r'^x', r'y$'], ('line %s' % i for i in range(100000)))
+
 	def testMethods(self, method, first, second, stderrs, msg = None, diffTheme = 'default'):
 		self.diffTheme = diffTheme
 		self.maxDiff   = None
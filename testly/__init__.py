@@ -1,42 +1,186 @@
 VERSION = '0.0.4'
-import logging, sys, re, difflib
-import unittest, types, traceback, pprint
+import sys, re, fnmatch, bisect
+import unittest, types
 from sys import stderr
-from six import with_metaclass, StringIO, moves, string_types
-from tempfile import gettempdir
-from os import remove, path
-from builtins import str
-from collections import namedtuple
+from six import with_metaclass, StringIO, moves, string_types, viewitems
+from os import path
 from contextlib import contextmanager
-from .cdiff import CDiff
+from .result import TextTestResult, TextTestRunner
+from . import aio
+if sys.version_info[0] < 3: # pragma: no cover
+	from builtins import str
+
+# the modules that are only needed by some tests, or when a test fails, are imported on first use:
+# name exported by testly -> the module that defines it
+_LAZY = dict(
+	CDiff          = '.cdiff',
+	cachedProvider = '.cache',
+	concurrent     = '.batch',
+	RowBatch       = '.batch',
+	measure        = '.benchmark',
+	formatTime     = '.benchmark',
+	getStore       = '.benchmark',
+	BaselineStore  = '.benchmark',
+	memory         = '.memory',
+)
+
+def _lazy(name):
+	import importlib
+	module = importlib.import_module(_LAZY[name], __name__)
+	return module if module.__name__.endswith('.' + name) else getattr(module, name)
+
+def __getattr__(name):
+	# the lazy names, see PEP 562
+	if name not in _LAZY:
+		raise AttributeError('module %r has no attribute %r' % (__name__, name))
+	ret = globals()[name] = _lazy(name)
+	return ret
+
+# unittest reports the durations of the tests since python 3.12
+_UNITTEST_DURATIONS = hasattr(unittest.TestResult, 'addDuration')
 
 def _createTestMethod(func, *args, **kwargs):
-	return lambda self: func(self, *args, **kwargs)
+	if aio.iscoroutinefunction(func):
+		ret = lambda self: self.runAsync(func(self, *args, **kwargs))
+		ret.testlyAsync = True
+	else:
+		ret = lambda self: func(self, *args, **kwargs)
+	ret.concurrency = getattr(func, 'concurrency', None)
+	# where the test comes from, for the keys of the result cache
+	ret.testlyFunc = func
+	ret.testlyArgs = args, kwargs
+	return ret
+
+def _parseData(data):
+	if isinstance(data, Data):
+		return data()
+	elif isinstance(data, (tuple, list)):
+		return Data(*data)()
+	elif isinstance(data, dict):
+		return Data(**data)()
+	raise ValueError('Expect data type tuple/list/dict/testly.Data, but got %s' % type(data))
+
+def _provide(provider, box, klass = None):
+	"""
+	Get the rows of a data provider. The rows of async generators are generated on
+	the event loop of the class, or on a loop of their own if the class is not created yet.
+	"""
+	rows = provider(box)
+	if not hasattr(rows, '__anext__'):
+		return rows
+	if klass is not None:
+		return aio.iterAsync(rows, aio.getLoop(klass))
+	def generate():
+		loop = aio.newLoop()
+		try:
+			for row in aio.iterAsync(rows, loop):
+				yield row
+		finally:
+			loop.close()
+	return generate()
 
-def _isFirst(testMethods):
+# the builtin containers whose `in` is plain equality, so that their elements can be looked up in a set instead
+_LOOKUP_TYPES = (list, tuple, set, frozenset, dict, type(moves.range(0)))
+
+def _missingItems(first, second):
+	"""
+	Generate the elements of first that are not in second.
+	If second is a builtin list, tuple, set, dict or range, its elements are looked up in a set
+	if they are hashable, by bisection of the sorted elements if they are orderable, or linearly otherwise.
+	Otherwise the elements are looked up as `in` does, i.e. as substrings of strings and bytes,
+	or by the `__contains__` of the container.
+	"""
+	# not their subclasses, which may have a `__contains__` of their own
+	if type(second) not in _LOOKUP_TYPES and not hasattr(second, '__contains__'):
+		second = list(second)
+	if type(second) not in _LOOKUP_TYPES:
+		contains = second.__contains__
+	else:
+		try:
+			lookup   = set(second)
+			contains = lookup.__contains__
+		except TypeError:
+			try:
+				lookup = sorted(second)
+			except TypeError:
+				contains = second.__contains__
+			else:
+				def contains(item):
+					index = bisect.bisect_left(lookup, item)
+					# confirm the misses linearly, in case the elements are only partially ordered
+					return index < len(lookup) and lookup[index] == item or item in second
+	for item in first:
+		try:
+			found = contains(item)
+		except TypeError:
+			# unhashable or unorderable item
+			found = item in second
+		if not found:
+			yield item
+
+def _shortRepr(obj, maxlen = 80):
+	ret = repr(obj)
+	return ret if len(ret) <= maxlen else ret[:maxlen] + '...'
+
+def _compilePatterns(patterns):
+	if not isinstance(patterns, (list, tuple)):
+		patterns = [patterns]
+	return [re.compile(pattern) for pattern in patterns]
+
+def _combinePatterns(patterns):
+	"""
+	Combine the compiled patterns into one alternation, with a named group for each,
+	so that the pattern that matches can be told by `lastgroup`.
+	Returns None if they cannot be combined (i.e. different flags or backreferences).
+	"""
+	if len(patterns) < 2:
+		return None
+	flags = set(pattern.flags for pattern in patterns)
+	if len(flags) > 1 or any(pattern.groups for pattern in patterns):
+		return None
+	try:
+		return re.compile('|'.join(
+			'(?P<testly%s>%s)' % (i, pattern.pattern) for i, pattern in enumerate(patterns)), flags.pop())
+	except re.error:
+		return None
+
+def lazyProvider(func):
+	"""
+	Mark a data provider as lazy: instead of being expanded when the class is created,
+	its rows are produced one at a time while the test set is running.
+	"""
+	func.lazy = True
+	return func
+
+def _isFirst(testSets):
 	def isFirst(self):
-		name = self.setName()
-		if name not in testMethods:
-			return False
-		return testMethods[name].isFirst(self._testMethodName)
+		if self._testlyRow:
+			return self._testlyRow[1]
+		testset = testSets.get(self._testMethodName)
+		return testset is not None and testset.isFirst(self._testMethodName)
 	return isFirst
 
-def _isLast(testMethods):
+def _isLast(testSets):
 	def isLast(self):
-		name = self.setName()
-		if name not in testMethods:
-			return False
-		return testMethods[name].isLast(self._testMethodName)
+		if self._testlyRow:
+			return self._testlyRow[2]
+		testset = testSets.get(self._testMethodName)
+		return testset is not None and testset.isLast(self._testMethodName)
 	return isLast
 
-def _setName(testMethods):
+def _setName(testSets):
 	def setName(self):
-		for testset in testMethods.values():
-			if self._testMethodName in testset.tests:
-				return testset.name
-		return self._testMethodName
+		if self._testlyRow:
+			return self._testlyRow[0].name
+		testset = testSets.get(self._testMethodName)
+		return self._testMethodName if testset is None else testset.name
 	return setName
 
+def _isOfSet(testSets):
+	def isOfSet(self):
+		return bool(self._testlyRow) or self._testMethodName in testSets
+	return isOfSet
+
 class Data(object):
 	def __init__(self, *args, **kwargs):
 		self.args   = args
@@ -65,40 +209,207 @@ class Box(dict):
 			super(Box, self).__setattr__(name, val)
 
 class TestSet(object):
+	"""
+	The tests generated by a data provider.
+	The positions of the tests are indexed, so that `index`, `isFirst` and `isLast`
+	don't have to search the tests.
+	"""
 	def __init__(self, name):
 		self.name  = name
 		self.tests = []
 
+	@property
+	def tests(self):
+		return self._tests
+
+	@tests.setter
+	def tests(self, tests):
+		self._tests     = list(tests)
+		self._positions = dict((test, i) for i, test in enumerate(self._tests))
+
 	def addTest(self, testname):
-		self.tests.append(testname)
+		self._positions[testname] = len(self._tests)
+		self._tests.append(testname)
+
+	def index(self, testname):
+		"""Get the position of the test in the set, -1 if it is not in the set"""
+		return self._positions.get(testname, -1)
 
 	def isFirst(self, testname):
-		if not self.tests:
-			return False
-		return self.tests[0] == testname
+		return self.index(testname) == 0
 
 	def isLast(self, testname):
-		if not self.tests:
-			return False
-		return self.tests[-1] == testname
+		return bool(self._tests) and self.index(testname) == len(self._tests) - 1
 
-class _assertLogsHandler(logging.Handler):
+class LazyTestSet(TestSet):
+	"""
+	A test set whose tests are generated by a lazy data provider, on demand.
+	"""
+	def __init__(self, name, provider, func, box):
+		super(LazyTestSet, self).__init__(name)
+		self.provider = provider
+		self.func     = func
+		self.box      = box
+
+	def rows(self, klass = None):
+		for i, data in enumerate(_provide(self.provider, self.box, klass)):
+			args, kwargs = _parseData(data)
+			yield i, args, kwargs
+
+def _setKey(test):
+	if not isinstance(test, TestCase) or not test.isOfSet():
+		return None
+	return test.__class__, test.setName()
+
+def _concurrency(test):
+	"""The concurrency of a test, from the `concurrent` decorator of the test method or the class"""
+	method = getattr(test, test._testMethodName, None)
+	return getattr(method, 'concurrency', None) or test.concurrency or 1
+
+class TestSuite(unittest.TestSuite):
+	"""
+	The suite used by testly, which also runs `setUpSet` and `tearDownSet` of the tests
+	once around each run of the tests of a test set, the same way as `setUpClass` and
+	`tearDownClass` are run around the tests of a class.
+	The test set being run is tracked on the result, so that it works across suites.
+	"""
 
-	LOGFMT = "%(levelname)s:%(name)s:%(message)s"
+	@staticmethod
+	def _addSetError(result, method, setkey):
+		exc = sys.exc_info()
+		holder = unittest.suite._ErrorHolder('%s (%s.%s)' % (method, unittest.util.strclass(setkey[0]), setkey[1]))
+		if isinstance(exc[1], unittest.SkipTest) and hasattr(result, 'addSkip'):
+			result.addSkip(holder, str(exc[1]))
+		else:
+			result.addError(holder, exc)
+
+	def _tearDownPreviousSet(self, test, result):
+		previous = getattr(result, '_testlyPreviousSet', None)
+		if previous is None or (test is not None and _setKey(test) == previous['key']):
+			return
+		result._testlyPreviousSet = None
+		if previous['failed']:
+			# skipped the rest of the test set
+			previous['key'][0]._classSetupFailed = False
+			return
+		try:
+			previous['test'].tearDownSet(previous['key'][1])
+		except Exception:
+			TestSuite._addSetError(result, 'tearDownSet', previous['key'])
+		finally:
+			if previous['key'][0].asyncLoopScope == 'set':
+				aio.closeLoop(previous['key'][0])
 
-	def __init__(self):
-		LoggingWatcher = namedtuple("_LoggingWatcher", ["records", "output"])
-		logging.Handler.__init__(self)
-		self.watcher = LoggingWatcher([], [])
+	def _tearDownPreviousClass(self, test, result):
+		self._tearDownPreviousSet(test, result)
+		previousClass = getattr(result, '_previousTestClass', None)
+		super(TestSuite, self)._tearDownPreviousClass(test, result)
+		if previousClass is not None and previousClass is not test.__class__ and issubclass(previousClass, TestCase):
+			aio.closeLoop(previousClass)
 
-	def flush(self):
+	def _markBatches(self):
+		"""
+		Group the rows of the test sets with `concurrency` into `RowBatch`es.
+		The first and the last row of a set run alone, so that `isFirst()` and `isLast()` still hold.
+		"""
+		batch = []
+		for test in self._tests + [None]:
+			setkey = _setKey(test)
+			if batch and setkey != _setKey(batch[0]):
+				if len(batch) > 1:
+					from .batch import RowBatch
+					rowBatch = RowBatch(batch, _concurrency(batch[0]))
+					for member in batch:
+						member._testlyBatch = rowBatch
+				batch = []
+			if setkey is not None and _concurrency(test) > 1 and not test.isFirst() and not test.isLast():
+				batch.append(test)
+
+	def run(self, result, debug = False):
+		if not debug:
+			self._markBatches()
+		return super(TestSuite, self).run(result, debug)
+
+	def _handleClassSetUp(self, test, result):
+		super(TestSuite, self)._handleClassSetUp(test, result)
+		previous = getattr(result, '_testlyPreviousSet', None)
+		if previous is not None:
+			# still in the same test set
+			test.setContext = previous['context']
+			return
+		setkey = _setKey(test)
+		if setkey is None or getattr(setkey[0], '_classSetupFailed', False) or \
+			getattr(setkey[0], '__unittest_skip__', False) or getattr(result, '_moduleSetUpFailed', False):
+			return
+		test.setContext = Box()
+		previous = result._testlyPreviousSet = dict(
+			key = setkey, test = test, context = test.setContext, failed = False)
+		try:
+			test.setUpSet(setkey[1])
+		except Exception:
+			previous['failed'] = True
+			# so that the rest of the test set is skipped by unittest.TestSuite.run
+			setkey[0]._classSetupFailed = True
+			TestSuite._addSetError(result, 'setUpSet', setkey)
+
+class LazyTestSuite(TestSuite):
+	"""
+	A suite running the tests of a `LazyTestSet`.
+	The tests are created when the suite is iterated, one row ahead,
+	so that the last test of the set is known. Each test is dropped once it is done.
+	"""
+	def __init__(self, testCaseClass, testset, indexes = None):
+		super(LazyTestSuite, self).__init__()
+		self.testCaseClass = testCaseClass
+		self.testset       = testset
+		self.indexes       = indexes
+		# the number of tests, once they are all generated
+		self._count        = None
+
+	def _rows(self):
+		if self.indexes is None:
+			return self.testset.rows(self.testCaseClass)
+		indexes = set(self.indexes)
+		return (row for row in self.testset.rows(self.testCaseClass) if row[0] in indexes)
+
+	def createTest(self, index, args = (), kwargs = None, first = False, last = False):
+		test = self.testCaseClass(self.testset.name)
+		test._testMethodName = '%s-%s' % (self.testset.name, index)
+		test._testMethodDoc  = None
+		test._testlyRow      = (self.testset, first, last)
+		method = _createTestMethod(self.testset.func, *args, **(kwargs or {}))
+		method.testlyProvider = self.testset.provider
+		setattr(test, test._testMethodName, types.MethodType(method, test))
+		return test
+
+	def __iter__(self):
+		prev = firstIndex = None
+		count = 0
+		for row in self._rows():
+			count += 1
+			if prev is not None:
+				test = self.createTest(*prev, first = prev[0] == firstIndex, last = False)
+				yield test
+				# break the cycle of the test and its bound method
+				test.__dict__.pop(test._testMethodName, None)
+			else:
+				firstIndex = row[0]
+			prev = row
+		if prev is not None:
+			test = self.createTest(*prev, first = prev[0] == firstIndex, last = True)
+			yield test
+			test.__dict__.pop(test._testMethodName, None)
+		self._count = count
+
+	def countTestCases(self):
+		# don't run the data provider again after the tests ran
+		if self._count is not None:
+			return self._count
+		return sum(1 for _ in self._rows())
+
+	def _removeTestAtIndex(self, index):
 		pass
 
-	def emit(self, record):
-		self.watcher.records.append(record)
-		msg = self.format(record)
-		self.watcher.output.append(msg)
-
 class MetaTestCase(type):
 
 	def __new__(meta, classname, bases, classDict):
@@ -106,6 +417,10 @@ class MetaTestCase(type):
 		classDict = Box(classDict)
 
 		testMethods	= {}
+		# method name -> test set, including those of the base classes
+		testSets    = {}
+		for base in reversed(bases):
+			testSets.update(getattr(base, '_testlySets', {}))
 		if 'setUpMeta' in classDict:
 			classDict['setUpMeta'](classDict)
 			del classDict['setUpMeta']
@@ -116,28 +431,27 @@ class MetaTestCase(type):
 				del classDict[key]
 				testname = key[13:]
 				testMethods[testname] = TestSet(testname)
-				if testname in classDict:
-					for i, data in enumerate(val(Box(classDict))):
+				if testname in classDict and getattr(val, 'lazy', False):
+					testMethods[testname] = LazyTestSet(testname, val, classDict[testname], Box(classDict))
+					classDict[testname] = testMethods[testname]
+				elif testname in classDict:
+					for i, data in enumerate(_provide(val, Box(classDict))):
 						testMethod = '%s-%s' % (testname, i)
 						testMethods[testname].addTest(testMethod)
-						if isinstance(data, Data):
-							args, kwargs = data()
-						elif isinstance(data, (tuple, list)):
-							args, kwargs = Data(*data)()
-						elif isinstance(data, dict):
-							args, kwargs = Data(**data)()
-						else:
-							raise ValueError('Expect data type tuple/list/dict/testly.Data, but got %s' % type(data))
+						testSets[testMethod] = testMethods[testname]
+						args, kwargs = _parseData(data)
 						classDict[testMethod] = _createTestMethod(classDict[testname], *args, **kwargs)
+						classDict[testMethod].testlyProvider = val
 					del classDict[testname]
 					classDict[testname] = testMethods[testname]
 				else:
 					stderr.write('WARNING: Data provider [%s] ignored: no corresponding test method [%s] found.' % (key, testname))
 
-		classDict['isFirst'] = _isFirst(testMethods)
-		classDict['isLast']  = _isLast(testMethods)
-		classDict['setName'] = _setName(testMethods)
-		classDict['isOfSet'] = lambda self: self._testMethodName != self.setName()
+		classDict['_testlySets'] = testSets
+		classDict['isFirst']     = _isFirst(testSets)
+		classDict['isLast']      = _isLast(testSets)
+		classDict['setName']     = _setName(testSets)
+		classDict['isOfSet']     = _isOfSet(testSets)
 		return type.__new__(meta, classname, bases, classDict)
 
 class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
@@ -146,30 +460,135 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 	diffColWidth = None
 	diffTheme    = 'default'
 	diffContext  = 1
+	diffEngine   = 'auto'
+	# whether to color the diff, None to color it only if stderr is a TTY and NO_COLOR is not set
+	diffColor    = None
+	# (testset, isFirst, isLast) of the tests generated by lazy data providers
+	_testlyRow   = None
+	# the context shared by the tests of a test set, see `setUpSet`
+	setContext   = None
+	# the number of rows of a test set that run at the same time, see `testly.batch.RowBatch`
+	concurrency    = None
+	# the event loop is shared by the tests of the class, or closed after each test set if 'set'
+	asyncLoopScope = 'class'
+	# the file of the baselines of the benchmarks (.testly_cache/benchmarks.json if True), see `benchmark`
+	benchmarkBaseline  = None
+	# the ratio of slowdown from the baseline to tolerate
+	benchmarkTolerance = .2
+	# the max number of rounds of a benchmark and the time to spend on them
+	benchmarkRounds    = 5
+	benchmarkMaxTime   = 1.0
+	# the rows that run concurrently with this one
+	_testlyBatch   = None
+
+	def __init__(self, methodName = 'runTest'):
+		super(TestCase, self).__init__(methodName)
+		method = getattr(self.__class__, methodName, None)
+		if aio.iscoroutinefunction(method):
+			coro    = getattr(self, methodName)
+			wrapper = lambda: self.runAsync(coro())
+			# where the test comes from, for the keys of the result cache
+			wrapper.testlyFunc = method
+			setattr(self, methodName, wrapper)
+
+	def runAsync(self, coro):
+		"""
+		Run a coroutine on the event loop of the class, where async test methods and
+		async data providers run. With `concurrency`, the coroutines of the rows of
+		a test set (except the first and the last ones) overlap on the loop.
+		@params:
+			`coro`: The coroutine
+		@returns:
+			The result of the coroutine
+		"""
+		return aio.runOn(aio.getLoop(self.__class__), coro)
+
+	def run(self, result = None):
+		batch = self._testlyBatch
+		if batch is None:
+			return super(TestCase, self).run(result)
+		self._testlyBatch = None
+		batch.replay(self, result)
+		return result
+
+	def _runRecorded(self, result):
+		return super(TestCase, self).run(result)
+
+	def setUpSet(self, name):
+		"""
+		Called once before the tests of a test set run, with `self.setContext` being a fresh `Box`,
+		which is then shared by all the tests of the set. If it fails, the tests of the set are skipped.
+		@params:
+			`name`: The name of the test set
+		"""
+
+	def tearDownSet(self, name):
+		"""
+		Called once after the tests of a test set run, if `setUpSet` succeeded.
+		@params:
+			`name`: The name of the test set
+		"""
 
 	@contextmanager
-	def assertLogs(self, logger=None, level=None):
+	def assertLogs(self, logger = None, level = None, capacity = None, keep = None, names = None,
+		appears = None, never = None, msg = None):
+		"""
+		Capture the logs of a logger (the root logger by default), see `testly.logs.LogsHandler`.
+		Only the records passing `keep` and `names` are kept, and they are only formatted
+		when the `output` of the watcher is read, so that capturing many records stays cheap.
+		@params:
+			`logger`  : The logger or its name
+			`level`   : The level of the logger while capturing, INFO by default
+			`capacity`: Only keep the last records, i.e. as a ring buffer
+			`keep`    : Only keep the records of this level or above
+			`names`   : Only keep the records of these loggers and their children
+			`appears` : The pattern(s) that must be found in the messages of the records
+			`never`   : The pattern(s) that must not be found in the messages of the records
+		@yields:
+			The `testly.logs.LogsWatcher`, with the `records` kept and their `output`
+		"""
+		import logging
+		from .logs import LogsHandler, levelno
 		if not isinstance(logger, logging.Logger):
 			logger = logging.getLogger(logger)
-		level = getattr(logging, level) if level else logging.INFO
+		handler = LogsHandler(capacity, keep, names, appears, never)
+		old_handlers  = logger.handlers[:]
+		old_level     = logger.level
+		old_propagate = logger.propagate
 		try:
-			formatter = logging.Formatter(_assertLogsHandler.LOGFMT)
-			handler   = _assertLogsHandler()
-			handler.setFormatter(formatter)
-			old_handlers  = logger.handlers[:]
-			old_level     = logger.level
-			old_propagate = logger.propagate
 			logger.handlers    = [handler]
-			logger.setLevel(level)
+			logger.setLevel(levelno(level, logging.INFO))
 			logger.propagate   = False
 			yield handler.watcher
 		finally:
 			logger.handlers  = old_handlers
 			logger.propagate = old_propagate
 			logger.setLevel(old_level)
+		failures = handler.failures()
+		if failures:
+			self.fail(self._formatMessage(msg, '\n'.join(failures)))
 
 	@contextmanager
-	def assertStdOE(self):
+	def assertStdOE(self, fd = False, spool = '1MB'):
+		"""
+		Capture stdout and stderr.
+		@params:
+			`fd`   : Capture the file descriptors 1 and 2 instead of replacing `sys.stdout` and `sys.stderr`,
+				so that the output of C extensions and subprocesses is captured too, see `testly.capture.captureFds`
+			`spool`: With `fd`, the size of the output kept in memory before it is written to disk
+		@yields:
+			The captured stdout and stderr, as `StringIO`s, or with `fd`, as `testly.capture.Captured`s,
+			which also read the output by lines or chunks, and its tail
+		"""
+		if fd:
+			from .capture import captureFds
+			from .sizes import parseSize
+			with captureFds(parseSize(spool)) as captured:
+				for output in captured:
+					# readable until the test is done
+					self.addCleanup(output.close)
+				yield captured
+			return
 		new_out, new_err = StringIO(), StringIO()
 		old_out, old_err = sys.stdout, sys.stderr
 		try:
@@ -178,6 +597,115 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 		finally:
 			sys.stdout, sys.stderr = old_out, old_err
 
+	def _memoryFailure(self, message, usage, msg, retained = True):
+		from . import memory
+		# the allocations at the peak are gone, only those retained are known
+		top = retained and memory.topAllocations(usage.stats, theme = self.diffTheme, color = self.diffColor)
+		if top:
+			message += '\nTop allocations retained:\n' + top
+		self.fail(self._formatMessage(msg, message))
+
+	@contextmanager
+	def assertMaxMemory(self, peak = None, retained = None, msg = None):
+		"""
+		Assert that the memory allocated by the block is within limits, measured by tracemalloc.
+		When the retained memory is over the limit, the source lines that retained most of it are reported.
+		Before python 3.9, the peak is the one since tracemalloc started if it was tracing already,
+		see `testly.memory.MemoryUsage`.
+		@params:
+			`peak`    : The max memory allocated at the peak, i.e. `'50MB'`, see `testly.sizes.parseSize`
+			`retained`: The max memory still allocated after the block
+		@yields:
+			The `testly.memory.MemoryUsage`, which is filled once the block is done
+		"""
+		from . import memory
+		if memory.tracemalloc is None:
+			self.skipTest('tracemalloc is not available')
+		tracer = memory.Tracer()
+		tracer.start()
+		try:
+			yield tracer.usage
+		finally:
+			usage = tracer.stop()
+		if peak is not None and usage.peak > memory.parseSize(peak):
+			self._memoryFailure('Peak memory %s > %s%s' % (
+				memory.formatSize(usage.peak), memory.formatSize(memory.parseSize(peak)),
+				'' if usage.exactPeak else ' (the peak since tracemalloc started tracing)'), usage, msg, False)
+		if retained is not None and usage.retained > memory.parseSize(retained):
+			self._memoryFailure('Retained memory %s > %s' % (
+				memory.formatSize(usage.retained), memory.formatSize(memory.parseSize(retained))), usage, msg)
+
+	def assertNoLeak(self, fn, iterations = 100, tolerance = '1KB', msg = None):
+		"""
+		Assert that calling a function repeatedly doesn't retain memory.
+		The function is called once before, so that what it caches is not taken for a leak.
+		@params:
+			`fn`        : The function, without arguments
+			`iterations`: The number of calls
+			`tolerance` : The memory that may be retained by all the calls
+		@returns:
+			The `testly.memory.MemoryUsage` of the calls
+		"""
+		from . import memory
+		if memory.tracemalloc is None:
+			self.skipTest('tracemalloc is not available')
+		fn()
+		tracer = memory.Tracer()
+		tracer.start()
+		try:
+			for _ in range(iterations):
+				fn()
+		finally:
+			usage = tracer.stop()
+		if usage.retained > memory.parseSize(tolerance):
+			self._memoryFailure('%s leaked %s in %s calls (%s per call) > %s' % (
+				getattr(fn, '__name__', fn), memory.formatSize(usage.retained), iterations,
+				memory.formatSize(usage.retained // iterations),
+				memory.formatSize(memory.parseSize(tolerance))), usage, msg)
+		return usage
+
+	def benchmark(self, fn, *args, **kwargs):
+		"""
+		Time a function with warmup and an adaptive number of calls, see `testly.benchmark.measure`.
+		The stats are reported at the end of the run, as a scaling table for the rows of a test set.
+		With `benchmarkBaseline`, the median time is compared with the baseline recorded
+		by an earlier run (the first run records it), and the test fails if it is slower
+		than `benchmarkTolerance`.
+		@params:
+			`fn`: The function to time
+			`*args`, `**kwargs`: The arguments of the function
+		@returns:
+			The `testly.benchmark.Stats`
+		"""
+		from .benchmark import measure, formatTime, getStore, BaselineStore
+		stats = measure(lambda: fn(*args, **kwargs), rounds = self.benchmarkRounds, maxtime = self.benchmarkMaxTime)
+		benchmarks = self.__dict__.setdefault('_testlyBenchmarks', [])
+		name = self.id() if not benchmarks else '%s#%s' % (self.id(), len(benchmarks))
+		benchmarks.append((name, stats))
+		if self.benchmarkBaseline:
+			store = getStore(self.benchmarkBaseline if isinstance(self.benchmarkBaseline, string_types) else BaselineStore().path)
+			compared = store.compare(name, stats, self.benchmarkTolerance)
+			if compared and compared[2]:
+				self.fail('Benchmark %s is slower than its baseline: median %s != %s (%.2fx, tolerance: %s%%)' % (
+					name, formatTime(stats.median), formatTime(compared[0]), compared[1], self.benchmarkTolerance * 100))
+		return stats
+
+	def assertFasterThan(self, fn, seconds, *args, **kwargs):
+		"""
+		Assert that the median time of a function is less than seconds, see `benchmark`.
+		@params:
+			`fn`     : The function
+			`seconds`: The time limit
+			`*args`, `**kwargs`: The arguments of the function
+		@returns:
+			The `testly.benchmark.Stats`
+		"""
+		from .benchmark import formatTime
+		stats = self.benchmark(fn, *args, **kwargs)
+		if stats.median >= seconds:
+			self.fail('%s is not faster than %s: %s' % (getattr(fn, '__name__', fn), formatTime(seconds), stats))
+		return stats
+
 	def _getAssertEqualityFunc(self, first, second):
 		"""Get a detailed comparison function for the types of the two args.
 		Returns: A callable accepting (first, second, msg=None) that will
@@ -205,6 +733,12 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 
 		return self._baseAssertEqual
 
+	def _diff(self, first, second):
+		# stop the diff before it gets truncated by _truncateMessage as a whole
+		from .cdiff import CDiff
+		return '\n' + ''.join(CDiff(lineno = self.diffLineNo, theme = self.diffTheme, engine = self.diffEngine, color = self.diffColor).diff(
+			first, second, context = self.diffContext, cwidth = self.diffColWidth, maxsize = self.maxDiff - 1))
+
 	def assertMultiLineEqual(self, first, second, msg=None):
 		"""Assert that two multi-line strings are equal."""
 
@@ -215,10 +749,7 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 				'Second argument is not a string')
 
 		if first != second:
-			# don't use difflib if the strings are too long
-			if (len(first) > self._diffThreshold or
-				len(second) > self._diffThreshold):
-				self._baseAssertEqual(first, second, msg)
+			# long strings are diffed by the fast engine instead of falling back to _baseAssertEqual
 			firstlines = first.splitlines()
 			secondlines = second.splitlines()
 			if len(firstlines) == 1 and first.strip('\r\n') == first:
@@ -226,7 +757,7 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 				secondlines = [second + '\n']
 			standardMsg = '%s != %s' % (unittest.util.safe_repr(first, True),
 										unittest.util.safe_repr(second, True))
-			diff = '\n' + ''.join(CDiff(lineno = self.diffLineNo, theme = self.diffTheme).diff(firstlines, secondlines, context = self.diffContext, cwidth = self.diffColWidth))
+			diff = self._diff(firstlines, secondlines)
 			standardMsg = self._truncateMessage(standardMsg, diff)
 			self.fail(self._formatMessage(msg, standardMsg))
 
@@ -238,7 +769,10 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 
 		if d1 != d2:
 			standardMsg = '%s != %s' % (unittest.util.safe_repr(d1, True), unittest.util.safe_repr(d2, True))
-			diff = ('\n' + ''.join(CDiff(lineno = self.diffLineNo, theme = self.diffTheme).diff(list(sorted(d1.items())), list(sorted(d2.items())), context = self.diffContext, cwidth = self.diffColWidth)))
+			# only the differing paths of the (nested) dicts are reported
+			from .cdiff import CDiff
+			diff = '\n' + ''.join(CDiff(lineno = self.diffLineNo, theme = self.diffTheme, color = self.diffColor).pathdiff(
+				d1, d2, maxsize = self.maxDiff - 1))
 			standardMsg = self._truncateMessage(standardMsg, diff)
 			self.fail(self._formatMessage(msg, standardMsg))
 
@@ -338,7 +872,7 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 					differing += ('Unable to index element %d '
 								  'of second %s\n' % (len1, seq_type_name))
 		standardMsg = differing
-		diffMsg = '\n' + ''.join(CDiff(lineno = self.diffLineNo, theme = self.diffTheme).diff(seq1, seq2, context = self.diffContext, cwidth = self.diffColWidth))
+		diffMsg = self._diff(seq1, seq2)
 		standardMsg = self._truncateMessage(standardMsg, diffMsg)
 		msg = self._formatMessage(msg, standardMsg)
 		self.fail(msg)
@@ -349,6 +883,9 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 			self.fail(self._formatMessage(msg, 'The first argument is not a dict.'))
 		if not isinstance(second, dict):
 			self.fail(self._formatMessage(msg, 'The second argument is not a dict.'))
+		# the values are compared key by key, so they don't have to be hashable
+		if viewitems(first) <= viewitems(second):
+			return
 
 		dict1_repr = repr(first)
 		if len(dict1_repr) > 30:
@@ -356,23 +893,27 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 		dict2_repr = repr(second)
 		if len(dict2_repr) > 30:
 			dict2_repr = dict2_repr[:30] + '...'
-
-		for key in first.keys():
+		missing   = []
+		different = []
+		for key, value in first.items():
 			if key not in second:
-				self.fail(self._formatMessage(msg, 'Key %s from %s is not in %s' % (key, dict1_repr, dict2_repr)))
-			if first[key] != second[key]:
-				self.fail(self._formatMessage(msg, '%s and %s have different values on key %s' % (dict1_repr, dict2_repr, key)))
+				missing.append(key)
+			elif value != second[key]:
+				different.append(key)
+		standardMsg = []
+		if missing:
+			standardMsg.append('Key%s %s from %s %s not in %s' % (
+				's' if len(missing) > 1 else '', ', '.join(str(key) for key in missing),
+				dict1_repr, 'are' if len(missing) > 1 else 'is', dict2_repr))
+		if different:
+			standardMsg.append('%s and %s have different values on key%s %s' % (
+				dict1_repr, dict2_repr, 's' if len(different) > 1 else '',
+				', '.join(str(key) for key in different)))
+		self.fail(self._formatMessage(msg, '\n'.join(standardMsg)))
 	
 	def assertDictNotContains(self, first, second, msg = None):
-		isin  = True
 		first = first or {}
-		if not isinstance(first, dict) or not isinstance(second, dict):
-			isin = False
-		elif not all([key in second.keys() for key in first.keys()]):
-			isin = False
-		elif not all([first[key] == second[key] for key in first.keys()]):
-			isin = False
-		if isin:
+		if isinstance(first, dict) and isinstance(second, dict) and viewitems(first) <= viewitems(second):
 			dict1_repr = repr(first)
 			dict2_repr = repr(second)
 			if len(dict2_repr) > 30:
@@ -382,29 +923,38 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 			self.fail(msg)
 
 	def assertSeqContains(self, first, second, msg = None):
-		first = first or []
-		if not all([f in second for f in first]):
+		first   = first or []
+		missing = list(_missingItems(first, second))
+		if missing:
 			seq1_repr = repr(first)
 			seq2_repr = repr(second)
+			if len(seq1_repr) > 30:
+				seq1_repr = seq1_repr[:30] + ' ...'
 			if len(seq2_repr) > 30:
 				seq2_repr = seq2_repr[:30] + ' ...'
-			standardMsg = '%s does not contain %s' % (seq2_repr, seq1_repr)
+			missing_repr = repr(missing)
+			if len(missing_repr) > 80:
+				missing_repr = missing_repr[:80] + ' ...'
+			standardMsg = '%s does not contain %s, missing %s element(s): %s' % (
+				seq2_repr, seq1_repr, len(missing), missing_repr)
 			msg = self._formatMessage(msg, standardMsg)
 			self.fail(msg)
 	
 	def assertSeqNotContains(self, first, second, msg = None):
 		first = first or []
-		if all([f in second for f in first]):
-			seq1_repr = repr(first)
-			seq2_repr = repr(second)
-			if len(seq2_repr) > 30:
-				seq2_repr = seq2_repr[:30] + '...'
-			standardMsg = '%s contains %s' % (seq2_repr, seq1_repr)
-			msg = self._formatMessage(msg, standardMsg)
-			self.fail(msg)
+		# stops at the first missing element
+		for _ in _missingItems(first, second):
+			return
+		seq1_repr = repr(first)
+		seq2_repr = repr(second)
+		if len(seq2_repr) > 30:
+			seq2_repr = seq2_repr[:30] + '...'
+		standardMsg = '%s contains %s' % (seq2_repr, seq1_repr)
+		msg = self._formatMessage(msg, standardMsg)
+		self.fail(msg)
 
 	def assertInAny(self, s, sequence, msg = None):
-		if not any([s in seq for seq in sequence]):
+		if not any(s in seq for seq in sequence):
 			seq1_repr = repr(s)
 			seq2_repr = repr(sequence)
 			if len(seq2_repr) > 30:
@@ -414,41 +964,102 @@ class TestCase(with_metaclass(MetaTestCase, unittest.TestCase)):
 			self.fail(msg)
 
 	def assertNotInAny(self, s, sequence, msg = None):
-		if not all([s not in seq for seq in sequence]):
-			seq1_repr = repr(s)
-			seq2_repr = repr(sequence)
-			if len(seq2_repr) > 30:
-				seq2_repr = seq2_repr[:30] + '...'
-			standardMsg = '%s is in at least one element of %s\n' % (seq1_repr, seq2_repr)
-			msg = self._formatMessage(msg, standardMsg)
-			self.fail(msg)
+		for i, seq in enumerate(sequence):
+			if s in seq:
+				seq1_repr = repr(s)
+				seq2_repr = repr(sequence)
+				if len(seq2_repr) > 30:
+					seq2_repr = seq2_repr[:30] + '...'
+				standardMsg = '%s is in at least one element of %s\nElement %s: %s' % (
+					seq1_repr, seq2_repr, i, _shortRepr(seq))
+				msg = self._formatMessage(msg, standardMsg)
+				self.fail(msg)
 
 	def assertRegexAny(self, s, sequence, msg = None):
-		if not any([re.search(s, seq) for seq in sequence]):
-			seq1_repr = repr(s)
-			seq2_repr = repr(sequence)
-			if len(seq2_repr) > 30:
-				seq2_repr = seq2_repr[:30] + '...'
-			standardMsg = '%s does not match any elements of %s\n' % (seq1_repr, seq2_repr)
-			msg = self._formatMessage(msg, standardMsg)
-			self.fail(msg)
+		"""
+		Assert that a pattern matches at least one element of a sequence.
+		@params:
+			`s`: The pattern, or a list of patterns that must all match.
+				The patterns are compiled once, and the sequence is only read
+				until all of them have matched.
+			`sequence`: The sequence of strings
+		"""
+		patterns = _compilePatterns(s)
+		missing  = list(range(len(patterns)))
+		for seq in sequence:
+			missing = [i for i in missing if not patterns[i].search(seq)]
+			if not missing:
+				return
+		seq1_repr = repr(s)
+		seq2_repr = repr(sequence)
+		if len(seq2_repr) > 30:
+			seq2_repr = seq2_repr[:30] + '...'
+		standardMsg = '%s does not match any elements of %s\n' % (seq1_repr, seq2_repr)
+		if isinstance(s, (list, tuple)):
+			standardMsg += 'Missing patterns: %s\n' % ', '.join(repr(patterns[i].pattern) for i in missing)
+		msg = self._formatMessage(msg, standardMsg)
+		self.fail(msg)
 
 	def assertNotRegexAny(self, s, sequence, msg = None):
-		if not all([not re.search(s, seq) for seq in sequence]):
-			seq1_repr = repr(s)
-			seq2_repr = repr(sequence)
-			if len(seq2_repr) > 30:
-				seq2_repr = seq2_repr[:30] + '...'
-			standardMsg = '%s matches at least one element of %s\n' % (seq1_repr, seq2_repr)
-			msg = self._formatMessage(msg, standardMsg)
-			self.fail(msg)
+		"""
+		Assert that a pattern matches no element of a sequence.
+		@params:
+			`s`: The pattern, or a list of patterns, which are matched together
+				as an alternation in one pass if possible.
+			`sequence`: The sequence of strings
+		"""
+		patterns = _compilePatterns(s)
+		combined = _combinePatterns(patterns)
+		for i, seq in enumerate(sequence):
+			if combined:
+				matched = combined.search(seq)
+				matched = matched and patterns[int(matched.lastgroup[len('testly'):])]
+			else:
+				matched = next((pattern for pattern in patterns if pattern.search(seq)), None)
+			if matched:
+				seq1_repr = repr(s)
+				seq2_repr = repr(sequence)
+				if len(seq2_repr) > 30:
+					seq2_repr = seq2_repr[:30] + '...'
+				standardMsg = '%s matches at least one element of %s\nElement %s: %s matches %r\n' % (
+					seq1_repr, seq2_repr, i, _shortRepr(seq), matched.pattern)
+				msg = self._formatMessage(msg, standardMsg)
+				self.fail(msg)
 
 	assertCountEqual  = unittest.TestCase.assertCountEqual  if hasattr(unittest.TestCase, 'assertCountEqual')  else unittest.TestCase.assertItemsEqual
 	assertRaisesRegex = unittest.TestCase.assertRaisesRegex if hasattr(unittest.TestCase, 'assertRaisesRegex') else unittest.TestCase.assertRaisesRegexp
 	assertRegex       = unittest.TestCase.assertRegex       if hasattr(unittest.TestCase, 'assertRegex') else unittest.TestCase.assertRegexpMatches
 
 
+def _lazyTestSets(testCaseClass, prefix = 'test'):
+	"""The lazy test sets of a class whose names start with prefix, as `unittest.TestLoader.getTestCaseNames` does"""
+	for name in sorted(dir(testCaseClass)):
+		if not name.startswith(prefix):
+			continue
+		attr = getattr(testCaseClass, name, None)
+		if isinstance(attr, LazyTestSet) and attr.name == name:
+			yield attr
+
 class TestLoader(unittest.TestLoader):
+	suiteClass = TestSuite
+
+	def loadTestsFromTestCase(self, testCaseClass):
+		suite = super(TestLoader, self).loadTestsFromTestCase(testCaseClass)
+		if not issubclass(testCaseClass, TestCase):
+			return suite
+		lazysets = [
+			LazyTestSuite(testCaseClass, testset) for testset in _lazyTestSets(testCaseClass, self.testMethodPrefix)
+			if self._matchLazyTestSet(testCaseClass, testset)]
+		if not lazysets:
+			return suite
+		return self.suiteClass([suite] + lazysets)
+
+	def _matchLazyTestSet(self, testCaseClass, testset):
+		patterns = getattr(self, 'testNamePatterns', None)
+		if not patterns:
+			return True
+		fullName = '%s.%s.%s' % (testCaseClass.__module__, testCaseClass.__name__, testset.name)
+		return any(fnmatch.fnmatchcase(fullName, pattern) for pattern in patterns)
 
 	def loadTestsFromName(self, name, module=None): # pragma: no cover 
 		"""Return a suite of all test cases given a string specifier.
@@ -484,7 +1095,12 @@ class TestLoader(unittest.TestLoader):
 				parent, obj = obj, getattr(obj, part)
 			except AttributeError as e:
 				# We can't traverse some part of the name.
-				if (getattr(obj, '__path__', None) is not None
+				row = re.match(r'^(.+)-(\d+)$', part)
+				if (row and part == parts[-1] and isinstance(obj, type)
+					and isinstance(getattr(obj, row.group(1), None), LazyTestSet)):
+					# a test generated by a lazy data provider
+					return LazyTestSuite(obj, getattr(obj, row.group(1)), [int(row.group(2))])
+				elif (getattr(obj, '__path__', None) is not None
 					and error_case is not None):
 					# This is a package (no __path__ per importlib docs), and we
 					# encountered an error importing something. We cannot tell
@@ -495,6 +1111,7 @@ class TestLoader(unittest.TestLoader):
 					return error_case
 				else:
 					# Otherwise, we signal that an AttributeError has occurred.
+					import traceback
 					error_case, error_message = unittest.loader._make_failed_test(
 						part, e, self.suiteClass,
 						'Failed to access attribute:\n%s' % (
@@ -519,6 +1136,8 @@ class TestLoader(unittest.TestLoader):
 				return self.suiteClass([inst])
 		elif isinstance(obj, unittest.suite.TestSuite):
 			return obj
+		elif isinstance(obj, LazyTestSet):
+			return LazyTestSuite(parent, obj)
 		elif isinstance(obj, TestSet): # implies issubclass(parent, TestCase)
 			return self.suiteClass([parent(name) for name in obj.tests])
 
@@ -534,19 +1153,64 @@ class TestLoader(unittest.TestLoader):
 		else:
 			raise TypeError("don't know how to make test from: %s" % obj)
 
+def _shardArg(shard):
+	"""Check the value of --shard, so that an invalid one is reported as an error of the arguments"""
+	import argparse
+	from .shard import parseShard
+	try:
+		parseShard(shard)
+	except ValueError as ex:
+		raise argparse.ArgumentTypeError(str(ex))
+	return shard
+
 class TestProgram(unittest.TestProgram): # pragma: no cover
 
 	def __init__(self,
 		module      = '__main__',
 		defaultTest = None,
 		argv        = None,
-		testRunner  = None,
+		testRunner  = TextTestRunner,
 		testLoader  = TestLoader(),
 		exit        = True,
 		verbosity   = 1,
 		failfast    = None,
 		catchbreak  = None,
-		buffer      = None):
+		buffer      = None,
+		workers     = None,
+		splitSets   = None,
+		durations   = None,
+		durationsJson = None,
+		junitXml    = None,
+		jsonl       = None,
+		changedOnly = None,
+		failedFirst = None,
+		cacheDir    = None,
+		useCache    = None,
+		profile     = None,
+		profileSample = None,
+		profileDir  = None,
+		profileBy   = None,
+		shard       = None,
+		shardDurations = None):
+		self.workers       = workers
+		self.splitSets     = splitSets
+		self.durations     = durations
+		self.durationsJson = durationsJson
+		self.junitXml      = junitXml
+		self.jsonl         = jsonl
+		self.changedOnly   = changedOnly
+		self.failedFirst   = failedFirst
+		self.cacheDir      = cacheDir
+		self.useCache      = useCache
+		self.cache         = None
+		self.profile       = profile
+		self.profileSample = profileSample
+		self.profileDir    = profileDir
+		self.profileBy     = profileBy
+		self.shard         = shard
+		self.shardDurations = shardDurations
+		# unittest has its own --durations since python 3.12
+		extra = dict(durations = durations) if _UNITTEST_DURATIONS else {}
 		super(TestProgram, self).__init__(
 			module      = module,
 			defaultTest = defaultTest,
@@ -557,9 +1221,132 @@ class TestProgram(unittest.TestProgram): # pragma: no cover
 			verbosity   = verbosity,
 			failfast    = failfast,
 			catchbreak  = catchbreak,
-			buffer      = buffer
+			buffer      = buffer,
+			**extra
 		)
 
+	def _getParentArgParser(self):
+		parser = super(TestProgram, self)._getParentArgParser()
+		if self.workers is None:
+			parser.add_argument('--workers', dest='workers', type=int,
+								help='Run tests in N worker processes')
+			self.workers = 1
+		if self.splitSets is None:
+			parser.add_argument('--split-sets', dest='splitSets', action='store_true',
+								help='Allow tests of a test set to be run by different workers')
+			self.splitSets = False
+		if self.durations is None and not _UNITTEST_DURATIONS:
+			parser.add_argument('--durations', dest='durations', type=int, metavar='N',
+								help='Show the N slowest tests and test sets (N=0 for all)')
+		if self.durationsJson is None:
+			parser.add_argument('--durations-json', dest='durationsJson', metavar='PATH',
+								help='Write the wall and CPU time of the tests to a json file')
+		if self.junitXml is None:
+			parser.add_argument('--junit-xml', dest='junitXml', metavar='PATH',
+								help='Write the results to a JUnit xml file as the tests complete')
+		if self.jsonl is None:
+			parser.add_argument('--jsonl', dest='jsonl', metavar='PATH',
+								help='Write the results to a json-lines file as the tests complete')
+		if self.changedOnly is None:
+			parser.add_argument('--changed-only', dest='changedOnly', action='store_true',
+								help='Only run the tests that are new, changed or failed last time')
+			self.changedOnly = False
+		if self.failedFirst is None:
+			parser.add_argument('--failed-first', dest='failedFirst', action='store_true',
+								help='Run the tests that failed last time first')
+			self.failedFirst = False
+		if self.useCache is None:
+			parser.add_argument('--cache', dest='useCache', action='store_true',
+								help='Record the results in the cache for --changed-only and --failed-first')
+			self.useCache = False
+		if self.profile is None:
+			parser.add_argument('--profile', dest='profile', action='store_true',
+								help='Profile each test by cProfile, and print the hottest functions')
+			self.profile = False
+		if self.profileSample is None:
+			parser.add_argument('--profile-sample', dest='profileSample', action='store_true',
+								help='Profile each test by sampling its stack, and print the hottest functions')
+			self.profileSample = False
+		if self.profileDir is None:
+			parser.add_argument('--profile-dir', dest='profileDir', metavar='PATH',
+								help='Write the profiles to this directory (default: .testly_profile)')
+		if self.profileBy is None:
+			parser.add_argument('--profile-by', dest='profileBy', choices=['test', 'set'],
+								help='Profile each test (default) or each test set separately')
+		if self.shard is None:
+			parser.add_argument('--shard', dest='shard', metavar='INDEX/TOTAL', type=_shardArg,
+								help='Only run the INDEX-th (from 1) of TOTAL shards of the tests, i.e. on a node of the CI')
+		if self.shardDurations is None:
+			parser.add_argument('--shard-durations', dest='shardDurations', metavar='PATH',
+								help='Balance the shards by the durations in this json file from --durations-json')
+		return parser
+
+	def runTests(self):
+		# before the cache selects the tests, so that it only forgets the results of the tests of this shard
+		if self.shard:
+			self._selectShard()
+		if self.changedOnly or self.failedFirst or self.useCache:
+			from .cache import CACHE_DIR, ResultCache
+			self.cache = ResultCache(self.cacheDir or CACHE_DIR)
+			self.test  = self.cache.select(self.test, self.changedOnly, self.failedFirst)
+			sys.stderr.write(self.cache.summary() + '\n')
+		if self.workers and self.workers > 1 and (self.profile or self.profileSample):
+			sys.stderr.write('testly: the tests are profiled in this process, --workers is ignored.\n')
+			self.workers = 1
+		if self.workers and self.workers > 1:
+			from .parallel import ParallelSuite
+			self.test = ParallelSuite([self.test], workers = self.workers, splitSets = self.splitSets)
+		if isinstance(self.testRunner, type) and issubclass(self.testRunner, TextTestRunner):
+			self.testRunner = self._makeRunner()
+		super(TestProgram, self).runTests()
+
+	def _selectShard(self):
+		from .shard import parseShard, loadDurations, selectShard, units
+		index, total = parseShard(self.shard)
+		durations = {}
+		if self.shardDurations and path.isfile(self.shardDurations):
+			durations = loadDurations(self.shardDurations)
+		elif self.shardDurations:
+			sys.stderr.write('testly: %s does not exist, the tests are sharded by their names.\n' % self.shardDurations)
+		count = len(units(self.test))
+		self.test, estimated = selectShard(self.test, index, total, durations)
+		sys.stderr.write('testly shard %s: %s of %s tests and test sets%s.\n' % (
+			self.shard, len(units(self.test)), count,
+			', about %.2fs by the durations of the last run' % estimated if durations else ''))
+
+	def _makeRunner(self):
+		from .reporters import JUnitXmlReporter, JsonLinesReporter
+		reporters = []
+		if self.junitXml:
+			reporters.append(JUnitXmlReporter(self.junitXml))
+		if self.jsonl:
+			reporters.append(JsonLinesReporter(self.jsonl))
+		if self.cache:
+			reporters.append(self.cache.reporter())
+		profiler = None
+		if self.profile or self.profileSample:
+			from .profiler import PROFILE_DIR, CProfiler, SamplingProfiler
+			profiler = (CProfiler if self.profile else SamplingProfiler)(
+				self.profileDir or PROFILE_DIR, self.profileBy or 'test')
+		kwargs = dict(
+			verbosity     = self.verbosity,
+			failfast      = self.failfast,
+			buffer        = self.buffer,
+			durations     = self.durations,
+			durationsJson = self.durationsJson,
+			reporters     = reporters,
+			profiler      = profiler)
+		# not available in python2
+		for key in ('warnings', 'tb_locals'):
+			if hasattr(self, key):
+				kwargs[key] = getattr(self, key)
+		return self.testRunner(**kwargs)
+
 main   = TestProgram
 skip   = unittest.skip
 skipIf = unittest.skipIf
+
+if sys.version_info < (3, 7): # pragma: no cover
+	# no module __getattr__ before python 3.7
+	for _name in _LAZY:
+		globals()[_name] = _lazy(_name)
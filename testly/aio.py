@@ -0,0 +1,78 @@
+"""
+Support of async test methods and async data providers,
+which run on an event loop shared by the tests of a class
+"""
+import threading
+
+# the flags of the code of async functions and async generators, see `inspect`,
+# checked directly so that neither inspect nor asyncio is imported until an async test runs
+CO_COROUTINE       = 0x80
+CO_ASYNC_GENERATOR = 0x200
+
+def _check(flag):
+	def check(func):
+		code = getattr(getattr(func, '__func__', func), '__code__', None)
+		return code is not None and bool(code.co_flags & flag)
+	return check
+
+iscoroutinefunction = _check(CO_COROUTINE)
+isasyncgenfunction  = _check(CO_ASYNC_GENERATOR)
+# whether the current thread is running a row of a `testly.batch.RowBatch`
+batchThread = threading.local()
+
+def available():
+	"""Whether asyncio is available, it is not on python2"""
+	try:
+		import asyncio
+	except ImportError: # pragma: no cover
+		return False
+	return True
+
+def newLoop():
+	import asyncio
+	return asyncio.new_event_loop()
+
+def getLoop(klass):
+	"""Get the event loop of a test class, create it if it doesn't exist or has been closed"""
+	loop = klass.__dict__.get('_testlyLoop')
+	if loop is None or loop.is_closed():
+		loop = newLoop()
+		klass._testlyLoop = loop
+	return loop
+
+def closeLoop(klass):
+	"""Close the event loop of a test class, if any"""
+	loop = klass.__dict__.get('_testlyLoop')
+	if loop is None:
+		return
+	klass._testlyLoop = None
+	if not loop.is_closed():
+		try:
+			loop.run_until_complete(loop.shutdown_asyncgens())
+		finally:
+			loop.close()
+
+def runOn(loop, coro):
+	"""
+	Run a coroutine on the loop until it completes.
+	When running the rows of a `testly.batch.RowBatch`, the loop is run by the main thread,
+	so the coroutine is sent to it instead.
+	"""
+	if getattr(batchThread, 'running', False):
+		import asyncio
+		return asyncio.run_coroutine_threadsafe(coro, loop).result()
+	return loop.run_until_complete(coro)
+
+def iterAsync(agen, loop):
+	"""Iterate an async generator synchronously, on the loop"""
+	anext = type(agen).__anext__
+	try:
+		while True:
+			try:
+				item = runOn(loop, anext(agen))
+			except StopAsyncIteration:
+				break
+			yield item
+	finally:
+		if not loop.is_closed():
+			runOn(loop, agen.aclose())
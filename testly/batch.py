@@ -0,0 +1,147 @@
+"""
+Run the rows of a test set concurrently in a thread pool
+"""
+import sys, threading
+from multiprocessing.pool import ThreadPool
+from six import StringIO
+from .result import RecordingResult, replay
+from . import aio
+
+# the buffers of the row running in each thread, with `buffer`
+_buffers = threading.local()
+
+def concurrent(n):
+	"""
+	Run the rows of the test set generated for the test method concurrently,
+	with at most n of them at the same time. Overrides the `concurrency` of the class.
+	"""
+	def decorator(func):
+		func.concurrency = n
+		return func
+	return decorator
+
+class _ThreadStream(object):
+	"""
+	Stands for sys.stdout or sys.stderr while a batch runs with `buffer`,
+	writing to the buffer of the row running in the thread, if any
+	"""
+
+	def __init__(self, stream, name):
+		self.stream = stream
+		self.name   = name
+
+	def _target(self):
+		return getattr(_buffers, self.name, None) or self.stream
+
+	def write(self, s):
+		return self._target().write(s)
+
+	def __getattr__(self, name):
+		return getattr(self._target(), name)
+
+class _RowResult(RecordingResult):
+	"""
+	Records a row, buffering its output as `unittest.TestResult` does with `buffer`,
+	but for the thread it runs in, rather than by replacing sys.stdout and sys.stderr
+	"""
+
+	def _setupStdout(self):
+		if self.buffer:
+			if self._stdout_buffer is None:
+				self._stdout_buffer = StringIO()
+				self._stderr_buffer = StringIO()
+			_buffers.stdout = self._stdout_buffer
+			_buffers.stderr = self._stderr_buffer
+
+	def _restoreStdout(self):
+		if not self.buffer:
+			return
+		# the output of the failures is mirrored to the streams the batch runs with
+		_buffers.stdout = _buffers.stderr = None
+		if self._mirrorOutput:
+			output = self._stdout_buffer.getvalue()
+			error  = self._stderr_buffer.getvalue()
+			if output:
+				if not output.endswith('\n'):
+					output += '\n'
+				self._original_stdout.write(output)
+			if error:
+				if not error.endswith('\n'):
+					error += '\n'
+				self._original_stderr.write(error)
+		for buf in (self._stdout_buffer, self._stderr_buffer):
+			buf.seek(0)
+			buf.truncate()
+
+class RowBatch(object):
+	"""
+	The rows of a test set that run concurrently: up to `concurrency` of them are run at the
+	same time in a thread pool. The event loop of the class runs in the main thread meanwhile,
+	so that the coroutines of the rows overlap on it. Each row is recorded, and replayed into
+	the result when it is its turn to run (see `TestCase.run`), so the results are reported in order.
+	A row is only started once a thread is free, and no more rows are started once a row
+	stops the result, i.e. with `failfast`.
+	"""
+
+	def __init__(self, tests, concurrency):
+		self.tests       = tests
+		self.concurrency = concurrency
+		self.events      = None
+		self.failfast    = False
+		self.buffer      = False
+		self.stopped     = False
+		self.slots       = None
+
+	def _run(self, test):
+		result = _RowResult()
+		result.failfast = self.failfast
+		result.buffer   = self.buffer
+		aio.batchThread.running = True
+		try:
+			test._runRecorded(result)
+		finally:
+			aio.batchThread.running = False
+			if result.shouldStop:
+				self.stopped = True
+			self.slots.release()
+		return result.events
+
+	def _runAll(self, pool, result):
+		"""Start the rows one by one as the threads are free, until the batch or the result stops"""
+		pending = []
+		for test in self.tests:
+			self.slots.acquire()
+			if self.stopped or getattr(result, 'shouldStop', False):
+				break
+			pending.append((test, pool.apply_async(self._run, (test, ))))
+		return dict((id(test), events.get()) for test, events in pending)
+
+	def runBatch(self, result):
+		# the rows share the context of their test set
+		for test in self.tests[1:]:
+			test.setContext = self.tests[0].setContext
+		self.failfast = getattr(result, 'failfast', False)
+		self.buffer   = getattr(result, 'buffer', False)
+		size          = min(self.concurrency, len(self.tests))
+		self.slots    = threading.Semaphore(size)
+		streams       = sys.stdout, sys.stderr
+		if self.buffer:
+			sys.stdout = _ThreadStream(streams[0], 'stdout')
+			sys.stderr = _ThreadStream(streams[1], 'stderr')
+		pool = ThreadPool(size)
+		try:
+			if not aio.available():
+				self.events = self._runAll(pool, result)
+			else:
+				loop = aio.getLoop(self.tests[0].__class__)
+				self.events = loop.run_until_complete(loop.run_in_executor(None, self._runAll, pool, result))
+		finally:
+			pool.terminate()
+			pool.join()
+			sys.stdout, sys.stderr = streams
+
+	def replay(self, test, result):
+		if self.events is None:
+			self.runBatch(result)
+		# nothing is replayed for the rows not started once the batch stopped
+		replay(self.events.pop(id(test), ()), result, {test.id(): test})
@@ -0,0 +1,132 @@
+"""
+Benchmarks inside the tests: timing of functions and baselines to compare them with
+"""
+import os, json, math, timeit, threading
+from .cache import CACHE_DIR
+
+class Stats(dict):
+	"""
+	The statistics of a benchmark, in seconds per call:
+	`min`, `median`, `mean` and `stddev`, measured in `rounds` rounds of `number` calls.
+	It is a dict, so that it can be pickled and dumped as json.
+	"""
+
+	def __getattr__(self, name):
+		try:
+			return self[name]
+		except KeyError:
+			raise AttributeError(name)
+
+	def __str__(self):
+		return 'min %s, median %s, stddev %s (%s x %s calls)' % (
+			formatTime(self['min']), formatTime(self['median']), formatTime(self['stddev']),
+			self['rounds'], self['number'])
+
+def formatTime(seconds):
+	"""Format a time with a unit that fits it"""
+	for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+		if seconds >= scale:
+			return '%.3g%s' % (seconds / scale, unit)
+	return '%.3gns' % (seconds / 1e-9)
+
+def measure(func, warmup = 1, mintime = .01, rounds = 5, maxtime = 1.0, maxnumber = 1 << 20):
+	"""
+	Time a function.
+	@params:
+		`func`     : The function to time, without arguments
+		`warmup`   : The number of calls before timing
+		`mintime`  : The min time of a round: the number of calls in each round is increased until reaching it
+		`rounds`   : The number of rounds to time. Fewer rounds (at least 1) are timed if they take longer than `maxtime`
+		`maxtime`  : The time to spend on the rounds
+		`maxnumber`: The max number of calls in a round
+	@returns:
+		The `Stats` of the function
+	"""
+	timer = timeit.Timer(func)
+	if warmup:
+		timer.timeit(warmup)
+	number = 1
+	while True:
+		elapsed = timer.timeit(number)
+		if elapsed >= mintime or number >= maxnumber:
+			break
+		# estimate the number of calls needed, but grow by at most 10 times a round
+		number = min(number * 10, maxnumber, max(number * 2, int(number * mintime / max(elapsed, 1e-9)) + 1))
+	times = [elapsed / number]
+	spent = elapsed
+	while len(times) < rounds and spent < maxtime:
+		elapsed = timer.timeit(number)
+		spent  += elapsed
+		times.append(elapsed / number)
+	times.sort()
+	mean   = sum(times) / len(times)
+	middle = len(times) // 2
+	return Stats(
+		min    = times[0],
+		median = times[middle] if len(times) % 2 else (times[middle - 1] + times[middle]) / 2.0,
+		mean   = mean,
+		stddev = math.sqrt(sum((t - mean) ** 2 for t in times) / (len(times) - 1)) if len(times) > 1 else 0.0,
+		number = number,
+		rounds = len(times))
+
+class BaselineStore(object):
+	"""
+	The stats of the benchmarks recorded by earlier runs, saved as a json file
+	of benchmark name to stats, which can be committed with the tests.
+	"""
+	_lock = threading.Lock()
+
+	def __init__(self, path = os.path.join(CACHE_DIR, 'benchmarks.json')):
+		self.path      = path
+		self.baselines = None
+
+	def _load(self):
+		if self.baselines is None:
+			self.baselines = {}
+			if os.path.isfile(self.path):
+				try:
+					with open(self.path) as f:
+						self.baselines = json.load(f)
+				except ValueError:
+					pass
+
+	def get(self, name):
+		with BaselineStore._lock:
+			self._load()
+			return self.baselines.get(name)
+
+	def record(self, name, stats):
+		"""Record the stats as the baseline of the benchmark, and save the store"""
+		with BaselineStore._lock:
+			self._load()
+			self.baselines[name] = dict(stats)
+			dirname = os.path.dirname(self.path)
+			if dirname and not os.path.isdir(dirname):
+				os.makedirs(dirname)
+			tmpfile = '%s.%s.tmp' % (self.path, os.getpid())
+			with open(tmpfile, 'w') as f:
+				json.dump(self.baselines, f, indent = 1, sort_keys = True)
+			if os.path.exists(self.path):
+				os.remove(self.path)
+			os.rename(tmpfile, self.path)
+
+	def compare(self, name, stats, tolerance, metric = 'median'):
+		"""
+		Compare the stats with the baseline, which is recorded if it doesn't exist.
+		@returns:
+			None if there is no baseline, otherwise (the baseline time, the ratio of the time to it, whether it is slower than the tolerance)
+		"""
+		baseline = self.get(name)
+		if baseline is None:
+			self.record(name, stats)
+			return None
+		ratio = stats[metric] / baseline[metric] if baseline[metric] else float('inf')
+		return baseline[metric], ratio, ratio > 1 + tolerance
+
+_stores = {}
+def getStore(path):
+	"""Get the store of the baselines saved at path, shared by the tests"""
+	with BaselineStore._lock:
+		if path not in _stores:
+			_stores[path] = BaselineStore(path)
+		return _stores[path]
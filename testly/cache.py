@@ -0,0 +1,249 @@
+"""
+A cache of the results of the tests, so that only the tests that changed
+or failed last time have to be run again
+"""
+import os, json, glob, pickle, hashlib, inspect, unittest
+from functools import wraps
+from .reporters import Reporter
+
+CACHE_DIR = '.testly_cache'
+# the outcomes that don't have to be run again
+PASSED    = ('success', 'skip', 'expectedFailure')
+
+_sources = {}
+def _source(func):
+	if func is None:
+		return ''
+	func = getattr(func, '__func__', func)
+	if func in _sources:
+		return _sources[func]
+	try:
+		ret = inspect.getsource(func)
+	except (IOError, OSError, TypeError):
+		code = getattr(func, '__code__', None)
+		ret  = repr((code.co_code, code.co_consts)) if code else repr(func)
+	_sources[func] = ret
+	return ret
+
+def testKey(test):
+	"""
+	The key of a test in the cache: a hash of the source of the test method,
+	the source of its data provider and the repr of the arguments of its row.
+	None if it cannot be computed, so that the test is always run.
+	"""
+	name   = getattr(test, '_testMethodName', None)
+	method = getattr(test, name, None) if name else None
+	if method is None or getattr(test, '_testlyRow', None):
+		return None
+	try:
+		parts = (
+			_source(getattr(method, 'testlyFunc', method)),
+			_source(getattr(method, 'testlyProvider', None)),
+			repr(getattr(method, 'testlyArgs', None)))
+	except Exception:
+		return None
+	digest = hashlib.sha1()
+	for part in parts:
+		digest.update(part.encode('utf-8'))
+	return digest.hexdigest()
+
+def _flatten(suite):
+	from . import LazyTestSuite
+	for test in suite:
+		if isinstance(test, (LazyTestSuite, unittest.TestCase)) or not isinstance(test, unittest.TestSuite):
+			yield test
+		else:
+			for t in _flatten(test):
+				yield t
+
+class CacheReporter(Reporter):
+	"""Records the results in the cache, which is saved when the run stops"""
+
+	def __init__(self, cache):
+		self.cache = cache
+
+	def addResult(self, test, outcome, text, wall, cpu):
+		self.cache.results[test.id()] = [testKey(test), outcome]
+
+	def stopTestRun(self):
+		self.cache.save()
+
+class ResultCache(object):
+	"""
+	The results of the last runs, saved as `results.json` in the cache directory,
+	as a dict of test id to [key, outcome], see `testKey`.
+	"""
+
+	def __init__(self, cachedir = CACHE_DIR):
+		self.cachedir = cachedir
+		self.path     = os.path.join(cachedir, 'results.json')
+		self.results  = {}
+		self.stats    = dict(new = 0, changed = 0, failed = 0, passed = 0, lazy = 0, notrun = 0)
+		if os.path.isfile(self.path):
+			try:
+				with open(self.path) as f:
+					self.results = json.load(f)
+			except ValueError:
+				# broken cache, start over
+				self.results = {}
+
+	def save(self):
+		if not os.path.isdir(self.cachedir):
+			os.makedirs(self.cachedir)
+		tmpfile = self.path + '.tmp'
+		with open(tmpfile, 'w') as f:
+			json.dump(self.results, f)
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(tmpfile, self.path)
+
+	def status(self, test):
+		"""
+		The status of a test: new, changed (its key changed),
+		failed (last time) or passed (unchanged and passed last time)
+		"""
+		result = self.results.get(test.id())
+		if result is None:
+			return 'new'
+		key = testKey(test)
+		if key is None or key != result[0]:
+			return 'changed'
+		return 'passed' if result[1] in PASSED else 'failed'
+
+	def reporter(self):
+		return CacheReporter(self)
+
+	def select(self, suite, changedOnly = False, failedFirst = False):
+		"""
+		Select the tests to run.
+		The tests of a test set go together: they are all run if any of them has to,
+		so that `isFirst()`/`isLast()` still hold. Lazy test sets are always run,
+		as their rows are unknown until they are running.
+		@params:
+			`suite`      : The suite of the tests
+			`changedOnly`: Only run the tests that are new, changed or failed last time
+			`failedFirst`: Run the tests that failed last time first
+		@returns:
+			The suite of the selected tests
+		"""
+		from . import LazyTestSuite, TestSuite
+		groups = []
+		bySet  = {}
+		failed = set(testid for testid, result in self.results.items() if result[1] not in PASSED)
+		for test in _flatten(suite):
+			if isinstance(test, LazyTestSuite):
+				self.stats['lazy'] += 1
+				prefix = '%s.%s-' % (unittest.util.strclass(test.testCaseClass), test.testset.name)
+				groups.append([[test], ['lazy'], any(testid.startswith(prefix) for testid in failed)])
+				continue
+			status = self.status(test)
+			self.stats[status] += 1
+			isOfSet = getattr(test, 'isOfSet', None)
+			if isOfSet and isOfSet():
+				setkey = (test.__class__, test.setName())
+				if setkey not in bySet:
+					bySet[setkey] = [[], [], False]
+					groups.append(bySet[setkey])
+				group = bySet[setkey]
+			else:
+				group = [[], [], False]
+				groups.append(group)
+			group[0].append(test)
+			group[1].append(status)
+			group[2] = group[2] or test.id() in failed
+
+		if changedOnly:
+			selected = []
+			for group in groups:
+				if all(status == 'passed' for status in group[1]):
+					self.stats['notrun'] += len(group[0])
+				else:
+					selected.append(group)
+			groups = selected
+		if failedFirst:
+			groups = [group for group in groups if group[2]] + [group for group in groups if not group[2]]
+
+		tests = [test for group in groups for test in group[0]]
+		# forget the results of the tests to run, in case they end up not being run
+		for test in tests:
+			if not isinstance(test, LazyTestSuite):
+				self.results.pop(test.id(), None)
+		return TestSuite(tests)
+
+	def summary(self):
+		return ('testly cache: %(new)s new, %(changed)s changed, %(failed)s failed last time, '
+			'%(passed)s unchanged and passed, %(lazy)s lazy test sets; %(notrun)s tests not run.') % self.stats
+
+def _providerKey(func, dependsOn):
+	digest = hashlib.sha1(_source(func).encode('utf-8'))
+	for dep in dependsOn:
+		try:
+			stat = os.stat(dep)
+			digest.update(('%s:%s:%r' % (dep, stat.st_size, stat.st_mtime)).encode('utf-8'))
+		except OSError:
+			digest.update(('%s:missing' % dep).encode('utf-8'))
+	return digest.hexdigest()
+
+def _loadRows(cachefile):
+	"""Load the rows one by one, instead of the whole list at once"""
+	with open(cachefile, 'rb') as f:
+		while True:
+			try:
+				yield pickle.load(f)
+			except EOFError:
+				break
+
+def _saveRows(rows, cachefile):
+	"""Pass the rows through, and save them to the cache file once all of them are generated"""
+	tmpfile = '%s.%s.tmp' % (cachefile, os.getpid())
+	f       = open(tmpfile, 'wb')
+	try:
+		for row in rows:
+			if f:
+				try:
+					pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+				except (pickle.PicklingError, TypeError, AttributeError):
+					# not picklable, just don't cache
+					f.close()
+					f = None
+			yield row
+		if f:
+			f.close()
+			f = None
+			for oldfile in glob.glob(cachefile.rpartition('-')[0] + '-*.pickle'):
+				os.remove(oldfile)
+			os.rename(tmpfile, cachefile)
+	finally:
+		# not all the rows are generated
+		if f:
+			f.close()
+		if os.path.exists(tmpfile):
+			os.remove(tmpfile)
+
+def cachedProvider(dependsOn = None, cacheDir = None):
+	"""
+	Cache the rows of a data provider on disk, in the `providers` directory under `cacheDir`
+	(default: `.testly_cache`), so that later runs don't have to generate them again.
+	The rows are generated again when the source of the provider or any of the files it
+	depends on changes. The rows must be picklable, otherwise they are not cached.
+	@params:
+		`dependsOn`: The files that the rows depend on
+		`cacheDir` : The cache directory
+	"""
+	dependsOn = list(dependsOn or [])
+	def decorator(func):
+		@wraps(func)
+		def provider(box):
+			cachedir  = os.path.join(cacheDir or CACHE_DIR, 'providers')
+			cachefile = os.path.join(cachedir, '%s.%s-%s.pickle' % (
+				func.__module__, getattr(func, '__qualname__', func.__name__), _providerKey(func, dependsOn)))
+			if os.path.isfile(cachefile):
+				return _loadRows(cachefile)
+			try:
+				os.makedirs(cachedir)
+			except OSError:
+				# exists, or created by another process
+				pass
+			return _saveRows(func(box), cachefile)
+		return provider
+	return decorator
@@ -0,0 +1,164 @@
+"""
+Capture the output written to the file descriptors of stdout and stderr for `testly.TestCase.assertStdOE`,
+including the output of C extensions and subprocesses
+"""
+import io, os, sys, codecs, threading
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+CHUNK = 1 << 16
+# how long to wait for the rest of the output in the pipe once the file descriptor is restored,
+# longer only if the subprocesses that inherited the pipe still write to it
+DRAIN_TIMEOUT = .2
+
+class Captured(object):
+	"""
+	The output captured from a file descriptor, kept in a spooled temporary file:
+	in memory up to `maxsize` bytes, then on disk. Rather than as a whole, it is read
+	by chunks or lines as it is needed, or only its tail.
+	"""
+
+	def __init__(self, maxsize = 1 << 20, encoding = 'utf-8'):
+		self.file     = SpooledTemporaryFile(max_size = maxsize)
+		self.maxsize  = maxsize
+		self.encoding = encoding
+		self.size     = 0
+		self.lock     = threading.Lock()
+
+	def write(self, data):
+		with self.lock:
+			# the output of the subprocesses still running after the test is done is dropped
+			if self.file.closed:
+				return
+			self.file.seek(0, 2)
+			self.file.write(data)
+			self.size += len(data)
+
+	def _read(self, offset, size):
+		with self.lock:
+			self.file.seek(offset)
+			return self.file.read(size)
+
+	@property
+	def spilled(self):
+		"""Whether the output has been written to disk"""
+		return self.size > self.maxsize
+
+	def chunks(self, size = CHUNK):
+		"""Iterate the output as strings of about `size` bytes"""
+		decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+		offset  = 0
+		while True:
+			data = self._read(offset, size)
+			offset += len(data)
+			text = decoder.decode(data, not data)
+			if text:
+				yield text
+			if not data:
+				break
+
+	def __iter__(self):
+		"""Iterate the lines of the output, with their line endings"""
+		rest = ''
+		for chunk in self.chunks():
+			lines = (rest + chunk).split('\n')
+			rest  = lines.pop()
+			for line in lines:
+				yield line + '\n'
+		if rest:
+			yield rest
+
+	def tail(self, n = 10):
+		"""The last n lines of the output, without their line endings, read from the end"""
+		offset = self.size
+		data   = b''
+		# one more line break than the lines, as the first line read is likely to be cut
+		while offset > 0 and data.count(b'\n') <= n:
+			start  = max(offset - CHUNK, 0)
+			data   = self._read(start, offset - start) + data
+			offset = start
+		return data.decode(self.encoding, 'replace').splitlines()[-n:] if n else []
+
+	def getvalue(self):
+		"""The whole output as a string, as `StringIO.getvalue`"""
+		return ''.join(self.chunks())
+
+	def close(self):
+		with self.lock:
+			self.file.close()
+
+class FdCapture(object):
+	"""Redirect a file descriptor to a pipe, which a background thread drains into a `Captured`"""
+
+	def __init__(self, fd, captured):
+		self.fd       = fd
+		self.captured = captured
+		self.saved    = None
+		self.thread   = None
+
+	def _drain(self, reader):
+		try:
+			while True:
+				data = os.read(reader, CHUNK)
+				if not data:
+					break
+				self.captured.write(data)
+		finally:
+			os.close(reader)
+
+	def start(self):
+		reader, writer = os.pipe()
+		self.saved = os.dup(self.fd)
+		os.dup2(writer, self.fd)
+		os.close(writer)
+		self.thread = threading.Thread(target = self._drain, args = (reader, ), name = 'testly-capture-%s' % self.fd)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		# the pipe is closed once the file descriptor is restored, unless the subprocesses started meanwhile
+		# still have it open: then the thread keeps draining it in the background until they are done
+		os.dup2(self.saved, self.fd)
+		os.close(self.saved)
+		self.thread.join(DRAIN_TIMEOUT)
+
+def _open(fd, encoding):
+	"""A stream writing to a copy of the file descriptor, to stand for sys.stdout or sys.stderr"""
+	if sys.version_info[0] < 3: # pragma: no cover
+		# python2 writes bytes to sys.stdout
+		return os.fdopen(os.dup(fd), 'w', 1)
+	return io.open(os.dup(fd), 'w', buffering = 1, encoding = encoding)
+
+@contextmanager
+def captureFds(maxsize = 1 << 20, encoding = 'utf-8'):
+	"""
+	Capture the output written to the file descriptors 1 and 2,
+	and by `sys.stdout` and `sys.stderr`, which write to them meanwhile.
+	@params:
+		`maxsize` : The size of the output kept in memory, before it is written to disk
+		`encoding`: The encoding of the output
+	@yields:
+		The `Captured` stdout and stderr
+	"""
+	out, err = Captured(maxsize, encoding), Captured(maxsize, encoding)
+	streams  = sys.stdout, sys.stderr
+	captures = []
+	for stream in streams:
+		stream.flush()
+	try:
+		for fd, captured in ((1, out), (2, err)):
+			capture = FdCapture(fd, captured)
+			capture.start()
+			captures.append(capture)
+		sys.stdout = _open(1, encoding)
+		sys.stderr = _open(2, encoding)
+		yield out, err
+	finally:
+		# closed, so that they don't keep the pipes open
+		if sys.stdout is not streams[0]:
+			sys.stdout.close()
+		if sys.stderr is not streams[1]:
+			sys.stderr.close()
+		sys.stdout, sys.stderr = streams
+		for capture in captures:
+			capture.stop()
@@ -1,8 +1,20 @@
 from __future__ import print_function
-import difflib, itertools
+import os, sys, difflib, itertools, bisect, re
+from six import string_types, viewkeys, viewitems
 
 DEFAULT_CONSOLE_WIDTH = 160
 MIN_CONSOLE_WIDTH     = 80
+# room reserved for the footer when the diff is truncated
+FOOTER_SIZE           = 64
+# the "auto" engine switches to the fast one when the inputs have more characters than this,
+# the same as unittest.TestCase._diffThreshold
+AUTO_ENGINE_THRESHOLD = 2**16
+
+ANSI_REGEX = re.compile(r'\x1b\[[0-9;]*m')
+
+def stripColors(s):
+	"""Remove the ANSI color codes from a string"""
+	return ANSI_REGEX.sub('', s)
 
 class Colors(object):
 	none      = ''
@@ -71,13 +83,425 @@ class Theme(object):
 		'sep'   : Colors.darkgray,
 	}
 
+	# the kinds of fragments to color
+	KINDS  = ('delete', 'insert', 'equal', 'change', 'lineno', 'sep')
+	THEMES = {
+		'default' : DEFAULT,
+		'bright'  : BRIGHT,
+		'contrast': CONTRAST,
+		'plain'   : PLAIN,
+	}
+
+	@staticmethod
+	def register(name, colors, base = 'default'):
+		"""
+		Register a theme, which can be used by its name afterwards.
+		@params:
+			`name`  : The name of the theme
+			`colors`: A dict of the kinds in `Theme.KINDS` to their color codes
+			`base`  : The theme where the missing kinds are taken from
+		"""
+		unknown = set(colors) - set(Theme.KINDS)
+		if unknown:
+			raise ValueError('Unknown kinds of fragments: %s' % ', '.join(sorted(unknown)))
+		theme = dict(Theme.THEMES[base])
+		theme.update(colors)
+		Theme.THEMES[name] = theme
+
 	def __init__(self, theme = 'default'):
-		self.theme = theme
+		if theme not in Theme.THEMES:
+			raise ValueError('Unknown theme %r, expect one of: %s' % (theme, ', '.join(sorted(Theme.THEMES))))
+		self.theme    = theme
+		# the tables the renderers are compiled from
+		self.prefixes = dict(Theme.THEMES[theme])
+		self.suffixes = dict((kind, Colors.end) for kind in Theme.KINDS)
 
 	def __getattr__(self, name):
-		def color(s):
-			return getattr(Theme, self.theme.upper())[name] + s + Colors.end
-		return color
+		# kept for compatibility: the theme used to color the fragments itself, i.e. `Theme('default').insert(s)`
+		if name not in Theme.KINDS or 'prefixes' not in self.__dict__:
+			raise AttributeError(name)
+		prefix, suffix = self.prefixes[name], self.suffixes[name]
+		return lambda s: prefix + s + suffix
+
+def _identity(s):
+	return s
+
+class Renderer(object):
+	"""
+	Renders the fragments of a diff. Each kind of fragment in `Theme.KINDS` has a method
+	to render it, i.e. `renderer.insert(s)`, and `render(segments)` renders a line of
+	(kind, text) segments, where unchanged text is of kind "equal" and is not colored.
+	The fragments are rendered as they are, unless a subclass renders them otherwise.
+	"""
+
+	def __init__(self, theme = 'default'):
+		self.theme = theme if isinstance(theme, Theme) else Theme(theme)
+		for kind in Theme.KINDS:
+			setattr(self, kind, _identity)
+
+	def mark(self, segments):
+		"""Mark the segments of a line before it is wrapped, so that the marks count in its width"""
+		return segments
+
+	def render(self, segments):
+		return ''.join(text if kind == 'equal' else getattr(self, kind)(text) for kind, text in segments)
+
+class AnsiRenderer(Renderer):
+	"""Renders with the ANSI color codes of the theme"""
+
+	def __init__(self, theme = 'default'):
+		super(AnsiRenderer, self).__init__(theme)
+		for kind in Theme.KINDS:
+			# compiled once, so rendering a fragment is a single string formatting
+			fmt = self.theme.prefixes[kind].replace('%', '%%') + '%s' + self.theme.suffixes[kind].replace('%', '%%')
+			setattr(self, kind, fmt.__mod__)
+		self.formats = dict(
+			(kind, self.theme.prefixes[kind] + '%s' + self.theme.suffixes[kind])
+			for kind in ('insert', 'delete', 'change'))
+		self.formats['equal'] = '%s'
+
+	def render(self, segments):
+		formats = self.formats
+		return ''.join(formats[kind] % text for kind, text in segments)
+
+class PlainRenderer(Renderer):
+	"""
+	Renders without any color codes. The changes within a line are marked
+	as `[-deleted-]`, `{+inserted+}` and `[~changed~]` instead.
+	"""
+
+	MARKS = {'delete': '[-%s-]', 'insert': '{+%s+}', 'change': '[~%s~]'}
+
+	def mark(self, segments):
+		# the lines deleted or inserted as a whole are told by their side already
+		if not any(kind == 'equal' and text for kind, text in segments):
+			return segments
+		return [(kind, text if kind == 'equal' or not text else PlainRenderer.MARKS[kind] % text)
+			for kind, text in segments]
+
+	def render(self, segments):
+		return ''.join(text for _, text in segments)
+
+def _escapeHtml(s):
+	return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+class HtmlRenderer(Renderer):
+	"""
+	Renders the fragments as html, in `<span class="testly-KIND">` elements,
+	to be styled by css and put in a `<pre>` element
+	"""
+
+	def __init__(self, theme = 'default'):
+		super(HtmlRenderer, self).__init__(theme)
+		for kind in Theme.KINDS:
+			setattr(self, kind, self._span(kind))
+
+	@staticmethod
+	def _span(kind):
+		fmt = '<span class="testly-' + kind + '">%s</span>'
+		return lambda s: fmt % _escapeHtml(s)
+
+	def render(self, segments):
+		return ''.join(
+			_escapeHtml(text) if kind == 'equal' else getattr(self, kind)(text)
+			for kind, text in segments)
+
+def useColor(stream = None):
+	"""
+	Tell whether to color the output: not if the `NO_COLOR` environment variable is set,
+	otherwise only if the stream (default: `sys.stderr`) is a TTY.
+	"""
+	if os.environ.get('NO_COLOR'):
+		return False
+	stream = stream or sys.stderr
+	try:
+		return stream.isatty()
+	except (AttributeError, ValueError):
+		return False
+
+def getRenderer(theme = 'default', color = None, stream = None):
+	"""
+	Get the renderer for a theme
+	@params:
+		`theme`: The name of the theme, or a `Theme`
+		`color`: Whether to color the output, None to decide by `useColor(stream)`
+		`stream`: The stream the output goes to
+	"""
+	if color is None:
+		color = useColor(stream)
+	return (AnsiRenderer if color else PlainRenderer)(theme)
+
+def groupOpcodes(opcodes, context = 3):
+	"""
+	Group the opcodes into hunks with `context` lines of context,
+	the same as difflib.SequenceMatcher.get_grouped_opcodes
+	"""
+	codes = list(opcodes) or [('equal', 0, 1, 0, 1)]
+	if codes[0][0] == 'equal':
+		tag, i1, i2, j1, j2 = codes[0]
+		codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+	if codes[-1][0] == 'equal':
+		tag, i1, i2, j1, j2 = codes[-1]
+		codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+	group = []
+	for tag, i1, i2, j1, j2 in codes:
+		if tag == 'equal' and i2 - i1 > context * 2:
+			group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+			yield group
+			group  = []
+			i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+		group.append((tag, i1, i2, j1, j2))
+	if group and not (len(group) == 1 and group[0][0] == 'equal'):
+		yield group
+
+# the marks of the intraline differences made by difflib._mdiff
+MARKS = {'+': 'insert', '-': 'delete', '^': 'change'}
+
+def toSegments(text):
+	"""
+	Convert a line marked up by difflib._mdiff (`\\x00+...\\x01`, `\\x00-...\\x01`, `\\x00^...\\x01`)
+	into a list of (kind, text) segments.
+	"""
+	if text == '\n':
+		# the placeholder of a missing line
+		return []
+	parts = text.split('\x00')
+	ret   = [('equal', parts[0])] if parts[0] else []
+	for part in parts[1:]:
+		marked, _, rest = part[1:].partition('\x01')
+		if marked:
+			ret.append((MARKS[part[0]], marked))
+		if rest:
+			ret.append(('equal', rest))
+	return ret
+
+class DifflibEngine(object):
+	"""
+	The diff engine based on difflib, whose results are the same as difflib.ndiff,
+	but quadratic on lines and characters in the worst cases.
+	"""
+	def __init__(self, linejunk = None, charjunk = difflib.IS_CHARACTER_JUNK):
+		self.linejunk = linejunk
+		self.charjunk = charjunk
+
+	def opcodes(self, a, b):
+		"""Get the opcodes of the lines, as difflib.SequenceMatcher.get_opcodes"""
+		return difflib.SequenceMatcher(self.linejunk, a, b).get_opcodes()
+
+	def rows(self, a, b, group):
+		"""
+		Generate the rows of a hunk, in the format of difflib._mdiff,
+		but with the lines as lists of segments (see `toSegments`)
+		"""
+		i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+		for left, right, match in difflib._mdiff(a[i1:i2], b[j1:j2], None, self.linejunk, self.charjunk):
+			yield (left[0] and left[0] + i1, toSegments(left[1])), (right[0] and right[0] + j1, toSegments(right[1])), match
+
+class FastEngine(DifflibEngine):
+	"""
+	The diff engine for large inputs:
+	- The common prefix and suffix of the lines are trimmed;
+	- The lines are matched by patience diff, with the lines unique in both sides as anchors.
+	  Only the small regions without anchors fall back to difflib;
+	- Intraline differences are only computed for short changed pairs of lines.
+	  For the long ones, only the common prefix and suffix of the pair are trimmed.
+	"""
+	# regions without anchors smaller than this (len(a) * len(b)) are matched by difflib
+	FALLBACK_SIZE = 10000
+	# pairs of lines longer than this are not compared character by character
+	INTRALINE_LENGTH = 200
+
+	@staticmethod
+	def _lis(pairs):
+		"""Longest increasing subsequence of the pairs (sorted by the first) on the second"""
+		tails, tailidx, prev = [], [], [None] * len(pairs)
+		for k, (_, j) in enumerate(pairs):
+			pos = bisect.bisect_left(tails, j)
+			if pos == len(tails):
+				tails.append(j)
+				tailidx.append(k)
+			else:
+				tails[pos]   = j
+				tailidx[pos] = k
+			prev[k] = tailidx[pos - 1] if pos else None
+		ret = []
+		k   = tailidx[-1] if tailidx else None
+		while k is not None:
+			ret.append(pairs[k])
+			k = prev[k]
+		return ret[::-1]
+
+	def _matchingBlocks(self, a, b):
+		blocks  = []
+		regions = [(0, len(a), 0, len(b))]
+		while regions:
+			alo, ahi, blo, bhi = regions.pop()
+			while alo < ahi and blo < bhi and a[alo] == b[blo]:
+				blocks.append((alo, blo, 1))
+				alo += 1
+				blo += 1
+			while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+				ahi -= 1
+				bhi -= 1
+				blocks.append((ahi, bhi, 1))
+			if alo == ahi or blo == bhi:
+				continue
+
+			# -1 for lines that are not unique
+			aindex = {}
+			for i in range(alo, ahi):
+				aindex[a[i]] = -1 if a[i] in aindex else i
+			bindex = {}
+			for j in range(blo, bhi):
+				if aindex.get(b[j], -1) >= 0:
+					bindex[b[j]] = -1 if b[j] in bindex else j
+			anchors = self._lis(sorted((aindex[line], j) for line, j in bindex.items() if j >= 0))
+
+			if anchors:
+				i0, j0 = alo, blo
+				for i, j in anchors:
+					regions.append((i0, i, j0, j))
+					blocks.append((i, j, 1))
+					i0, j0 = i + 1, j + 1
+				regions.append((i0, ahi, j0, bhi))
+			elif (ahi - alo) * (bhi - blo) <= self.FALLBACK_SIZE:
+				matcher = difflib.SequenceMatcher(self.linejunk, a[alo:ahi], b[blo:bhi], autojunk = False)
+				blocks.extend((alo + i, blo + j, size) for i, j, size in matcher.get_matching_blocks() if size)
+		blocks.sort()
+
+		# merge the adjacent blocks
+		ret = []
+		for i, j, size in blocks:
+			if ret and ret[-1][0] + ret[-1][2] == i and ret[-1][1] + ret[-1][2] == j:
+				ret[-1][2] += size
+			else:
+				ret.append([i, j, size])
+		ret.append([len(a), len(b), 0])
+		return ret
+
+	def opcodes(self, a, b):
+		i = j = 0
+		ret   = []
+		for ai, bj, size in self._matchingBlocks(a, b):
+			if i < ai and j < bj:
+				ret.append(('replace', i, ai, j, bj))
+			elif i < ai:
+				ret.append(('delete', i, ai, j, bj))
+			elif j < bj:
+				ret.append(('insert', i, ai, j, bj))
+			i, j = ai + size, bj + size
+			if size:
+				ret.append(('equal', ai, i, bj, j))
+		return ret
+
+	def _intraline(self, left, right):
+		if len(left) > self.INTRALINE_LENGTH or len(right) > self.INTRALINE_LENGTH:
+			prefix = 0
+			maxfix = min(len(left), len(right))
+			while prefix < maxfix and left[prefix] == right[prefix]:
+				prefix += 1
+			suffix = 0
+			while suffix < maxfix - prefix and left[-suffix - 1] == right[-suffix - 1]:
+				suffix += 1
+			ldiff = left[prefix:len(left) - suffix]
+			rdiff = right[prefix:len(right) - suffix]
+			kind  = 'change' if ldiff and rdiff else None
+			lefts = [('equal', left[:prefix]), (kind or 'delete', ldiff), ('equal', left[len(left) - suffix:])]
+			rights = [('equal', right[:prefix]), (kind or 'insert', rdiff), ('equal', right[len(right) - suffix:])]
+			return [seg for seg in lefts if seg[1]], [seg for seg in rights if seg[1]]
+
+		matcher = difflib.SequenceMatcher(self.charjunk, left, right)
+		if matcher.real_quick_ratio() < .75 or matcher.quick_ratio() < .75 or matcher.ratio() < .75:
+			return [('delete', left or ' ')], [('insert', right or ' ')]
+		lefts, rights = [], []
+		for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+			if tag == 'equal':
+				lefts.append(('equal', left[i1:i2]))
+				rights.append(('equal', right[j1:j2]))
+				continue
+			if i1 < i2:
+				lefts.append(('change' if tag == 'replace' else 'delete', left[i1:i2]))
+			if j1 < j2:
+				rights.append(('change' if tag == 'replace' else 'insert', right[j1:j2]))
+		return lefts, rights
+
+	def rows(self, a, b, group):
+		for tag, i1, i2, j1, j2 in group:
+			if tag == 'equal':
+				for k in range(i2 - i1):
+					yield (i1 + k + 1, [('equal', a[i1 + k])] if a[i1 + k] else []), \
+						(j1 + k + 1, [('equal', b[j1 + k])] if b[j1 + k] else []), False
+				continue
+			for k in range(max(i2 - i1, j2 - j1)):
+				i, j = i1 + k, j1 + k
+				if i < i2 and j < j2:
+					left, right = self._intraline(a[i], b[j])
+					yield (i + 1, left), (j + 1, right), True
+				elif i < i2:
+					yield (i + 1, [('delete', a[i] or ' ')]), ('', []), True
+				else:
+					yield ('', []), (j + 1, [('insert', b[j] or ' ')]), True
+
+ENGINES = {
+	'difflib': DifflibEngine,
+	'fast'   : FastEngine,
+}
+
+# the value of a missing key or index in structDiff
+MISSING = object()
+
+def _keyPath(path, key):
+	if isinstance(key, string_types) and re.match(r'^[A-Za-z_]\w*$', key):
+		return path + '.' + key if path else key
+	return '%s[%r]' % (path, key)
+
+def _sortKeys(keys):
+	if len(set(type(key) for key in keys)) == 1:
+		try:
+			return sorted(keys)
+		except TypeError:
+			pass
+	# keys of different types are ordered by type first, as python2 would order them differently from python3
+	try:
+		return sorted(keys, key = lambda key: (type(key).__name__, key))
+	except TypeError:
+		# keys not orderable
+		return sorted(keys, key = lambda key: (type(key).__name__, repr(key)))
+
+def structDiff(first, second, path = ''):
+	"""
+	Walk two nested dicts/lists/tuples and generate the differing paths,
+	as tuples of (path, first value, second value), where a missing value is `MISSING`.
+	The keys of the dicts are compared as sets, and only the differing branches are walked,
+	so that the cost scales with the differences rather than the size of the inputs.
+	"""
+	if isinstance(first, dict) and isinstance(second, dict):
+		keys1, keys2 = viewkeys(first), viewkeys(second)
+		try:
+			changed = set(key for key, _ in viewitems(first) - viewitems(second)) - (keys1 - keys2)
+		except TypeError:
+			# unhashable values
+			changed = [key for key in keys1 & keys2 if first[key] != second[key]]
+		for key in _sortKeys(changed):
+			for ret in structDiff(first[key], second[key], _keyPath(path, key)):
+				yield ret
+		for key in _sortKeys(keys1 - keys2):
+			yield _keyPath(path, key), first[key], MISSING
+		for key in _sortKeys(keys2 - keys1):
+			yield _keyPath(path, key), MISSING, second[key]
+	elif isinstance(first, (list, tuple)) and isinstance(second, (list, tuple)) \
+		and type(first) is type(second):
+		for i in range(min(len(first), len(second))):
+			if first[i] != second[i]:
+				for ret in structDiff(first[i], second[i], '%s[%d]' % (path, i)):
+					yield ret
+		for i in range(len(second), len(first)):
+			yield '%s[%d]' % (path, i), first[i], MISSING
+		for i in range(len(first), len(second)):
+			yield '%s[%d]' % (path, i), MISSING, second[i]
+	elif first != second:
+		yield path, first, second
 
 class CDiff (object):
 	"""
@@ -102,9 +526,8 @@ class CDiff (object):
 			return default
 
 	@staticmethod
-	def _getLen(mdexpr):
-		# '\x00', '\x01', '+' or '-' or '^'
-		return len(mdexpr) - mdexpr.count('\x00') * 3
+	def _getLen(segments):
+		return sum(len(text) for _, text in segments)
 
 	@staticmethod
 	def _getWidth(md, cwidth = None, lineno = True):
@@ -133,58 +556,177 @@ class CDiff (object):
 		return min(maxwidth, availwidth), maxlnno_left, maxlnno_right
 
 
-	def __init__(self, linejunk = None, charjunk = difflib.IS_CHARACTER_JUNK, lineno = True, theme = 'default'):
+	def __init__(self, linejunk = None, charjunk = difflib.IS_CHARACTER_JUNK, lineno = True, theme = 'default', engine = 'auto', color = None):
+		"""
+		@params:
+			`linejunk`, `charjunk`: The junk filters for the lines and characters, see difflib
+			`lineno`: Whether to show the line numbers
+			`theme` : The name of the theme
+			`engine`: The diff engine, one of the keys of `ENGINES`, or an object with
+				`opcodes(a, b)` and `rows(a, b, group)` methods like `DifflibEngine`.
+				"auto" to use the fast engine for large inputs, and difflib for others.
+			`color` : Whether to color the output, None to decide by `useColor()`
+		"""
 		self.linejunk = linejunk
 		self.charjunk = charjunk
-		self.theme    = Theme(theme)
+		self.renderer = getRenderer(theme, color)
+		self.theme    = self.renderer.theme
 		self.lineno   = lineno
+		self.engine   = engine
 
-	def _replaceTag(self, s):
-		return s.replace('\x00+', getattr(self.theme, self.theme.theme.upper())['insert']) \
-				.replace('\x00-', getattr(self.theme, self.theme.theme.upper())['delete']) \
-				.replace('\x00^', getattr(self.theme, self.theme.theme.upper())['change']) \
-				.replace('\x01', Colors.end)
+	def _getEngine(self, a, b):
+		engine = self.engine
+		if engine == 'auto':
+			size   = sum(len(line) for line in a) + sum(len(line) for line in b)
+			engine = 'fast' if size > AUTO_ENGINE_THRESHOLD else 'difflib'
+		if engine in ENGINES:
+			engine = ENGINES[engine](self.linejunk, self.charjunk)
+		return engine
 
 	@staticmethod
-	def _split(s, width):
-		ret = []
+	def _wrap(segments, width):
+		"""Wrap a line of segments into lines of `width` characters, padding the last one"""
+		ret    = []
+		line   = []
+		length = 0
+		for kind, text in segments:
+			while text:
+				piece, text = text[:width - length], text[width - length:]
+				line.append((kind, piece))
+				length += len(piece)
+				if length == width:
+					ret.append(line)
+					line   = []
+					length = 0
+		if line:
+			line.append(('equal', ' ' * (width - length)))
+			ret.append(line)
+		return ret
 
-		opened  = False
-		opentag = None
-		length  = 0
-		tmp     = ''
-		for c in list(s):
-			if c == '\x00':
-				opened = True
-				tmp += c
-			elif opened and not opentag:
-				opentag = c
-				tmp += c
-			elif opened and c == '\x01':
-				opened = False
-				# give up if tmp is empty, because it's already added at line 169
-				if tmp != '\x00' + opentag: 
-					tmp += c
+	def _renderRow(self, left, right, match, width, lnno_left, lnno_right):
+		linefmt = '{lineno_left}{leftstr}{sep}{lineno_right}{rightstr}\n'
+		sep     = self.renderer.sep(' | ')
+		if match is None:
+			if self.lineno:
+				lineno_left  = str(' ').rjust(lnno_left + 2)
+				lineno_right = str(' ').rjust(lnno_right + 2)
+			else:
+				lineno_left = lineno_right = ''
+
+			yield linefmt.format(
+				lineno_left  = self.renderer.lineno(lineno_left),
+				lineno_right = self.renderer.lineno(lineno_right),
+				leftstr      = self.renderer.sep('-' * width),
+				rightstr     = self.renderer.sep('-' * width),
+				sep          = sep
+			)
+			return
+
+		lefts  = CDiff._wrap(self.renderer.mark(left[1]), width)
+		rights = CDiff._wrap(self.renderer.mark(right[1]), width)
+
+		# at least one line, even if both sides are empty
+		for i in range(max(len(lefts), len(rights), 1)):
+			if i == 0:
+				if self.lineno:
+					lineno_left  = (str(left[0]).rjust(lnno_left) + '. ') if left[0] else str(' ').rjust(lnno_left + 2)
+					lineno_right = (str(right[0]).rjust(lnno_right) + '. ') if right[0] else str(' ').rjust(lnno_right + 2)
 				else:
-					tmp = ''
+					lineno_left  = lineno_right = ''
 			else:
-				length += 1
-				tmp += c
-
-			if length == width:
-				if not opened:
-					ret.append(tmp)
-					tmp    = ''
-					length = 0
+				if self.lineno:
+					lineno_left  = str(' ').rjust(lnno_left + 2)
+					lineno_right = str(' ').rjust(lnno_right + 2)
 				else:
-					ret.append(tmp + '\x01')
-					tmp = '\x00' + opentag
-					length = 0
-					
-		if tmp: ret.append(tmp + ' ' * (width - CDiff._getLen(tmp)))
+					lineno_left  = lineno_right = ''
+
+			if i < len(lefts):
+				leftstr = self.renderer.render(lefts[i])
+			else:
+				leftstr = ' ' * width
+
+			if i < len(rights):
+				rightstr = self.renderer.render(rights[i])
+			else:
+				rightstr = ' ' * width
+
+			yield linefmt.format(
+				lineno_left  = self.renderer.lineno(lineno_left),
+				lineno_right = self.renderer.lineno(lineno_right),
+				leftstr      = leftstr,
+				rightstr     = rightstr,
+				sep          = sep
+			)
+
+	@staticmethod
+	def _rows(a, b, engine, opcodes, context):
+		"""
+		Generate the rows of the diff hunk by hunk, in the format of difflib._mdiff,
+		so that the intraline differences are only computed for the hunks being rendered.
+		"""
+		for group in groupOpcodes(opcodes, context):
+			if group[0][1] > 0 or group[0][3] > 0:
+				yield None, None, None
+			for row in engine.rows(a, b, group):
+				yield row
+
+	@staticmethod
+	def _remaining(opcodes, shown):
+		"""Count the differing lines after the lines shown."""
+		ret = 0
+		for tag, i1, i2, j1, j2 in opcodes:
+			if tag == 'equal':
+				continue
+			ret += max(i2 - max(i1, shown[0]), j2 - max(j1, shown[1]), 0)
 		return ret
 
-	def diff(self, a, b, context = 3, cwidth = None):
+	@staticmethod
+	def _repr(value, maxlen = 80):
+		ret = repr(value)
+		return ret if len(ret) <= maxlen else ret[:maxlen] + ' [truncated]...'
+
+	def pathdiff(self, first, second, maxlines = None, maxsize = None):
+		"""
+		Generate the lines of the differing paths of two nested dicts/lists, i.e.:
+		`  a.b[3].c: 1 != 2`, `- a.d: 3` (only in first) and `+ a.e: 4` (only in second).
+		@params:
+			`first`, `second`: The dicts/lists to compare
+			`maxlines`: The max number of lines to generate
+			`maxsize` : The max number of characters to generate
+				Once either budget is reached, the paths are not walked any further,
+				but counted in a footer.
+		"""
+		nlines = size = 0
+		diffs  = structDiff(first, second)
+		for path, left, right in diffs:
+			if left is MISSING:
+				line = self.renderer.insert('+ ') + self.renderer.lineno(path or '.') + ': ' + self.renderer.insert(CDiff._repr(right))
+			elif right is MISSING:
+				line = self.renderer.delete('- ') + self.renderer.lineno(path or '.') + ': ' + self.renderer.delete(CDiff._repr(left))
+			else:
+				line = '  ' + self.renderer.lineno(path or '.') + ': ' + self.renderer.delete(CDiff._repr(left)) + \
+					self.renderer.sep(' != ') + self.renderer.insert(CDiff._repr(right))
+			line += '\n'
+			if (maxlines is not None and nlines >= maxlines) or \
+				(maxsize is not None and size + len(line) > maxsize - FOOTER_SIZE):
+				yield self.renderer.sep('... %s more differing paths' % (1 + sum(1 for _ in diffs))) + '\n'
+				return
+			nlines += 1
+			size   += len(line)
+			yield line
+
+	def diff(self, a, b, context = 3, cwidth = None, maxlines = None, maxsize = None):
+		"""
+		Generate the lines of the side-by-side diff of a and b.
+		@params:
+			`a`, `b`  : The lists or strings to compare
+			`context` : The number of context lines
+			`cwidth`  : The console width, detected if not given
+			`maxlines`: The max number of lines to generate
+			`maxsize` : The max number of characters to generate
+				Once either budget is reached, the diff is neither computed nor rendered any further,
+				but ends with a footer telling how many differing lines are not shown.
+		"""
 		if not isinstance(a, list):
 			a = a.splitlines()
 		if not isinstance(b, list):
@@ -192,71 +734,36 @@ class CDiff (object):
 
 		a = [str(_) for _ in a]
 		b = [str(_) for _ in b]
-		
-		md = difflib._mdiff(a, b, context, self.linejunk, self.charjunk)
-		md, md2 = itertools.tee(md)
-		width, lnno_left, lnno_right = CDiff._getWidth(md2, cwidth, self.lineno)
-		output = []
-
-		for left, right, match in md:
-			linefmt         = '{lineno_left}{leftstr}{sep}{lineno_right}{rightstr}\n'
-			if match is None:
-				if self.lineno:
-					lineno_left  = str(' ').rjust(lnno_left + 2)
-					lineno_right = str(' ').rjust(lnno_right + 2)
-				else:
-					lineno_left = lineno_right = ''
-					
-				output.append(linefmt.format(
-					lineno_left  = self.theme.lineno(lineno_left),
-					lineno_right = self.theme.lineno(lineno_right),
-					leftstr      = self.theme.sep('-' * width),
-					rightstr     = self.theme.sep('-' * width),
-					sep          = self.theme.sep(' | ')
-				))
-				continue
-
-			lefts  = CDiff._split(left[1]  if left[1]  != '\n' else '', width)
-			rights = CDiff._split(right[1] if right[1] != '\n' else '', width)
-
-			for i in range(max(len(lefts), len(rights))):
-				if i == 0:
-					if self.lineno:
-						lineno_left  = (str(left[0]).rjust(lnno_left) + '. ') if left[0] else str(' ').rjust(lnno_left + 2)
-						lineno_right = (str(right[0]).rjust(lnno_right) + '. ') if right[0] else str(' ').rjust(lnno_right + 2)
-					else:
-						lineno_left  = lineno_right = ''
-				else:
-					if self.lineno:
-						lineno_left  = str(' ').rjust(lnno_left + 2)
-						lineno_right = str(' ').rjust(lnno_right + 2)
-					else:
-						lineno_left  = lineno_right = ''
-
-				if i < len(lefts):
-					leftstr = self._replaceTag(lefts[i])
-				else:
-					leftstr = ' ' * width
-				
-				if i < len(rights):
-					rightstr = self._replaceTag(rights[i])
-				else:
-					rightstr = ' ' * width
-				
-				output.append(linefmt.format(
-					lineno_left  = self.theme.lineno(lineno_left),
-					lineno_right = self.theme.lineno(lineno_right),
-					leftstr      = leftstr,
-					rightstr     = rightstr,
-					sep          = self.theme.sep(' | ')
-				))
-
-
-		for line in output:
-			yield line
-	
-
 
+		engine  = self._getEngine(a, b)
+		opcodes = engine.opcodes(a, b)
+		md      = CDiff._rows(a, b, engine, opcodes, context)
+		if maxlines is None and maxsize is None:
+			rows = list(md)
+		else:
+			# each row takes at least one line, which is longer than MIN_CONSOLE_WIDTH,
+			# so we don't need more rows than this to exhaust the budget
+			maxrows = min(
+				maxlines if maxlines is not None else maxsize,
+				maxsize // MIN_CONSOLE_WIDTH + 1 if maxsize is not None else maxlines)
+			rows = list(itertools.islice(md, maxrows + 1))
+		width, lnno_left, lnno_right = CDiff._getWidth(rows, cwidth, self.lineno)
+
+		nlines = size = 0
+		shown  = [0, 0]
+		for left, right, match in rows:
+			for line in self._renderRow(left, right, match, width, lnno_left, lnno_right):
+				if (maxlines is not None and nlines >= maxlines) or \
+					(maxsize is not None and size + len(line) > maxsize - FOOTER_SIZE):
+					remaining = CDiff._remaining(opcodes, shown)
+					if remaining:
+						yield self.renderer.sep('... %s more differing lines' % remaining) + '\n'
+					return
+				nlines += 1
+				size   += len(line)
+				yield line
+			if match is not None:
+				shown = [left[0] or shown[0], right[0] or shown[1]]
 
 if __name__ == '__main__': # pragma: no cover 
 	
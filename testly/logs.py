@@ -0,0 +1,109 @@
+"""
+The handler capturing the logs for `testly.TestCase.assertLogs`
+"""
+import re, logging
+from collections import deque, OrderedDict
+from six import string_types
+
+LOGFMT = "%(levelname)s:%(name)s:%(message)s"
+
+def levelno(level, default = 0):
+	"""The number of a level given by name (i.e. `'DEBUG'`) or number"""
+	if not level:
+		return default
+	return level if isinstance(level, int) else getattr(logging, level)
+
+def _patterns(patterns):
+	if patterns is None:
+		return []
+	if isinstance(patterns, string_types) or hasattr(patterns, 'search'):
+		patterns = [patterns]
+	return [re.compile(pattern) if isinstance(pattern, string_types) else pattern for pattern in patterns]
+
+class LogsWatcher(object):
+	"""
+	The logs captured by `testly.TestCase.assertLogs`: `records` are the records kept,
+	only the last `capacity` ones if it is set, and `output` are the records formatted
+	as `LEVEL:logger:message`, which are only formatted when it is read.
+	"""
+
+	def __init__(self, capacity = None, formatter = None):
+		self.records   = deque(maxlen = capacity) if capacity else []
+		self.formatter = formatter or logging.Formatter(LOGFMT)
+
+	@property
+	def output(self):
+		return [self.formatter.format(record) for record in self.records]
+
+class LogsHandler(logging.Handler):
+	"""
+	Keep the records that pass the filters in a `LogsWatcher`,
+	and check the records against the streaming matchers as they arrive, without keeping them.
+	@params:
+		`capacity`: Only keep the last records
+		`keep`    : Only keep the records of this level or above
+		`names`   : Only keep the records of these loggers and their children
+		`appears` : The patterns that must be found in the messages
+		`never`   : The patterns that must not be found in the messages
+	"""
+
+	def __init__(self, capacity = None, keep = None, names = None, appears = None, never = None):
+		logging.Handler.__init__(self)
+		self.setFormatter(logging.Formatter(LOGFMT))
+		self.watcher = LogsWatcher(capacity, self.formatter)
+		self.keep    = levelno(keep)
+		self.names   = (names, ) if isinstance(names, string_types) else tuple(names) if names else None
+		# whether the records of a logger are kept, by logger name
+		self.named   = {}
+		# the patterns that haven't been found yet
+		self.appears = _patterns(appears)
+		self.never   = _patterns(never)
+		# the pattern found that must not be -> [the first record found, the number of records found]
+		self.found   = OrderedDict()
+		self.store   = self.watcher.records.append
+		if not self.appears and not self.never:
+			# the records below are not even handed to the handler
+			self.setLevel(self.keep)
+
+	def keeps(self, record):
+		if record.levelno < self.keep:
+			return False
+		if self.names is None:
+			return True
+		ret = self.named.get(record.name)
+		if ret is None:
+			ret = self.named[record.name] = any(
+				record.name == name or record.name.startswith(name + '.') for name in self.names)
+		return ret
+
+	def match(self, record):
+		message = record.getMessage()
+		if self.appears:
+			self.appears = [pattern for pattern in self.appears if not pattern.search(message)]
+		for pattern in self.never:
+			if pattern.search(message):
+				found = self.found.setdefault(pattern.pattern, [record, 0])
+				found[1] += 1
+
+	def handle(self, record):
+		# without the lock of logging.Handler, as appending to a list or a deque is thread-safe
+		if self.filters and not self.filter(record):
+			return False
+		self.emit(record)
+		return True
+
+	def emit(self, record):
+		if self.appears or self.never:
+			self.match(record)
+		if self.keeps(record):
+			self.store(record)
+
+	def flush(self):
+		pass
+
+	def failures(self):
+		"""The messages of the streaming matchers that failed"""
+		ret = ['Pattern %r found in the logs %s time(s), first: %s' % (
+			pattern, count, self.format(record)) for pattern, (record, count) in self.found.items()]
+		ret.extend('Pattern %r not found in the logs' % pattern.pattern for pattern in self.appears)
+		return ret
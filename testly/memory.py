@@ -0,0 +1,97 @@
+"""
+Measure the memory allocated by the tests with tracemalloc
+"""
+import gc
+from .sizes import parseSize, formatSize
+try:
+	import tracemalloc
+except ImportError: # pragma: no cover
+	# python2
+	tracemalloc = None
+
+class MemoryUsage(object):
+	"""
+	The memory allocated by a block of code, see `testly.TestCase.assertMaxMemory`:
+	`peak` is the peak of the memory allocated while running it,
+	`retained` is the memory that is still allocated once it's done,
+	and `stats` are the `tracemalloc.StatisticDiff`s of the retained memory by source line.
+	Before python 3.9, the peak can't be reset: if tracemalloc was tracing already, `peak` is
+	the one since it started, which may be more than the block allocated, and `exactPeak` is False.
+	"""
+	def __init__(self):
+		self.peak      = 0
+		self.exactPeak = True
+		self.retained  = 0
+		self.stats     = []
+
+class Tracer(object):
+	"""
+	Trace the memory allocations of a block of code.
+	tracemalloc is started (and stopped afterwards) if it is not tracing yet.
+	"""
+
+	def __init__(self, nframes = 1):
+		self.nframes = nframes
+		self.started = False
+		self.before  = None
+		self.base    = 0
+		self.usage   = MemoryUsage()
+
+	@staticmethod
+	def _filter(snapshot):
+		return snapshot.filter_traces((
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, __file__),
+			tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+
+	def start(self):
+		if not tracemalloc.is_tracing():
+			tracemalloc.start(self.nframes)
+			self.started = True
+		gc.collect()
+		self.before = tracemalloc.take_snapshot()
+		# before python 3.9, the peak is the one since tracemalloc started,
+		# which is only about the block if it's started here
+		if hasattr(tracemalloc, 'reset_peak'):
+			tracemalloc.reset_peak()
+		else: # pragma: no cover
+			self.usage.exactPeak = self.started
+		self.base = tracemalloc.get_traced_memory()[0]
+
+	def stop(self):
+		current, peak = tracemalloc.get_traced_memory()
+		gc.collect()
+		after = tracemalloc.take_snapshot()
+		if self.started:
+			tracemalloc.stop()
+		self.usage.peak     = max(peak - self.base, 0)
+		# filtered afterwards, so that what the filtering allocates is not traced
+		self.usage.stats    = Tracer._filter(after).compare_to(Tracer._filter(self.before), 'lineno')
+		self.usage.retained = sum(stat.size_diff for stat in self.usage.stats)
+		return self.usage
+
+def topAllocations(stats, limit = 10, theme = 'default', color = None):
+	"""
+	Format the source lines that allocated or freed most of the memory, like a diff:
+	allocations are inserted lines and frees are deleted lines.
+	@params:
+		`stats`: The `tracemalloc.StatisticDiff`s
+		`limit`: The max number of lines
+		`theme`, `color`: The theme of the colors, and whether to color them, see `testly.cdiff.getRenderer`
+	"""
+	from .cdiff import getRenderer
+	renderer = getRenderer(theme, color)
+	stats    = [stat for stat in stats if stat.size_diff][:limit]
+	if not stats:
+		return ''
+	lines = []
+	width = max(len(formatSize(stat.size_diff)) for stat in stats) + 1
+	for stat in stats:
+		frame = stat.traceback[0]
+		kind  = 'insert' if stat.size_diff > 0 else 'delete'
+		text  = '%s %s (%s blocks) %s:%s' % (
+			'+' if kind == 'insert' else '-',
+			formatSize(abs(stat.size_diff)).rjust(width),
+			stat.count_diff, frame.filename, frame.lineno)
+		lines.append(renderer.render([(kind, text)]))
+	return '\n'.join(lines)
@@ -0,0 +1,186 @@
+"""
+Run tests in a pool of worker processes
+"""
+import sys, unittest, multiprocessing
+from collections import OrderedDict
+from .result import RecordingResult, replay
+
+def _flatten(suite):
+	from . import LazyTestSuite
+	for test in suite:
+		# tests of lazy test sets are generated by the workers
+		if isinstance(test, LazyTestSuite):
+			yield test
+		elif isinstance(test, unittest.TestSuite):
+			for t in _flatten(test):
+				yield t
+		else:
+			yield test
+
+def _qualname(klass):
+	return getattr(klass, '__qualname__', klass.__name__)
+
+def _resolve(module, qualname):
+	obj = sys.modules.get(module)
+	if obj is None:
+		obj = __import__(module, fromlist = ['__name__'])
+	for part in qualname.split('.'):
+		obj = getattr(obj, part, None)
+	return obj
+
+def _isPortable(test):
+	"""Tell whether a test can be rebuilt by name in a worker process"""
+	from . import LazyTestSuite
+	if isinstance(test, LazyTestSuite):
+		klass = test.testCaseClass
+	elif not isinstance(test, unittest.TestCase) or not hasattr(test, '_testMethodName'):
+		return False
+	else:
+		klass = test.__class__
+	try:
+		return _resolve(klass.__module__, _qualname(klass)) is klass
+	except ImportError:
+		return False
+
+def _chunks(items, n):
+	n    = max(min(n, len(items)), 1)
+	size = len(items) // n
+	rest = len(items) % n
+	start = 0
+	for i in range(n):
+		end = start + size + (1 if i < rest else 0)
+		yield items[start:end]
+		start = end
+
+def shardTests(tests, workers, splitSets = False):
+	"""
+	Group the tests into shards to be sent to the workers.
+	Tests of the same `TestSet` are kept in the same shard, unless `splitSets` is True,
+	where the set is split into at most `workers` continuous chunks. In each chunk,
+	`isFirst()` and `isLast()` then refer to the first and last test of the chunk.
+	Regular tests of a class go together. A lazy test set is never split, as its tests
+	are only generated while running.
+	@params:
+		`tests`    : The tests
+		`workers`  : The number of workers
+		`splitSets`: Whether to split the test sets
+	@returns:
+		A tuple of the shards and the tests that cannot be run in the workers.
+		Each shard is a tuple of (module name, class name, test method names, lazy test set name).
+		For a lazy test set, the test method names are the indexes of the rows to run,
+		or None for all of them.
+	"""
+	from . import LazyTestSuite
+	groups = OrderedDict()
+	lazy   = []
+	local  = []
+	for test in tests:
+		if not _isPortable(test):
+			local.append(test)
+			continue
+		if isinstance(test, LazyTestSuite):
+			klass = test.testCaseClass
+			lazy.append((klass.__module__, _qualname(klass), test.indexes, test.testset.name))
+			continue
+		klass   = test.__class__
+		setname = test.setName() if getattr(test, 'isOfSet', None) and test.isOfSet() else None
+		key     = (klass.__module__, _qualname(klass), setname)
+		groups.setdefault(key, []).append(test._testMethodName)
+
+	shards = []
+	for (module, qualname, setname), names in groups.items():
+		if setname is not None and splitSets:
+			for chunk in _chunks(names, workers):
+				shards.append((module, qualname, chunk, None))
+		else:
+			shards.append((module, qualname, names, None))
+	return shards + lazy, local
+
+def _runShard(args):
+	from . import LazyTestSuite, TestSuite
+	(module, qualname, names, lazy), failfast, buffer, tb_locals = args
+	klass  = _resolve(module, qualname)
+	if lazy:
+		tests = [LazyTestSuite(klass, getattr(klass, lazy), names)]
+	else:
+		tests = [klass(name) for name in names]
+	testsets = OrderedDict()
+	for test in tests if not lazy else ():
+		if getattr(test, 'isOfSet', None) and test.isOfSet():
+			testsets.setdefault(test.setName(), []).append(test._testMethodName)
+	# so that isFirst/isLast work within the shard
+	restore = {}
+	for setname, setnames in testsets.items():
+		testset = getattr(klass, setname)
+		restore[setname] = testset.tests
+		testset.tests = setnames
+
+	result = RecordingResult()
+	result.failfast  = failfast
+	result.buffer    = buffer
+	result.tb_locals = tb_locals
+	try:
+		TestSuite(tests).run(result)
+	finally:
+		for setname, setnames in restore.items():
+			getattr(klass, setname).tests = setnames
+	return result.events
+
+class _KnownTests(dict):
+	"""
+	The tests of the main process by id, which also creates the stand-ins of
+	the tests generated by lazy test sets in the workers
+	"""
+	def __init__(self, tests):
+		from . import LazyTestSuite
+		super(_KnownTests, self).__init__()
+		self.lazy = {}
+		for test in tests:
+			if isinstance(test, LazyTestSuite):
+				klass = test.testCaseClass
+				prefix = '%s.%s.%s-' % (klass.__module__, _qualname(klass), test.testset.name)
+				self.lazy[prefix] = test
+			else:
+				self[test.id()] = test
+
+	def __missing__(self, testid):
+		prefix, _, index = testid.rpartition('-')
+		if prefix + '-' not in self.lazy or not index.isdigit():
+			raise KeyError(testid)
+		return self.lazy[prefix + '-'].createTest(int(index))
+
+class ParallelSuite(unittest.TestSuite):
+	"""
+	A suite that runs its tests in a pool of worker processes,
+	and replays the results into the result of the main process in order.
+	"""
+
+	def __init__(self, tests = (), workers = None, splitSets = False):
+		super(ParallelSuite, self).__init__(tests)
+		self.workers   = workers or multiprocessing.cpu_count()
+		self.splitSets = splitSets
+
+	def run(self, result, debug = False):
+		from . import TestSuite
+		tests         = list(_flatten(self))
+		shards, local = shardTests(tests, self.workers, self.splitSets)
+		known         = _KnownTests(tests)
+
+		pool = multiprocessing.Pool(self.workers)
+		try:
+			remote = pool.imap(_runShard, [(
+				shard,
+				getattr(result, 'failfast', False),
+				getattr(result, 'buffer', False),
+				getattr(result, 'tb_locals', False)
+			) for shard in shards])
+			if local:
+				TestSuite(local).run(result, debug)
+			for events in remote:
+				if result.shouldStop:
+					break
+				replay(events, result, known)
+		finally:
+			pool.terminate()
+			pool.join()
+		return result
@@ -0,0 +1,255 @@
+"""
+Profile the tests, each test or each test set separately,
+either deterministically by cProfile or by sampling the stack from a background thread
+"""
+import os, re, sys, time, pstats, cProfile, threading
+from collections import Counter, OrderedDict, defaultdict
+from .result import _setName
+
+PROFILE_DIR = '.testly_profile'
+
+def _filename(key, ext):
+	return re.sub(r'[^\w.\-]+', '_', key) + ext
+
+def _funcName(func):
+	"""The name of a function from its (filename, lineno, name), i.e. the keys of pstats"""
+	filename, lineno, name = func
+	if filename == '~':
+		# builtins
+		return name
+	return '%s:%s(%s)' % (filename, lineno, name)
+
+class Samples(Counter):
+	"""The number of samples of each stack, as a tuple of the functions from the outermost"""
+
+	def add(self, other):
+		self.update(other)
+
+	def dump_stats(self, path):
+		"""Write the samples as collapsed stacks"""
+		with open(path, 'w') as f:
+			for stack, count in self.most_common():
+				f.write('%s %s\n' % (';'.join(_funcName(func) for func in stack), count))
+
+	def functions(self):
+		"""Generate (function, samples, own samples, cumulative samples) of the functions sampled"""
+		own        = Counter()
+		cumulative = Counter()
+		for stack, count in self.items():
+			if not stack:
+				continue
+			own[stack[-1]] += count
+			for func in set(stack):
+				cumulative[func] += count
+		for func, count in own.items():
+			yield func, count, count, cumulative[func]
+
+class Profiler(object):
+	"""
+	Profile the tests between `start` and `stop`, grouped by test or by test set (`group` is 'test' or 'set'),
+	and write a file of the profile of each group to `outdir`.
+	The profiles (returned by `collect`) are merged by their `add`, and written by their `dump_stats`.
+	This one profiles nothing, the subclasses do.
+	"""
+	NAME  = 'none'
+	UNIT  = 'time'
+	CALLS = 'calls'
+	EXT   = '.prof'
+
+	def __init__(self, outdir = PROFILE_DIR, group = 'test'):
+		self.outdir  = outdir
+		self.group   = group
+		# the profiles of the groups that are not written yet
+		self.pending = OrderedDict()
+		self.written = []
+
+	def key(self, test):
+		if self.group == 'set':
+			return _setName(test) or test.id()
+		return test.id()
+
+	def start(self, test):
+		pass
+
+	def pause(self):
+		"""Stop profiling for a while, i.e. while the result formats a failure"""
+
+	def resume(self):
+		pass
+
+	def collect(self, test):
+		"""The profile of the test that just stopped, None if nothing was profiled"""
+		return None
+
+	def functions(self, profile):
+		"""Generate (function, calls, own time, cumulative time) of the functions in a profile"""
+		return ()
+
+	def stop(self, test):
+		"""Stop profiling the test, and write the profiles of the groups that are done"""
+		profile = self.collect(test)
+		key     = self.key(test)
+		for done in [done for done in self.pending if done != key]:
+			self.write(done, self.pending.pop(done))
+		if profile is None:
+			return
+		if key in self.pending:
+			self.pending[key].add(profile)
+		else:
+			self.pending[key] = profile
+
+	def close(self):
+		for key in list(self.pending):
+			self.write(key, self.pending.pop(key))
+
+	def write(self, key, profile):
+		if not os.path.isdir(self.outdir):
+			os.makedirs(self.outdir)
+		profile.dump_stats(os.path.join(self.outdir, _filename(key, self.EXT)))
+		self.written.append((key, profile))
+
+	@staticmethod
+	def format(value):
+		return str(value)
+
+	def hottest(self, n = 20):
+		"""
+		The n hottest functions of all the tests, by own time (or samples).
+		@returns:
+			A list of (function name, calls, own time, cumulative time,
+			the groups that spent most of the own time of the function as a list of (key, own time), the most first)
+		"""
+		total  = defaultdict(lambda: [0, 0, 0])
+		groups = defaultdict(list)
+		for key, profile in self.written:
+			for func, calls, own, cumulative in self.functions(profile):
+				stats = total[func]
+				stats[0] += calls
+				stats[1] += own
+				stats[2] += cumulative
+				groups[func].append((key, own))
+		funcs = sorted(total, key = lambda func: -total[func][1])[:n]
+		return [(_funcName(func), total[func][0], total[func][1], total[func][2],
+			sorted(groups[func], key = lambda group: -group[1])) for func in funcs]
+
+	def printHottest(self, stream, n = 20, top = 3):
+		"""
+		Print the table of the hottest functions, and the groups (tests or test sets) where most of their time was spent.
+		@params:
+			`stream`: The stream to print to, with `writeln`
+			`n`     : The number of functions
+			`top`   : The number of groups of each function
+		"""
+		stream.writeln()
+		stream.writeln('Hottest functions (%s, by own %s, profiles in %s):' % (self.NAME, self.UNIT, self.outdir))
+		stream.writeln('%10s %12s %12s  %s' % (self.CALLS, 'own', 'cumulative', 'function'))
+		for name, calls, own, cumulative, groups in self.hottest(n):
+			stream.writeln('%10s %12s %12s  %s' % (calls, self.format(own), self.format(cumulative), name))
+			stream.writeln('%36s  in %s' % ('', ', '.join(
+				'%s (%s)' % (key, self.format(value)) for key, value in groups[:top])))
+		stream.flush()
+
+class CProfiler(Profiler):
+	"""Profile the tests by cProfile, and write the profiles as pstats files"""
+	NAME  = 'cProfile'
+	EXT   = '.pstats'
+
+	def __init__(self, outdir = PROFILE_DIR, group = 'test'):
+		super(CProfiler, self).__init__(outdir, group)
+		self.profile = None
+
+	def start(self, test):
+		self.profile = cProfile.Profile()
+		self.profile.enable()
+
+	def pause(self):
+		if self.profile is not None:
+			self.profile.disable()
+
+	def resume(self):
+		if self.profile is not None:
+			self.profile.enable()
+
+	def collect(self, test):
+		if self.profile is None:
+			return None
+		self.profile.disable()
+		ret = pstats.Stats(self.profile)
+		self.profile = None
+		return ret
+
+	@staticmethod
+	def format(value):
+		return '%.6fs' % value
+
+	def functions(self, profile):
+		for func, (_, calls, own, cumulative, _) in profile.stats.items():
+			yield func, calls, own, cumulative
+
+class SamplingProfiler(Profiler):
+	"""
+	Profile the tests by sampling the stack of the thread running them every `interval` seconds,
+	from a background thread, and write the samples as collapsed stacks (`frame;frame;... count`),
+	which can be turned into flame graphs.
+	"""
+	NAME  = 'sampling'
+	UNIT  = 'samples'
+	CALLS = 'samples'
+	EXT   = '.collapsed'
+
+	def __init__(self, outdir = PROFILE_DIR, group = 'test', interval = .001):
+		super(SamplingProfiler, self).__init__(outdir, group)
+		self.interval = interval
+		self.samples  = None
+		self.threadId = None
+		self.lock     = threading.Lock()
+		self.thread   = None
+		self.running  = False
+		self.paused   = False
+
+	def _sample(self):
+		while self.running:
+			time.sleep(self.interval)
+			with self.lock:
+				if self.samples is None or self.paused:
+					continue
+				frame = sys._current_frames().get(self.threadId)
+				stack = []
+				while frame is not None:
+					code = frame.f_code
+					stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+					frame = frame.f_back
+				self.samples[tuple(reversed(stack))] += 1
+
+	def start(self, test):
+		if self.thread is None:
+			self.running = True
+			self.thread  = threading.Thread(target = self._sample, name = 'testly-sampling-profiler')
+			self.thread.daemon = True
+			self.thread.start()
+		with self.lock:
+			self.threadId = threading.current_thread().ident
+			self.samples  = Samples()
+			self.paused   = False
+
+	def pause(self):
+		self.paused = True
+
+	def resume(self):
+		self.paused = False
+
+	def collect(self, test):
+		with self.lock:
+			ret = self.samples
+			self.samples = None
+		return ret
+
+	def close(self):
+		super(SamplingProfiler, self).close()
+		if self.thread is not None:
+			self.running = False
+			self.thread.join()
+			self.thread = None
+
+	def functions(self, profile):
+		return profile.functions()
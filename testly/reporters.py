@@ -0,0 +1,132 @@
+"""
+Reporters that write the result of each test to a file as soon as it completes,
+so that the reports of large suites are never held in memory
+"""
+import re, json
+from .cdiff import stripColors
+
+# characters not allowed in xml 1.0
+INVALID_XML_REGEX = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def testInfo(test):
+	"""
+	Get the information of a test as a dict of:
+	id, class, name, set (the name of the test set, None if not of a test set) and
+	row (the index of the test in its test set, None if not of a test set).
+	"""
+	testid = test.id()
+	if hasattr(test, '_testMethodName'):
+		klass = '%s.%s' % (test.__class__.__module__, test.__class__.__name__)
+		name  = test._testMethodName
+	elif ' ' in testid:
+		# error holders, i.e. "setUpClass (module.Class)"
+		klass, name = '', testid
+	else:
+		klass, _, name = testid.rpartition('.')
+	setname = row = None
+	isOfSet = getattr(test, 'isOfSet', None)
+	if isOfSet and isOfSet():
+		setname = test.setName()
+		if test._testlyRow:
+			# generated by a lazy data provider, named as "set-index"
+			row = int(name.rpartition('-')[2])
+		else:
+			row = getattr(test.__class__, setname).index(name)
+	return dict(id = testid, **{'class': klass, 'name': name, 'set': setname, 'row': row})
+
+class Reporter(object):
+	"""
+	The interface of the reporters, which are called by `testly.result.TextTestResult`.
+	The outcome of a test is one of `OUTCOMES`, and the text is the formatted error,
+	the reason of a skip, or None.
+	"""
+	OUTCOMES = ('success', 'failure', 'error', 'skip', 'expectedFailure', 'unexpectedSuccess')
+
+	def startTestRun(self):
+		pass
+
+	def addResult(self, test, outcome, text, wall, cpu):
+		pass
+
+	def stopTestRun(self):
+		pass
+
+class FileReporter(Reporter):
+	"""A reporter writing to a file, opened when the run starts"""
+
+	def __init__(self, path):
+		self.path   = path
+		self.stream = None
+
+	def startTestRun(self):
+		self.stream = open(self.path, 'w')
+
+	def write(self, s):
+		self.stream.write(s)
+		# written as soon as the test completes
+		self.stream.flush()
+
+	def stopTestRun(self):
+		if self.stream:
+			self.stream.close()
+			self.stream = None
+
+class JsonLinesReporter(FileReporter):
+	"""Writes a json object for each test per line"""
+
+	def addResult(self, test, outcome, text, wall, cpu):
+		record = testInfo(test)
+		record.update(outcome = outcome, wall = wall, cpu = cpu,
+			text = stripColors(text) if text else text)
+		self.write(json.dumps(record) + '\n')
+
+class JUnitXmlReporter(FileReporter):
+	"""
+	Writes the results in JUnit xml format, one testcase element at a time.
+	The numbers of the tests, failures, errors and skips, which are not known
+	until the end, are not written as attributes of the testsuite.
+	"""
+
+	def startTestRun(self):
+		super(JUnitXmlReporter, self).startTestRun()
+		self.write('<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n<testsuite name="testly">\n')
+
+	@staticmethod
+	def _text(text):
+		return INVALID_XML_REGEX.sub('', stripColors(text or ''))
+
+	@staticmethod
+	def _message(text):
+		"""The line of the exception in a formatted traceback"""
+		lines = text.splitlines()
+		for line in lines[1:] if lines and lines[0].startswith('Traceback') else lines:
+			if line and not line[0].isspace():
+				return line
+		return ''
+
+	def addResult(self, test, outcome, text, wall, cpu):
+		# saxutils pulls in urllib, only import it when writing xml
+		from xml.sax.saxutils import escape, quoteattr
+		info = testInfo(test)
+		xml  = ['  <testcase classname=%s name=%s time="%.6f">\n' % (
+			quoteattr(info['class']), quoteattr(info['name']), wall)]
+		if info['set'] is not None:
+			xml.append('    <properties>\n')
+			xml.append('      <property name="set" value=%s/>\n' % quoteattr(info['set']))
+			xml.append('      <property name="row" value="%s"/>\n' % info['row'])
+			xml.append('    </properties>\n')
+		text = self._text(text)
+		if outcome in ('failure', 'error'):
+			xml.append('    <%s message=%s>%s</%s>\n' % (
+				outcome, quoteattr(self._message(text)), escape(text), outcome))
+		elif outcome == 'unexpectedSuccess':
+			xml.append('    <failure message="unexpected success"></failure>\n')
+		elif outcome == 'skip':
+			xml.append('    <skipped message=%s></skipped>\n' % quoteattr(text))
+		xml.append('  </testcase>\n')
+		self.write(''.join(xml))
+
+	def stopTestRun(self):
+		if self.stream:
+			self.write('</testsuite>\n</testsuites>\n')
+		super(JUnitXmlReporter, self).stopTestRun()
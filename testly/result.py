@@ -0,0 +1,424 @@
+"""
+Test results that can be recorded in one place (i.e. a worker process)
+and replayed into another result
+"""
+import time, json, heapq, unittest
+from collections import OrderedDict
+
+# CPU time of the process, time.clock for python2
+_cputime = getattr(time, 'process_time', None) or time.clock
+
+class RemoteFailure(AssertionError):
+	"""A failure that has been formatted already, somewhere else"""
+
+class RemoteError(Exception):
+	"""An error that has been formatted already, somewhere else"""
+
+class RemoteTest(object):
+	"""
+	Stand-in for a test that cannot be rebuilt where the results are replayed,
+	i.e. subtests or the error holders of setUpClass/setUpModule
+	"""
+	failureException = AssertionError
+
+	def __init__(self, testid, description):
+		self._testid      = testid
+		self._description = description
+
+	def id(self):
+		return self._testid
+
+	def shortDescription(self):
+		return None
+
+	def __str__(self):
+		return self._description
+
+def _remoteErr(kind, text):
+	exc = RemoteFailure if kind == 'failure' else RemoteError
+	return exc, exc(text), None
+
+def _setName(test):
+	"""The full name of the test set of a test, or None if it is not of a test set"""
+	isOfSet = getattr(test, 'isOfSet', None)
+	if not isOfSet or not isOfSet():
+		return None
+	return '%s.%s' % (test.id().rpartition('.')[0], test.setName())
+
+def _rowLabel(test, maxlen = 40):
+	"""The arguments of the row of a test set, to label its benchmarks"""
+	method = getattr(test, getattr(test, '_testMethodName', ''), None)
+	args, kwargs = getattr(method, 'testlyArgs', None) or ((), {})
+	ret = ', '.join([repr(arg) for arg in args] + ['%s=%r' % item for item in sorted(kwargs.items())])
+	return ret if len(ret) <= maxlen else ret[:maxlen - 3] + '...'
+
+class TimingResult(unittest.TestResult):
+	"""
+	A result that records the wall and CPU time of each test, including its setUp and tearDown,
+	as tuples of (test id, test set name, wall time, CPU time) in `timings`, and of each test set.
+	With `keepTimings` False, only the timing of the last test is kept (in `lastTiming`),
+	and with a number n, only the n slowest tests are kept, so that the memory doesn't grow with the tests.
+	The benchmarks of the tests (see `testly.TestCase.benchmark`) are also collected,
+	as tuples of (benchmark name, test set name, row label, stats) in `benchmarks`.
+	"""
+
+	keepTimings = True
+
+	def __init__(self, stream = None, descriptions = None, verbosity = None):
+		super(TimingResult, self).__init__(stream, descriptions, verbosity)
+		self.timings    = []
+		self.lastTiming = None
+		# test set name -> [number of tests, wall time, CPU time]
+		self.setTimings = OrderedDict()
+		self.benchmarks = []
+		self._slowest   = []
+		self._started   = None
+		self._timing    = None
+
+	def startTest(self, test):
+		super(TimingResult, self).startTest(test)
+		self._timing  = None
+		self._started = time.time(), _cputime()
+
+	def addTiming(self, test, wall, cpu):
+		"""Use the timing of a test measured somewhere else, i.e. in a worker process"""
+		self._timing = wall, cpu
+
+	def addBenchmark(self, test, name, setname, label, stats):
+		self.benchmarks.append((name, setname, label, stats))
+
+	def stopTest(self, test):
+		# popped, so that they are not reported again where a recorded test is replayed
+		for name, stats in getattr(test, '__dict__', {}).pop('_testlyBenchmarks', ()):
+			self.addBenchmark(test, name, _setName(test), _rowLabel(test), stats)
+		if self._timing is None:
+			started      = self._started or (time.time(), _cputime())
+			self._timing = time.time() - started[0], _cputime() - started[1]
+		self.lastTiming = (test.id(), _setName(test)) + self._timing
+		self._keep(self.lastTiming)
+		self._started = self._timing = None
+		super(TimingResult, self).stopTest(test)
+
+	def _keep(self, timing):
+		if self.keepTimings is False:
+			return
+		if self.keepTimings is True:
+			self.timings.append(timing)
+		else:
+			# a min-heap of the slowest ones, ordered by the wall time, then by the order they ran
+			heapq.heappush(self._slowest, (timing[2], -self.testsRun, timing))
+			if len(self._slowest) > self.keepTimings:
+				heapq.heappop(self._slowest)
+		if timing[1] is not None:
+			setTiming = self.setTimings.setdefault(timing[1], [0, 0.0, 0.0])
+			setTiming[0] += 1
+			setTiming[1] += timing[2]
+			setTiming[2] += timing[3]
+
+	def slowestTests(self, n = None):
+		"""The n (all kept if None) slowest timings by wall time"""
+		timings = self.timings if self.keepTimings is True else [item[2] for item in self._slowest]
+		return sorted(timings, key = lambda timing: -timing[2])[:n]
+
+	def slowestSets(self, n = None):
+		"""The n (all if None) slowest test sets as tuples of (name, number of tests, wall time, CPU time)"""
+		return sorted(
+			((name, ) + tuple(timing) for name, timing in self.setTimings.items()),
+			key = lambda timing: -timing[2])[:n]
+
+	def dumpTimings(self, stream):
+		"""Dump the timings as json"""
+		json.dump({
+			'tests': [dict(id = testid, set = setname, wall = wall, cpu = cpu)
+				for testid, setname, wall, cpu in self.timings],
+			'sets' : [dict(name = name, tests = count, wall = wall, cpu = cpu)
+				for name, count, wall, cpu in self.slowestSets()],
+			'benchmarks': [dict(stats, name = name, set = setname, args = label)
+				for name, setname, label, stats in self.benchmarks]
+		}, stream, indent = 1)
+
+class RecordingResult(TimingResult):
+	"""
+	A result that records everything reported to it as plain, picklable data.
+	Each event is a tuple of (method, test id, test description, arguments),
+	which can be replayed later by `replay`.
+	"""
+	# the timings are recorded as the events
+	keepTimings = False
+
+	def __init__(self, stream = None, descriptions = None, verbosity = None):
+		super(RecordingResult, self).__init__(stream, descriptions, verbosity)
+		self.events = []
+
+	def _record(self, method, test, *args):
+		self.events.append((method, test.id(), str(test), args))
+
+	def startTest(self, test):
+		super(RecordingResult, self).startTest(test)
+		self._record('startTest', test)
+
+	def stopTest(self, test):
+		super(RecordingResult, self).stopTest(test)
+		# the wall and CPU time of the test
+		self._record('stopTest', test, *self.lastTiming[2:])
+
+	def addBenchmark(self, test, name, setname, label, stats):
+		super(RecordingResult, self).addBenchmark(test, name, setname, label, stats)
+		self._record('addBenchmark', test, name, setname, label, stats)
+
+	def addSuccess(self, test):
+		super(RecordingResult, self).addSuccess(test)
+		self._record('addSuccess', test)
+
+	def addFailure(self, test, err):
+		super(RecordingResult, self).addFailure(test, err)
+		self._record('addFailure', test, 'failure', self.failures[-1][1])
+
+	def addError(self, test, err):
+		super(RecordingResult, self).addError(test, err)
+		self._record('addError', test, 'error', self.errors[-1][1])
+
+	def addSkip(self, test, reason):
+		super(RecordingResult, self).addSkip(test, reason)
+		self._record('addSkip', test, reason)
+
+	def addExpectedFailure(self, test, err):
+		super(RecordingResult, self).addExpectedFailure(test, err)
+		self._record('addExpectedFailure', test, 'failure', self.expectedFailures[-1][1])
+
+	def addUnexpectedSuccess(self, test):
+		super(RecordingResult, self).addUnexpectedSuccess(test)
+		self._record('addUnexpectedSuccess', test)
+
+	def addSubTest(self, test, subtest, err):
+		super(RecordingResult, self).addSubTest(test, subtest, err)
+		if err is None:
+			return
+		if issubclass(err[0], test.failureException):
+			kind, text = 'failure', self.failures[-1][1]
+		else:
+			kind, text = 'error', self.errors[-1][1]
+		self._record('addSubTest', test, subtest.id(), str(subtest), kind, text)
+
+def replay(events, result, tests = None):
+	"""
+	Replay the events recorded by a `RecordingResult` into result.
+	@params:
+		`events`: The recorded events
+		`result`: The result to replay the events into
+		`tests` : A dict of test id to test for the tests that exist here.
+			Others are replaced by `RemoteTest`.
+	"""
+	if tests is None:
+		tests = {}
+	for method, testid, description, args in events:
+		try:
+			test = tests[testid]
+		except KeyError:
+			test = RemoteTest(testid, description)
+		if method == 'addSubTest':
+			subid, subdesc, kind, text = args
+			result.addSubTest(test, RemoteTest(subid, subdesc), _remoteErr(kind, text))
+		elif method in ('addFailure', 'addError', 'addExpectedFailure'):
+			getattr(result, method)(test, _remoteErr(*args))
+		elif method == 'addBenchmark':
+			if hasattr(result, 'addBenchmark'):
+				result.addBenchmark(test, *args)
+		elif method == 'stopTest':
+			if args and hasattr(result, 'addTiming'):
+				result.addTiming(test, *args)
+			result.stopTest(test)
+		else:
+			getattr(result, method)(test, *args)
+
+class TextTestResult(TimingResult, unittest.TextTestResult):
+	"""
+	The text result used by testly, which knows how to print
+	the results formatted elsewhere, and reports the timings:
+	the `durations` slowest tests and test sets are printed at the end (all of them if 0),
+	and the timings are written to the json file `durationsJson`.
+	The result of each test is also sent to the `reporters` (see `testly.reporters.Reporter`)
+	once the test stops, and each test is profiled by the `profiler` (see `testly.profiler.Profiler`).
+	"""
+	durations     = None
+	durationsJson = None
+	keepTimings   = False
+	reporters     = ()
+	profiler      = None
+
+	def __init__(self, stream, descriptions, verbosity):
+		super(TextTestResult, self).__init__(stream, descriptions, verbosity)
+		self._current = None
+		self._outcome = None
+
+	def _report(self, test, outcome, text = None):
+		if not self.reporters:
+			return
+		if self._current is not test:
+			# not between startTest and stopTest, i.e. errors of setUpClass
+			for reporter in self.reporters:
+				reporter.addResult(test, outcome, text, 0.0, 0.0)
+		elif self._outcome is None or self._outcome[0] == 'success':
+			self._outcome = outcome, text
+		elif text:
+			# failing subtests
+			self._outcome = self._outcome[0], self._outcome[1] + '\n' + text
+
+	def startTest(self, test):
+		super(TextTestResult, self).startTest(test)
+		self._current = test
+		self._outcome = None
+		if self.profiler:
+			self.profiler.start(test)
+
+	def stopTest(self, test):
+		if self.profiler:
+			self.profiler.stop(test)
+		super(TextTestResult, self).stopTest(test)
+		if self.reporters and self._current is test:
+			outcome, text = self._outcome or ('success', None)
+			for reporter in self.reporters:
+				reporter.addResult(test, outcome, text, *self.lastTiming[2:])
+		self._current = self._outcome = None
+
+	def addSuccess(self, test):
+		super(TextTestResult, self).addSuccess(test)
+		self._report(test, 'success')
+
+	def _unprofiled(self, method, *args):
+		"""Call a method of the super class without profiling it, i.e. the formatting of the failures"""
+		if self.profiler:
+			self.profiler.pause()
+		try:
+			getattr(super(TextTestResult, self), method)(*args)
+		finally:
+			if self.profiler:
+				self.profiler.resume()
+
+	def addFailure(self, test, err):
+		self._unprofiled('addFailure', test, err)
+		self._report(test, 'failure', self.failures[-1][1])
+
+	def addError(self, test, err):
+		self._unprofiled('addError', test, err)
+		self._report(test, 'error', self.errors[-1][1])
+
+	def addSkip(self, test, reason):
+		super(TextTestResult, self).addSkip(test, reason)
+		self._report(test, 'skip', reason)
+
+	def addExpectedFailure(self, test, err):
+		self._unprofiled('addExpectedFailure', test, err)
+		self._report(test, 'expectedFailure', self.expectedFailures[-1][1])
+
+	def addUnexpectedSuccess(self, test):
+		super(TextTestResult, self).addUnexpectedSuccess(test)
+		self._report(test, 'unexpectedSuccess')
+
+	def addSubTest(self, test, subtest, err):
+		self._unprofiled('addSubTest', test, subtest, err)
+		if err is None:
+			return
+		if issubclass(err[0], test.failureException):
+			self._report(test, 'failure', self.failures[-1][1])
+		else:
+			self._report(test, 'error', self.errors[-1][1])
+
+	def startTestRun(self):
+		super(TextTestResult, self).startTestRun()
+		for reporter in self.reporters:
+			reporter.startTestRun()
+
+	def _exc_info_to_string(self, err, test):
+		if isinstance(err[1], (RemoteFailure, RemoteError)):
+			return str(err[1])
+		return super(TextTestResult, self)._exc_info_to_string(err, test)
+
+	def stopTestRun(self):
+		super(TextTestResult, self).stopTestRun()
+		for reporter in self.reporters:
+			reporter.stopTestRun()
+		if self.profiler:
+			self.profiler.close()
+		if self.durationsJson:
+			with open(self.durationsJson, 'w') as stream:
+				self.dumpTimings(stream)
+
+	def printErrors(self):
+		super(TextTestResult, self).printErrors()
+		if self.durations is not None:
+			self.printDurations(self.durations or None)
+		if self.benchmarks:
+			self.printBenchmarks()
+		if self.profiler:
+			self.profiler.printHottest(self.stream)
+
+	def printBenchmarks(self):
+		"""
+		Print the stats of the benchmarks. Those of the rows of a test set are printed as
+		a scaling table, with the ratio of the median time of each row to the first one.
+		"""
+		from .benchmark import formatTime
+		self.stream.writeln()
+		self.stream.writeln('Benchmarks:')
+		groups = OrderedDict()
+		for name, setname, label, stats in self.benchmarks:
+			groups.setdefault(setname or name, []).append((label, stats))
+		for group, benchmarks in groups.items():
+			if len(benchmarks) == 1 and not benchmarks[0][0]:
+				stats = benchmarks[0][1]
+				self.stream.writeln('  %s: %s median %s min %s stddev' % (
+					group, formatTime(stats['median']), formatTime(stats['min']), formatTime(stats['stddev'])))
+				continue
+			self.stream.writeln('  %s' % group)
+			first = benchmarks[0][1]['median']
+			for label, stats in benchmarks:
+				self.stream.writeln('    %-40s %10s median %10s min %10s stddev %8.2fx' % (
+					label, formatTime(stats['median']), formatTime(stats['min']),
+					formatTime(stats['stddev']), stats['median'] / first if first else float('inf')))
+		self.stream.flush()
+
+	def printDurations(self, n = None):
+		self.stream.writeln()
+		self.stream.writeln('Slowest tests:')
+		for testid, _, wall, cpu in self.slowestTests(n):
+			self.stream.writeln('%10.3fs wall %10.3fs cpu  %s' % (wall, cpu, testid))
+		sets = self.slowestSets(n)
+		if sets:
+			self.stream.writeln('Slowest test sets:')
+			for name, count, wall, cpu in sets:
+				self.stream.writeln('%10.3fs wall %10.3fs cpu  %s (%s tests)' % (wall, cpu, name, count))
+		self.stream.flush()
+
+class TextTestRunner(unittest.TextTestRunner):
+	"""
+	The text runner used by testly
+	@params:
+		`durations`    : Print the N slowest tests and test sets (all of them if 0)
+		`durationsJson`: Write the timings of the tests to this json file
+		`reporters`    : The reporters of the results, see `testly.reporters`
+		`profiler`     : The profiler of the tests, see `testly.profiler`
+		Others are the same as unittest.TextTestRunner
+	"""
+	resultclass = TextTestResult
+
+	def __init__(self, *args, **kwargs):
+		# not passed to unittest, which reports durations itself since python 3.12
+		self.slowest       = kwargs.pop('durations', None)
+		self.durationsJson = kwargs.pop('durationsJson', None)
+		self.reporters     = kwargs.pop('reporters', None) or []
+		self.profiler      = kwargs.pop('profiler', None)
+		super(TextTestRunner, self).__init__(*args, **kwargs)
+
+	def _makeResult(self):
+		result = super(TextTestRunner, self)._makeResult()
+		result.durations     = self.slowest
+		result.durationsJson = self.durationsJson
+		# the timings of all the tests are only kept to be written or printed
+		if self.durationsJson or self.slowest == 0:
+			result.keepTimings = True
+		else:
+			result.keepTimings = self.slowest or False
+		result.reporters     = self.reporters
+		result.profiler      = self.profiler
+		return result
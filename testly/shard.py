@@ -0,0 +1,105 @@
+"""
+Split the tests across the nodes of a CI, so that each node runs a shard of them,
+balanced by the durations of a previous run
+"""
+import json, heapq, hashlib, unittest
+from collections import OrderedDict
+from .parallel import _flatten
+from .result import _setName
+
+def parseShard(shard):
+	"""
+	Parse a shard given as `INDEX/TOTAL`, where INDEX is from 1 to TOTAL.
+	@returns:
+		A tuple of the 0-based index and the total
+	"""
+	try:
+		index, total = [int(part) for part in shard.split('/')]
+	except ValueError:
+		raise ValueError('Invalid shard, expect INDEX/TOTAL: %r' % shard)
+	if not 1 <= index <= total:
+		raise ValueError('Invalid shard, expect 1 <= INDEX <= TOTAL: %r' % shard)
+	return index - 1, total
+
+def loadDurations(path):
+	"""
+	Load the durations of a previous run, from the json file written by `--durations-json`.
+	@returns:
+		A dict of the wall time of the tests by test id, and of the test sets by their full names
+	"""
+	with open(path) as f:
+		timings = json.load(f)
+	ret = {}
+	for test in timings.get('tests', ()):
+		ret[test['id']] = test['wall']
+	for testset in timings.get('sets', ()):
+		ret[testset['name']] = testset['wall']
+	return ret
+
+def _hash(name, total):
+	# unlike hash(), the same in every process and every version of python
+	return int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16) % total
+
+def units(suite):
+	"""
+	Group the tests into the units that are assigned to the shards: all the rows of a test set
+	go together, so that `setUpSet` runs once and `isFirst()`/`isLast()` still hold,
+	and every other test is a unit of its own.
+	@returns:
+		An OrderedDict of the unit names (the full names of the test sets, or the test ids) to their tests,
+		in the order of the suite
+	"""
+	from . import LazyTestSuite
+	ret = OrderedDict()
+	for test in _flatten(suite):
+		if isinstance(test, LazyTestSuite):
+			name = '%s.%s' % (unittest.util.strclass(test.testCaseClass), test.testset.name)
+		else:
+			name = _setName(test) or test.id()
+		ret.setdefault(name, []).append(test)
+	return ret
+
+def assign(names, total, durations = None):
+	"""
+	Assign the units to the shards. The units with durations are packed by the greedy
+	longest-processing-time rule: from the slowest to the fastest, each one goes to the shard
+	with the least time so far. The units without durations go to the shard given by
+	a stable hash of their names, so that they stay on the same shard as other tests come and go.
+	@params:
+		`names`    : The names of the units
+		`total`    : The number of shards
+		`durations`: The durations of the units by name, see `loadDurations`
+	@returns:
+		A tuple of a dict of the shard index of each unit, and the estimated time of each shard
+	"""
+	durations = durations or {}
+	ret   = {}
+	loads = [0.0] * total
+	heap  = [(0.0, index) for index in range(total)]
+	# ties are broken by the names, so that every node comes up with the same assignment
+	for name in sorted((name for name in names if name in durations), key = lambda name: (-durations[name], name)):
+		load, index = heapq.heappop(heap)
+		ret[name]    = index
+		loads[index] = load + durations[name]
+		heapq.heappush(heap, (loads[index], index))
+	for name in names:
+		if name not in ret:
+			ret[name] = _hash(name, total)
+	return ret, loads
+
+def selectShard(suite, index, total, durations = None):
+	"""
+	Select the tests of a shard.
+	@params:
+		`suite`    : The suite of all the tests, which is the same on every node
+		`index`    : The 0-based index of the shard
+		`total`    : The number of shards
+		`durations`: The durations of a previous run, see `loadDurations`
+	@returns:
+		A tuple of the suite of the tests of the shard, in their order in `suite`,
+		and the estimated time of the shard
+	"""
+	from . import TestSuite
+	groups        = units(suite)
+	shards, loads = assign(list(groups), total, durations)
+	return TestSuite([test for name, tests in groups.items() if shards[name] == index for test in tests]), loads[index]
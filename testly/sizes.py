@@ -0,0 +1,30 @@
+"""
+Sizes of memory and files, given as strings like `'50MB'`
+"""
+import re
+from six import string_types
+
+SIZE_REGEX = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+UNITS      = dict(b = 1, k = 1 << 10, m = 1 << 20, g = 1 << 30, t = 1 << 40)
+
+def parseSize(size):
+	"""
+	Parse a size like `'50MB'`, `'1.5 GiB'` or `'100k'` to bytes, with the units of 1024.
+	Numbers are bytes already.
+	"""
+	if not isinstance(size, string_types):
+		return int(size)
+	matched = SIZE_REGEX.match(size)
+	if not matched:
+		raise ValueError('Invalid size: %r' % size)
+	return int(float(matched.group(1)) * UNITS[matched.group(2).lower() or 'b'])
+
+def formatSize(size):
+	"""Format a size with a unit that fits it"""
+	sign = '-' if size < 0 else ''
+	size = abs(size)
+	for unit in ('B', 'KB', 'MB', 'GB'):
+		if size < 1024 or unit == 'GB':
+			break
+		size /= 1024.0
+	return '%s%.4g%s' % (sign, size, unit)